@@ -0,0 +1,109 @@
+"""Import-time benchmark of the gearbox command line entry point.
+
+Runs ``gearbox --version`` and ``gearbox help`` in fresh interpreters
+under ``python -X importtime`` and reports how long importing took,
+how many modules got imported and whether the heavy dependencies
+(``paste.deploy``, ``hupper``, ...) were loaded at all::
+
+    $ python benchmarks/bench_imports.py --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = {
+    "--version": ["--version"],
+    "help": ["help"],
+}
+
+HEAVY_MODULES = ("paste.deploy", "hupper", "importlib.metadata", "tempita")
+
+RUNNER = """
+import sys
+from gearbox.main import GearBox
+try:
+    GearBox().run(%r)
+except SystemExit:
+    pass
+heavy = [m for m in %r if m in sys.modules]
+sys.stderr.write("GEARBOX-BENCH %%d %%s\\n" %% (len(sys.modules), ",".join(heavy)))
+"""
+
+
+def run_once(argv, env):
+    code = RUNNER % (argv, HEAVY_MODULES)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - start
+
+    import_us = 0
+    modules = 0
+    heavy = []
+    for line in proc.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            cumulative, name = line.split("|")[1:]
+            # Only top level imports, nested ones are part of their cumulative time.
+            if not name.startswith("  ") and cumulative.strip().isdigit():
+                import_us += int(cumulative)
+        elif line.startswith("GEARBOX-BENCH"):
+            _, count, loaded = line.split(" ", 2)
+            modules = int(count)
+            heavy = [m for m in loaded.strip().split(",") if m]
+    return {"wall": wall, "import": import_us / 1e6, "modules": modules, "heavy": heavy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5, help="runs per scenario")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, GEARBOX_CACHE_DIR=cache)
+        for name, argv in SCENARIOS.items():
+            run_once(argv, env)  # Warm up the entry point index and pyc files.
+            runs = [run_once(argv, env) for _ in range(args.runs)]
+            results[name] = {
+                "wall_ms": statistics.median(r["wall"] for r in runs) * 1000,
+                "import_ms": statistics.median(r["import"] for r in runs) * 1000,
+                "modules": runs[-1]["modules"],
+                "heavy_modules": runs[-1]["heavy"],
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(
+        "%-10s %10s %10s %8s  %s"
+        % ("scenario", "wall ms", "import ms", "modules", "heavy")
+    )
+    for name, r in results.items():
+        print(
+            "%-10s %10.1f %10.1f %8d  %s"
+            % (
+                name,
+                r["wall_ms"],
+                r["import_ms"],
+                r["modules"],
+                ", ".join(r["heavy_modules"]) or "-",
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Requests per second of the wsgiref runner with and without keep-alive.
+
+Serves a tiny WSGI application from a separate process with the
+standard ``wsgiref`` request handler, which closes every connection
+after one request, and with ``KeepAliveWSGIRequestHandler``. Clients
+run in threads of this process and either open a connection per
+request, reuse one persistent connection or pipeline batches of
+requests on it::
+
+    $ python benchmarks/bench_keepalive.py --requests 5000 --clients 4
+"""
+
+import argparse
+import http.client
+import multiprocessing
+import socket
+import sys
+import threading
+import time
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from gearbox.utils.wsgiserver import KeepAliveWSGIRequestHandler, ThreadPoolMixIn
+
+BODY = b"Hello World!\n"
+
+
+def app(environ, start_response):
+    start_response(
+        "200 OK", [("Content-Type", "text/plain"), ("Content-Length", str(len(BODY)))]
+    )
+    return [BODY]
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class QuietKeepAliveHandler(KeepAliveWSGIRequestHandler):
+    max_requests = 0
+
+    def log_message(self, *args):
+        pass
+
+
+class PooledServer(ThreadPoolMixIn, WSGIServer):
+    pool_size = 8
+    max_queued = 1024
+    request_queue_size = 1024
+
+
+def serve(handler_class, ready):
+    server = make_server("127.0.0.1", 0, app, PooledServer, handler_class)
+    ready.send(server.server_port)
+    server.serve_forever()
+
+
+def request_per_connection(port, count):
+    for _ in range(count):
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        conn.request("GET", "/")
+        conn.getresponse().read()
+        conn.close()
+
+
+def persistent_connection(port, count):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    for _ in range(count):
+        conn.request("GET", "/")
+        conn.getresponse().read()
+    conn.close()
+
+
+def pipelined_connection(port, count, depth=16):
+    request = b"GET / HTTP/1.1\r\nHost: bench\r\n\r\n"
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        while count > 0:
+            batch = min(depth, count)
+            sock.sendall(request * batch)
+            pending = b""
+            while pending.count(BODY) < batch:
+                pending += sock.recv(65536)
+            count -= batch
+
+
+SCENARIOS = [
+    ("close", QuietHandler, request_per_connection),
+    ("keepalive-close", QuietKeepAliveHandler, request_per_connection),
+    ("keepalive", QuietKeepAliveHandler, persistent_connection),
+    ("pipelined", QuietKeepAliveHandler, pipelined_connection),
+]
+
+
+def run_scenario(handler_class, client, requests, clients):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=serve, args=(handler_class, sender), daemon=True
+    )
+    server.start()
+    try:
+        port = receiver.recv()
+        client(port, 10)  # warm up
+        per_client = requests // clients
+        threads = [
+            threading.Thread(target=client, args=(port, per_client))
+            for _ in range(clients)
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.join()
+    return per_client * clients / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--requests", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=4)
+    args = parser.parse_args()
+
+    multiprocessing.set_start_method("fork")
+    results = {}
+    for name, handler_class, client in SCENARIOS:
+        results[name] = run_scenario(handler_class, client, args.requests, args.clients)
+
+    print("%-16s %12s %8s" % ("scenario", "requests/s", "speedup"))
+    for name, rate in results.items():
+        print("%-16s %12.0f %7.2fx" % (name, rate, rate / results["close"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""Time gearbox patch over a large synthetic tree.
+
+Generates a tree of Python modules where only a fraction of the files
+contain the patched text, then patches copies of it with the line by
+line engine gearbox patch used to rely on, where every line of every
+file is decoded and matched then replaced separately, and with the
+current one, for plain text and regular expressions. Then applies
+``--rules`` rules, half of them regular expressions, one after the other
+as separate ``gearbox patch`` invocations would and in a single pass::
+
+    $ python benchmarks/bench_patch.py --files 5000 --lines 200 --matching 0.01 --rules 40
+"""
+
+import argparse
+import glob
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+from gearbox.commands.patch import (
+    get_matcher,
+    patch_file,
+    patch_file_rules,
+    rules_by_file,
+)
+
+LINE = "    result_%d = compute(value, factor=%d)  # keep in sync\n"
+MATCHING_LINE = "    from tg.decorators import expose  # keep in sync\n"
+
+
+def make_tree(root, files, lines, matching):
+    every = max(int(1 / matching), 1) if matching else files + 1
+    for i in range(files):
+        package = os.path.join(root, "package_%d" % (i // 100))
+        os.makedirs(package, exist_ok=True)
+        body = [LINE % (n, n) for n in range(lines)]
+        if i % every == 0:
+            body[lines // 2] = MATCHING_LINE
+        with open(os.path.join(package, "module_%d.py" % i), "w") as f:
+            f.writelines(body)
+
+
+def line_by_line_patch(filepath, opts):
+    """The engine of gearbox patch before the matching fast paths"""
+    if opts.regex:
+
+        def match(line, text):
+            return re.search(text, line) is not None
+
+        def replace(line, text, replacement):
+            return re.sub(text, replacement, line)
+
+    else:
+
+        def match(line, text):
+            return text in line
+
+        def replace(line, text, replacement):
+            return line.replace(text, replacement)
+
+    matches = False
+    lines = []
+    with open(filepath) as f:
+        for line in f:
+            if not match(line, opts.text):
+                lines.append(line)
+                continue
+            matches = True
+            lines.append(replace(line, opts.text, opts.replacement))
+    if matches:
+        with open(filepath, "w") as f:
+            f.writelines(lines)
+    return matches
+
+
+def run(engine, tree, opts):
+    paths = sorted(
+        os.path.join(dirpath, name)
+        for dirpath, _, names in os.walk(tree)
+        for name in names
+    )
+    get_matcher.cache_clear()
+    started = time.perf_counter()
+    matched = sum(1 for filepath in paths if engine(filepath, opts))
+    return time.perf_counter() - started, len(paths), matched
+
+
+def make_rules(tree, count):
+    rules = []
+    for i in range(count):
+        if i % 2:
+            text, replacement, regex = "tg.decorators", "tg", False
+        else:
+            text, replacement, regex = r"compute_%d\(" % i, "calc(", True
+        rules.append(
+            argparse.Namespace(
+                name="rule %d" % i,
+                pattern=os.path.join(tree, "**", "*.py"),
+                text=text,
+                replacement=replacement,
+                regex=regex,
+                eval=False,
+                addition=None,
+                delete=False,
+                multiline=False,
+            )
+        )
+    return rules
+
+
+def one_rule_at_a_time(rules):
+    for rule in rules:
+        for filepath in glob.iglob(rule.pattern, recursive=True):
+            patch_file(filepath, rule)
+
+
+def all_rules_at_once(rules):
+    for filepath, file_rules in rules_by_file(rules):
+        patch_file_rules(filepath, file_rules)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--lines", type=int, default=200)
+    parser.add_argument(
+        "--matching", type=float, default=0.01, help="Fraction of matching files"
+    )
+    parser.add_argument("--rules", type=int, default=40)
+    args = parser.parse_args()
+
+    cases = [
+        ("plain", "tg.decorators", "tg", False),
+        ("regex", r"from tg\.(\w+) import", r"from tg import", True),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source")
+        make_tree(source, args.files, args.lines, args.matching)
+
+        print(
+            "%-8s %-14s %10s %12s %9s"
+            % ("text", "engine", "seconds", "files/s", "matched")
+        )
+        for label, text, replacement, regex in cases:
+            opts = argparse.Namespace(
+                text=text,
+                replacement=replacement,
+                regex=regex,
+                eval=False,
+                addition=None,
+                delete=False,
+                multiline=False,
+            )
+            for name, engine in (
+                ("line-by-line", line_by_line_patch),
+                ("gearbox", patch_file),
+            ):
+                tree = os.path.join(tmp, "%s-%s" % (label, name))
+                shutil.copytree(source, tree)
+                elapsed, files, matched = run(engine, tree, opts)
+                print(
+                    "%-8s %-14s %10.3f %12.0f %9d"
+                    % (label, name, elapsed, files / elapsed, matched)
+                )
+                shutil.rmtree(tree)
+
+        label = "%d rules" % args.rules
+        for name, engine in (
+            ("one-by-one", one_rule_at_a_time),
+            ("single pass", all_rules_at_once),
+        ):
+            tree = os.path.join(tmp, "rules-%s" % name.replace(" ", "-"))
+            shutil.copytree(source, tree)
+            get_matcher.cache_clear()
+            started = time.perf_counter()
+            engine(make_rules(tree, args.rules))
+            elapsed = time.perf_counter() - started
+            print(
+                "%-8s %-14s %10.3f %12.0f %9s"
+                % (label, name, elapsed, args.files / elapsed, "-")
+            )
+            shutil.rmtree(tree)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
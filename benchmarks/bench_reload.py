@@ -0,0 +1,163 @@
+"""Time from a source change to the reloaded application answering.
+
+Generates a project whose application imports a large third-party
+package, then runs ``gearbox serve --reload`` on it with the default
+``restart`` mode, where each reload starts the whole command again, and
+with ``--reload-mode zygote``, where each reload forks from a process
+that already imported the third-party package::
+
+    $ python benchmarks/bench_reload.py --modules 200 --reloads 5
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+import urllib.request
+
+APP = """\
+import heavylib
+
+VERSION = %d
+
+
+def factory(global_conf, **local_conf):
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [str(VERSION).encode("ascii")]
+
+    return app
+"""
+
+CONFIG = """\
+[server:main]
+use = egg:gearbox#wsgiref
+host = 127.0.0.1
+port = %d
+
+[app:main]
+use = call:app:factory
+"""
+
+
+def make_heavy_package(site_dir, modules, functions):
+    package = os.path.join(site_dir, "heavylib")
+    os.makedirs(package)
+    body = "".join(
+        textwrap.dedent(
+            """
+            def function_%d(value, factor=2):
+                return [item * factor for item in range(value)]
+            """
+        )
+        % i
+        for i in range(functions)
+    )
+    for i in range(modules):
+        with open(os.path.join(package, "module_%d.py" % i), "w") as f:
+            f.write(body)
+    with open(os.path.join(package, "__init__.py"), "w") as f:
+        for i in range(modules):
+            f.write("from . import module_%d\n" % i)
+
+
+def fetch(port):
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:%d/" % port, timeout=1) as r:
+            return int(r.read())
+    except (OSError, ValueError):
+        return None
+
+
+def wait_for_version(port, version, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if fetch(port) == version:
+            return
+        time.sleep(0.01)
+    raise RuntimeError("Server never answered with version %d" % version)
+
+
+def run_mode(project_dir, env, port, mode, reloads, interval):
+    app_file = os.path.join(project_dir, "app.py")
+    with open(app_file, "w") as f:
+        f.write(APP % 0)
+    command = [
+        shutil.which("gearbox"),
+        "serve",
+        "-c",
+        "development.ini",
+        "--reload",
+        "--reload-interval",
+        str(interval),
+        "--reload-mode",
+        mode,
+    ]
+    server = subprocess.Popen(
+        command,
+        cwd=project_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    timings = []
+    try:
+        started = time.monotonic()
+        wait_for_version(port, 0)
+        first = time.monotonic() - started
+        for version in range(1, reloads + 1):
+            # Let the file monitor settle, and the mtime change.
+            time.sleep(max(interval * 2, 1))
+            with open(app_file, "w") as f:
+                f.write(APP % version)
+            changed = time.monotonic()
+            wait_for_version(port, version)
+            timings.append(time.monotonic() - changed)
+    finally:
+        server.terminate()
+        server.wait()
+    return first, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--modules", type=int, default=200)
+    parser.add_argument("--functions", type=int, default=200)
+    parser.add_argument("--reloads", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.1)
+    parser.add_argument("--port", type=int, default=18765)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        site_dir = os.path.join(tmp, "site-packages")
+        project_dir = os.path.join(tmp, "project")
+        os.makedirs(project_dir)
+        make_heavy_package(site_dir, args.modules, args.functions)
+        with open(os.path.join(project_dir, "development.ini"), "w") as f:
+            f.write(CONFIG % args.port)
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join([project_dir, site_dir]),
+        )
+        # Compile the package once, like an installed one would be.
+        subprocess.check_call([sys.executable, "-c", "import heavylib"], env=env)
+
+        print("%-10s %12s %12s %12s" % ("mode", "startup s", "median s", "max s"))
+        for mode in ("restart", "zygote"):
+            first, timings = run_mode(
+                project_dir, env, args.port, mode, args.reloads, args.interval
+            )
+            print(
+                "%-10s %12.3f %12.3f %12.3f"
+                % (mode, first, statistics.median(timings), max(timings))
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Throughput and server CPU time of multi-MB file responses.
+
+Serves a large file from a separate process through the wsgiref
+runner handler, either with ``wsgiref.util.FileWrapper`` (the file is
+read into Python and written back in blocks, as before gearbox had its
+own ``wsgi.file_wrapper``) or with ``gearbox.utils.wsgiserver.FileWrapper``
+sent through ``os.sendfile``. The asyncio server is measured too::
+
+    $ python benchmarks/bench_sendfile.py --size-mb 64 --downloads 20
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import wsgiref.util
+from wsgiref.simple_server import WSGIServer, make_server
+
+from gearbox.utils.aioserver import AsyncioWSGIServer
+from gearbox.utils.wsgiserver import KeepAliveWSGIRequestHandler
+
+
+class QuietHandler(KeepAliveWSGIRequestHandler):
+    max_requests = 0
+
+    def log_message(self, *args):
+        pass
+
+
+def make_app(path, wrapper):
+    def app(environ, start_response):
+        if environ["PATH_INFO"] == "/cpu":
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            body = json.dumps(usage.ru_utime + usage.ru_stime).encode("ascii")
+            start_response("200 OK", [("Content-Length", str(len(body)))])
+            return [body]
+        start_response("200 OK", [("Content-Type", "application/octet-stream")])
+        file_wrapper = wrapper or environ["wsgi.file_wrapper"]
+        return file_wrapper(open(path, "rb"), 65536)
+
+    return app
+
+
+def serve(server_type, path, wrapper, ready):
+    app = make_app(path, wrapper)
+    if server_type == "asyncio":
+        server = AsyncioWSGIServer(app, "127.0.0.1", 0, threads=4)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        server.started.wait()
+        ready.send(server.server_port)
+        threading.Event().wait()
+    else:
+        server = make_server("127.0.0.1", 0, app, WSGIServer, QuietHandler)
+        ready.send(server.server_port)
+        server.serve_forever()
+
+
+def server_cpu(conn):
+    conn.request("GET", "/cpu")
+    return json.loads(conn.getresponse().read())
+
+
+def run_scenario(server_type, path, wrapper, downloads):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    server = multiprocessing.Process(
+        target=serve, args=(server_type, path, wrapper, sender), daemon=True
+    )
+    server.start()
+    try:
+        port = receiver.recv()
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        cpu_before = server_cpu(conn)
+        received = 0
+        start = time.perf_counter()
+        for _ in range(downloads):
+            conn.request("GET", "/")
+            response = conn.getresponse()
+            while chunk := response.read(1 << 20):
+                received += len(chunk)
+        elapsed = time.perf_counter() - start
+        cpu = server_cpu(conn) - cpu_before
+        conn.close()
+    finally:
+        server.terminate()
+        server.join()
+    return {
+        "mb_per_s": received / elapsed / (1 << 20),
+        "server_cpu_ms_per_mb": cpu * 1000 / (received / (1 << 20)),
+    }
+
+
+SCENARIOS = [
+    ("wsgiref read+write", "wsgiref", wsgiref.util.FileWrapper),
+    ("wsgiref sendfile", "wsgiref", None),
+    ("asyncio sendfile", "asyncio", None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--downloads", type=int, default=20)
+    args = parser.parse_args()
+
+    multiprocessing.set_start_method("fork")
+    with tempfile.NamedTemporaryFile() as f:
+        f.write(os.urandom(1 << 20) * args.size_mb)
+        f.flush()
+        print("%-20s %10s %16s" % ("scenario", "MB/s", "server CPU ms/MB"))
+        for name, server_type, wrapper in SCENARIOS:
+            result = run_scenario(server_type, f.name, wrapper, args.downloads)
+            print(
+                "%-20s %10.0f %16.3f"
+                % (name, result["mb_per_s"], result["server_cpu_ms_per_mb"])
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""Startup benchmark of the gearbox command line entry point.
+
+Measures wall time, peak RSS and the number of imported modules of
+``GearBox().run(argv)`` for the most common invocations. Each scenario
+runs in fresh interpreters both *cold* (empty gearbox cache, so the
+entry point index has to be built) and *warm* (index already on disk).
+
+Large environments are modelled by putting hundreds of synthetic
+``.dist-info`` directories on ``sys.path``. Results are printed as a
+table or written as JSON, and can be compared against a stored
+baseline to catch regressions::
+
+    $ python benchmarks/bench_startup.py --output results.json
+    $ python benchmarks/bench_startup.py --baseline benchmarks/baseline.json
+    $ python benchmarks/bench_startup.py --save-baseline benchmarks/baseline.json
+
+The baseline is machine specific, regenerate it when moving to
+different hardware.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = {
+    "help": ["help"],
+    "version": ["--version"],
+    "serve-help": ["serve", "--help"],
+    "scaffold-dry-run": ["scaffold", "model", "Sample", "--dry-run"],
+}
+
+# Allowed relative growth of the timings and absolute growth of the
+# imported modules before a result is considered a regression.
+DEFAULT_TOLERANCE = 0.25
+MODULES_TOLERANCE = 5
+
+RUNNER = """
+import json, os, resource, sys
+from gearbox.main import GearBox
+try:
+    status = GearBox().run(%r)
+except SystemExit as e:
+    status = e.code
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == "darwin":
+    rss //= 1024
+result = {"status": status, "modules": len(sys.modules), "rss_kb": rss}
+os.write(%d, json.dumps(result).encode("ascii"))
+"""
+
+
+def make_environment(root, num_dists):
+    """Create a site dir with ``num_dists`` stub distributions and a project"""
+    site_dir = os.path.join(root, "site-packages")
+    os.makedirs(site_dir)
+    for i in range(num_dists):
+        name = "fakedist%04d" % i
+        dist_info = os.path.join(site_dir, "%s-1.0.dist-info" % name)
+        os.mkdir(dist_info)
+        with open(os.path.join(dist_info, "METADATA"), "w") as f:
+            f.write("Metadata-Version: 2.1\nName: %s\nVersion: 1.0\n" % name)
+        with open(os.path.join(dist_info, "RECORD"), "w") as f:
+            f.write("%s/__init__.py,,\n" % name)
+        if i % 3 == 0:
+            # Most distributions have entry points, only for other tools.
+            with open(os.path.join(dist_info, "entry_points.txt"), "w") as f:
+                f.write("[console_scripts]\n%s = %s:main\n" % (name, name))
+
+    project_dir = os.path.join(root, "project")
+    scaffold_dir = os.path.join(project_dir, "scaffolds")
+    os.makedirs(scaffold_dir)
+    with open(os.path.join(scaffold_dir, "model.py.template"), "w") as f:
+        f.write("class {{target}}:\n    pass\n")
+
+    # Backdate everything, so that the index trusts the stamps.
+    past = time.time() - 3600
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        for name in filenames + dirnames:
+            os.utime(os.path.join(dirpath, name), (past, past))
+        os.utime(dirpath, (past, past))
+    return site_dir, project_dir
+
+
+def run_once(argv, env, cwd):
+    read_fd, write_fd = os.pipe()
+    code = RUNNER % (argv, write_fd)
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code],
+        env=env,
+        cwd=cwd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        pass_fds=(write_fd,),
+    )
+    os.close(write_fd)
+    with os.fdopen(read_fd, "rb") as f:
+        output = f.read()
+    proc.wait()
+    wall = time.perf_counter() - start
+    if not output:
+        raise RuntimeError("gearbox %s crashed" % " ".join(argv))
+    result = json.loads(output)
+    result["wall_ms"] = wall * 1000
+    return result
+
+
+def summarize(runs):
+    return {
+        "wall_ms": statistics.median(r["wall_ms"] for r in runs),
+        "wall_ms_min": min(r["wall_ms"] for r in runs),
+        "rss_kb": max(r["rss_kb"] for r in runs),
+        "modules": max(r["modules"] for r in runs),
+        "status": runs[-1]["status"],
+    }
+
+
+def run_benchmarks(num_dists, runs):
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        site_dir, project_dir = make_environment(root, num_dists)
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            p for p in (site_dir, env.get("PYTHONPATH")) if p
+        )
+        for name, argv in SCENARIOS.items():
+            cold = []
+            for i in range(runs):
+                env["GEARBOX_CACHE_DIR"] = os.path.join(
+                    root, "cold-cache-%s-%d" % (name, i)
+                )
+                cold.append(run_once(argv, env, project_dir))
+
+            env["GEARBOX_CACHE_DIR"] = os.path.join(root, "warm-cache")
+            run_once(argv, env, project_dir)
+            warm = [run_once(argv, env, project_dir) for _ in range(runs)]
+
+            results[name] = {"cold": summarize(cold), "warm": summarize(warm)}
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "distributions": num_dists,
+        "runs": runs,
+        "scenarios": results,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of ``results`` compared to ``baseline``, as messages"""
+    regressions = []
+    for name, modes in results["scenarios"].items():
+        for mode, current in modes.items():
+            previous = baseline.get("scenarios", {}).get(name, {}).get(mode)
+            if previous is None:
+                continue
+            for key in ("wall_ms", "rss_kb"):
+                limit = previous[key] * (1 + tolerance)
+                if current[key] > limit:
+                    regressions.append(
+                        "%s/%s %s: %.1f > %.1f (baseline %.1f)"
+                        % (name, mode, key, current[key], limit, previous[key])
+                    )
+            if current["modules"] > previous["modules"] + MODULES_TOLERANCE:
+                regressions.append(
+                    "%s/%s modules: %d > %d"
+                    % (name, mode, current["modules"], previous["modules"])
+                )
+    return regressions
+
+
+def print_table(results):
+    print(
+        "%-18s %-5s %10s %10s %10s %8s"
+        % ("scenario", "mode", "wall ms", "min ms", "rss KB", "modules")
+    )
+    for name, modes in results["scenarios"].items():
+        for mode, r in modes.items():
+            print(
+                "%-18s %-5s %10.1f %10.1f %10d %8d"
+                % (
+                    name,
+                    mode,
+                    r["wall_ms"],
+                    r["wall_ms_min"],
+                    r["rss_kb"],
+                    r["modules"],
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--dists", type=int, default=600, help="number of fake distributions"
+    )
+    parser.add_argument("--runs", type=int, default=5, help="runs per scenario")
+    parser.add_argument("--output", help="write the results as JSON to OUTPUT")
+    parser.add_argument("--baseline", help="compare results against BASELINE")
+    parser.add_argument(
+        "--save-baseline", metavar="BASELINE", help="store results as new BASELINE"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="allowed relative regression (default %(default)s)",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.dists, args.runs)
+    print_table(results)
+
+    for filename in (args.output, args.save_baseline):
+        if filename:
+            with open(filename, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+                f.write("\n")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions against %s:" % args.baseline)
+            for regression in regressions:
+                print("  " + regression)
+            return 1
+        print("\nNo regressions against %s" % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Time looking up files in a large synthetic project tree.
+
+Generates a project where the sources are a small fraction of the files,
+most of them being in ``node_modules``, ``.git``, ``.venv``, ``build``
+and ``__pycache__`` directories, then expands ``**/*.py`` with
+:func:`glob.glob`, as ``gearbox patch`` used to, and with
+:func:`gearbox.utils.walk.glob_files`, and looks up a scaffold template
+with a full :func:`os.walk`, as ``gearbox scaffold`` used to, and with
+:func:`gearbox.utils.walk.walk_files`::
+
+    $ python benchmarks/bench_walk.py --sources 2000 --vendored 50000
+"""
+
+import argparse
+import glob
+import os
+import sys
+import tempfile
+import time
+
+from gearbox.utils.walk import glob_files, walk_files
+
+VENDORED_DIRECTORIES = (
+    ("node_modules", ".js"),
+    (".git/objects", ""),
+    (".venv/lib/site-packages", ".py"),
+    ("build/lib", ".py"),
+)
+
+
+def make_tree(root, sources, vendored):
+    def touch(dirpath, name):
+        os.makedirs(dirpath, exist_ok=True)
+        with open(os.path.join(dirpath, name), "w") as f:
+            f.write("# generated\n")
+
+    for i in range(sources):
+        package = os.path.join(root, "project", "package_%d" % (i // 50))
+        touch(package, "module_%d.py" % i)
+        touch(os.path.join(package, "__pycache__"), "module_%d.cpython.pyc" % i)
+    touch(os.path.join(root, "project", "templates"), "controller.py.template")
+    per_directory = vendored // len(VENDORED_DIRECTORIES)
+    for top, ext in VENDORED_DIRECTORIES:
+        for i in range(per_directory):
+            dirpath = os.path.join(root, top, "package_%d" % (i // 50))
+            touch(dirpath, "file_%d%s" % (i, ext))
+
+
+def os_walk_lookup(template):
+    found = None
+    for root, __, files in os.walk("."):
+        for f in files:
+            fname, fext = os.path.splitext(f)
+            if fext == ".template" and os.path.splitext(fname)[0] == template:
+                found = os.path.join(root, f)
+    return found
+
+
+def walk_files_lookup(template):
+    for relpath in walk_files("."):
+        fname, fext = os.path.splitext(os.path.basename(relpath))
+        if fext == ".template" and os.path.splitext(fname)[0] == template:
+            return relpath
+    return None
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sources", type=int, default=2000)
+    parser.add_argument("--vendored", type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        make_tree(tmp, args.sources, args.vendored)
+        os.chdir(tmp)
+
+        print("%-10s %-12s %10s %9s" % ("lookup", "walker", "seconds", "found"))
+        for name, function in (
+            ("glob", lambda: glob.glob("**/*.py", recursive=True)),
+            ("glob_files", lambda: list(glob_files("**/*.py"))),
+        ):
+            elapsed, found = timed(function)
+            print("%-10s %-12s %10.3f %9d" % ("patch", name, elapsed, len(found)))
+        for name, function in (
+            ("os.walk", os_walk_lookup),
+            ("walk_files", walk_files_lookup),
+        ):
+            elapsed, found = timed(function, "controller")
+            print("%-10s %-12s %10.3f %9d" % ("scaffold", name, elapsed, bool(found)))
+        os.chdir(os.path.dirname(tmp))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,20 @@
 import argparse
-import inspect
 import os
 import sys
 
 from .template import GearBoxTemplate
+from .utils.lazy import lazy_import
+
+inspect = lazy_import("inspect")
 
 
 class Command:
     deprecated = False
 
+    #: One line description shown by ``gearbox help``, when provided
+    #: the command is listed without being instantiated.
+    summary = None
+
     def __init__(self, app, app_args, cmd_name=None):
         self.app = app
         self.app_args = app_args
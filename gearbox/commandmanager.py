@@ -4,9 +4,10 @@
 This comes from OpenStack cliff.
 """
 
-import importlib.metadata
 import logging
 
+from .utils.plugins import entry_points
+
 LOG = logging.getLogger(__name__)
 
 
@@ -39,7 +40,7 @@ class CommandManager:
 
     def load_commands(self, namespace):
         """Load all the commands from an entrypoint"""
-        for ep in importlib.metadata.entry_points().select(group=namespace):
+        for ep in entry_points(namespace):
             LOG.debug("found command %r", ep.name)
             cmd_name = (
                 ep.name.replace("_", " ") if self.convert_underscores else ep.name
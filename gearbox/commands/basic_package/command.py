@@ -4,10 +4,12 @@ from gearbox.command import TemplateCommand
 
 
 class MakePackageCommand(TemplateCommand):
+    summary = "Creates a basic python package"
+
     CLEAN_PACKAGE_NAME_RE = re.compile("[^a-zA-Z0-9_]")
 
     def get_description(self):
-        return "Creates a basic python package"
+        return self.summary
 
     def get_parser(self, prog_name):
         parser = super().get_parser(prog_name)
@@ -27,6 +27,11 @@ class HelpAction(argparse.Action):
                 if namespace.debug:
                     traceback.print_exc(file=sys.stdout)
                 continue
+            summary = getattr(factory, "summary", None)
+            if isinstance(summary, str):
+                if getattr(factory, "deprecated", False) is not True:
+                    print("  %-13s  %s" % (name, summary))
+                continue
             try:
                 cmd = factory(app, None)
                 if cmd.deprecated:
@@ -44,6 +49,8 @@ class HelpAction(argparse.Action):
 class HelpCommand(Command):
     """print detailed help for another command"""
 
+    summary = "print detailed help for another command"
+
     def get_parser(self, prog_name):
         parser = super().get_parser(prog_name)
         parser.add_argument(
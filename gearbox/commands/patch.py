@@ -1,11 +1,77 @@
-import glob
+import codecs
+import contextlib
+import functools
+import io
+import locale
+import os
 import re
-from argparse import RawDescriptionHelpFormatter
+import sys
+from argparse import ArgumentParser, Namespace, RawDescriptionHelpFormatter
 
 from gearbox.command import Command
+from gearbox.utils.lazy import lazy_import
+
+configparser = lazy_import("configparser")
+futures = lazy_import("concurrent.futures")
+mmap = lazy_import("mmap")
+shutil = lazy_import("shutil")
+tempfile = lazy_import("tempfile")
+# tomllib is only in the standard library since Python 3.11.
+tomllib = lazy_import("tomllib" if sys.version_info >= (3, 11) else "tomli")
+glob_files = lazy_import("gearbox.utils.walk", "glob_files")
+
+# Files patched by a pool worker per task, when patching in parallel.
+PATCH_BATCH_SIZE = 64
+
+#: Size, in bytes, from which files are patched without being loaded in
+#: memory.
+STREAM_THRESHOLD = 64 * 2**20
+
+#: Size, in bytes, of the chunks streamed files are processed by.
+STREAM_CHUNK_SIZE = 2**20
+
+# ASCII compatible encodings, where a text is found in the encoded bytes
+# only where it is in the decoded text.
+_SEARCHABLE_ENCODINGS = ("utf-8", "ascii", "iso8859-1", "iso8859-15", "cp1252")
+
+# Constructs of a regular expression that could match at the start or
+# end of a line, but not at the same place within the whole content.
+_CROSS_LINE_UNSAFE_RE = re.compile(r"\\[AZ]|\(\?<!")
+
+# Constructs of a regular expression that change meaning when combined
+# with others in an alternation: backreferences and global flags.
+_UNCOMBINABLE_RE = re.compile(r"\\\d|\(\?P=|\(\?[aiLmsux]+\)")
+
+# Options of the rules of a --rules file, and the options of the
+# command they stand for.
+_RULE_OPTIONS = {
+    "pattern": "pattern",
+    "text": "text",
+    "replace": "replacement",
+    "append": "addition",
+    "delete": "delete",
+    "regex": "regex",
+    "eval": "eval",
+    "multiline": "multiline",
+}
+_RULE_FLAGS = ("delete", "regex", "eval", "multiline")
+
+
+class IntermixedArgumentParser(ArgumentParser):
+    """Parser accepting options between optional positional arguments.
+
+    ``ArgumentParser`` gives up on optional positional arguments as soon
+    as an option follows the first one, so ``gearbox patch '*.py' -x
+    text`` would not set the text.
+    """
+
+    def parse_args(self, args=None, namespace=None):
+        return self.parse_intermixed_args(args, namespace)
 
 
 class PatchCommand(Command):
+    summary = "Patches files by replacing, appending or deleting text."
+
     def get_description(self):
         return r"""Patches files by replacing, appending or deleting text.
 
@@ -22,20 +88,65 @@ replacements, like updating the Copyright year in your documentation:
 
     $ gearbox patch '**/*.rst' -x 'Copyright(\s*)(\d+)' -e -r '"Copyright\\g<1>"+__import__("datetime").datetime.utcnow().strftime("%Y")'
 
-Works on a line by line basis, so it is not possible to match text
-across multiple lines.
+Works on a line by line basis, unless --multiline is given: the text
+is then looked up in the whole content of the files, where regular
+expressions are matched with re.MULTILINE and re.DOTALL, and lines
+touched by a match are appended after or deleted:
+
+    $ gearbox patch '**/*.py' -m -x 'import (\w+)\nimport (\w+)\n' -r 'import \1, \2\n'
+
+Many patches can be applied in a single pass over the tree, each file
+being read and written once, from a --rules file listing them in order.
+In ini files each section is a rule, in TOML files each [[rule]] table,
+with the long names of the options as keys:
+
+    [decorators]
+    pattern = **/*.py
+    text = tg.decorators
+    replace = tg
+
+    $ gearbox patch --rules upgrade.ini
+
+Recursive patterns, using **, don't look into version control, build,
+cache and virtualenv directories, like .git, build, __pycache__,
+node_modules or .venv, nor into the files ignored by .gitignore files.
+More can be excluded with --exclude, --no-ignore looks everywhere:
+
+    $ gearbox patch --exclude 'migrations/' '**/*.py' 'tg.decorators' -r 'tg'
+
+Large trees can be patched from multiple processes with -j:
+
+    $ gearbox patch -j 0 '**/*.py' 'from tg import expose' -r 'from tg import expose, redirect'
 """
 
     def get_parser(self, prog_name):
-        parser = super().get_parser(prog_name)
-        parser.formatter_class = RawDescriptionHelpFormatter
+        parser = IntermixedArgumentParser(
+            description=self.get_description(),
+            prog=prog_name,
+            add_help=False,
+            formatter_class=RawDescriptionHelpFormatter,
+        )
 
         parser.add_argument(
-            "pattern", help="The glob pattern of files that should be matched"
+            "pattern",
+            nargs="?",
+            help="The glob pattern of files that should be matched",
         )
 
         parser.add_argument(
-            "text", help="text that should be looked up in matched files."
+            "text",
+            nargs="?",
+            help="text that should be looked up in matched files.",
+        )
+
+        parser.add_argument(
+            "--rules",
+            dest="rules",
+            metavar="FILE",
+            help=(
+                "Apply the rules of the ini or TOML FILE, in a single pass, "
+                "instead of the pattern and text."
+            ),
         )
 
         parser.add_argument(
@@ -72,63 +183,693 @@ across multiple lines.
             help="Eval the replacement as Python code before applying it.",
         )
 
-        return parser
+        parser.add_argument(
+            "-m",
+            "--multiline",
+            dest="multiline",
+            action="store_true",
+            help=(
+                "Match the text across lines, in the whole content of files. "
+                "The lines of each match are reported."
+            ),
+        )
 
-    def take_action(self, opts):
-        match = self._match_plain
-        if opts.regex:
-            match = self._match_regex
-
-        replace = self._replace_plain
-        if opts.regex:
-            replace = self._replace_regex
-
-        matches = []
-        for filepath in glob.glob(opts.pattern, recursive=True):
-            matches.append(filepath)
-
-        print("%s files matching" % len(matches))
-        for filepath in matches:
-            replacement = opts.replacement
-            if opts.eval and replacement:
-                replacement = str(eval(replacement, globals()))
-
-            addition = opts.addition
-            if opts.eval and addition:
-                addition = str(eval(addition, globals()))
-
-            matches = False
-            lines = []
-            with open(filepath) as f:
-                for line in f:
-                    if not match(line, opts.text):
-                        lines.append(line)
-                        continue
-
-                    matches = True
-                    empty_line = not line.strip()
-                    if opts.replacement:
-                        line = replace(line, opts.text, replacement)
-
-                    if empty_line or line.strip() and not opts.delete:
-                        lines.append(line)
-
-                    if opts.addition:
-                        lines.append(addition + "\n")
-
-            print("%s Patching %s" % (matches and "!" or "x", filepath))
-            if matches:
-                with open(filepath, "w") as f:
-                    f.writelines(lines)
+        parser.add_argument(
+            "--exclude",
+            dest="exclude",
+            action="append",
+            default=[],
+            metavar="PATTERN",
+            help=(
+                "Skip the files and directories matching PATTERN, in the "
+                ".gitignore syntax, when matching recursive patterns."
+            ),
+        )
 
-    def _replace_regex(self, line, text, replacement):
-        return re.sub(text, replacement, line)
+        parser.add_argument(
+            "--no-ignore",
+            dest="ignore",
+            action="store_false",
+            help=(
+                "Look into the directories usually skipped by recursive "
+                "patterns, and into the files ignored by .gitignore files."
+            ),
+        )
 
-    def _replace_plain(self, line, text, replacement):
-        return line.replace(text, replacement)
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            dest="jobs",
+            type=int,
+            default=1,
+            metavar="N",
+            help=(
+                "Patch files from N processes, 0 for one per CPU. Files are "
+                "still reported in the order they were matched."
+            ),
+        )
 
-    def _match_regex(self, line, text):
-        return re.search(text, line) is not None
+        return parser
 
-    def _match_plain(self, line, text):
-        return text in line
+    def take_action(self, opts):
+        jobs = opts.jobs if opts.jobs > 0 else os.cpu_count() or 1
+        if opts.rules:
+            try:
+                rules = load_rules(opts.rules)
+            except (OSError, ValueError) as e:
+                print("Error: %s" % e)
+                return 2
+            patch = patch_file_rules
+            tasks = rules_by_file(rules, opts.exclude, opts.ignore)
+        elif opts.pattern is None or opts.text is None:
+            print("Error: a pattern and a text are required, unless --rules is used")
+            return 2
+        else:
+            paths = glob_files(opts.pattern, opts.exclude, opts.ignore)
+            patch, tasks = patch_file, ((filepath, opts) for filepath in paths)
+
+        if jobs == 1:
+            tasks = list(tasks)
+            results = (patch(filepath, arg) for filepath, arg in tasks)
+        else:
+            tasks, results = self._patch_in_pool(patch, tasks, jobs)
+
+        print("%s files matching" % len(tasks))
+        for (filepath, _), matched in zip(tasks, results):
+            details = ""
+            if matched and opts.rules:
+                details = " (%s)" % ", ".join(matched)
+            elif matched and opts.multiline:
+                details = " (lines %s)" % ", ".join(
+                    "%d-%d" % span if span[0] != span[1] else "%d" % span[0]
+                    for span in matched
+                )
+            print("%s Patching %s%s" % (matched and "!" or "x", filepath, details))
+
+    def _patch_in_pool(self, patch, tasks, jobs):
+        """Run ``patch(filepath, arg)`` for ``tasks`` in ``jobs`` processes.
+
+        Tasks are sent to the pool in batches while the glob is still
+        being expanded. Returns the tasks and an iterator over their
+        results, in the same order.
+        """
+        pool = futures.ProcessPoolExecutor(jobs)
+        pending = []
+        batches = []
+        for task in tasks:
+            pending.append(task)
+            if len(pending) % PATCH_BATCH_SIZE == 0:
+                batches.append(
+                    pool.submit(patch_files, patch, pending[-PATCH_BATCH_SIZE:])
+                )
+        remaining = len(pending) % PATCH_BATCH_SIZE
+        if remaining:
+            batches.append(pool.submit(patch_files, patch, pending[-remaining:]))
+
+        def results():
+            with pool:
+                for batch in batches:
+                    yield from batch.result()
+
+        return pending, results()
+
+
+def patch_files(patch, tasks):
+    """``patch(filepath, arg)`` for each of ``tasks``, as a batch run by a
+    pool worker.
+    """
+    return [patch(filepath, arg) for filepath, arg in tasks]
+
+
+def load_rules(filename):
+    """Rules of the ``--rules`` file ``filename``, in order.
+
+    ``.toml`` files list them as ``[[rule]]`` tables, optionally named
+    by a ``name`` key, other files are read as ini files with a section
+    per rule. Both use the long names of the options of ``gearbox
+    patch``: ``pattern``, ``text``, ``replace``, ``append``, ``delete``,
+    ``regex``, ``eval`` and ``multiline``. Rules are namespaces like the
+    command options, with a ``name``.
+    """
+    entries = []
+    if filename.endswith(".toml"):
+        try:
+            load = tomllib.load
+        except ImportError:
+            raise ValueError("TOML rules need Python 3.11+ or tomli installed")
+        with open(filename, "rb") as f:
+            data = load(f)
+        for i, entry in enumerate(data.get("rule", []), 1):
+            entry = dict(entry)
+            entries.append((str(entry.pop("name", "rule %d" % i)), entry))
+    else:
+        parser = configparser.ConfigParser(interpolation=None)
+        try:
+            with open(filename, encoding="utf-8") as f:
+                parser.read_file(f)
+        except configparser.Error as e:
+            raise ValueError(str(e))
+        for section in parser.sections():
+            entry = dict(parser.items(section))
+            for flag in _RULE_FLAGS:
+                if flag in entry:
+                    entry[flag] = parser.getboolean(section, flag)
+            entries.append((section, entry))
+
+    rules = []
+    for name, entry in entries:
+        unknown = sorted(set(entry) - set(_RULE_OPTIONS))
+        if unknown:
+            raise ValueError(
+                "Unknown options %s in rule %r of %s"
+                % (", ".join(unknown), name, filename)
+            )
+        for required in ("pattern", "text"):
+            if not entry.get(required):
+                raise ValueError("Rule %r of %s has no %s" % (name, filename, required))
+        rule = Namespace(
+            name=name,
+            replacement=None,
+            addition=None,
+            delete=False,
+            regex=False,
+            eval=False,
+            multiline=False,
+        )
+        for option, value in entry.items():
+            setattr(rule, _RULE_OPTIONS[option], value)
+        rules.append(rule)
+    if not rules:
+        raise ValueError("No rules in %s" % filename)
+    return rules
+
+
+def rules_by_file(rules, exclude=(), ignore=True):
+    """The files matched by the patterns of ``rules``, with their rules.
+
+    Each pattern is expanded once, however many rules share it, by
+    :func:`gearbox.utils.walk.glob_files` with ``exclude`` and
+    ``ignore``. Files
+    are listed in the order they were first matched, with the rules
+    applying to them in their order.
+    """
+    expanded = {}
+    files = {}
+    for rule in rules:
+        if rule.pattern not in expanded:
+            expanded[rule.pattern] = list(glob_files(rule.pattern, exclude, ignore))
+        for filepath in expanded[rule.pattern]:
+            files.setdefault(filepath, []).append(rule)
+    return list(files.items())
+
+
+def patch_file_rules(filepath, rules):
+    """Patch ``filepath`` with all of ``rules``, reading and writing it once.
+
+    Rules apply in order, each to the content patched by the previous
+    ones, as if they were applied one after the other. Files containing
+    none of the texts are not decoded, and consecutive rules working on
+    lines are applied together, only to the lines matching any of them.
+    Returns the names of the rules that matched.
+
+    Like with :func:`patch_file`, files of :data:`STREAM_THRESHOLD`
+    bytes or more are patched chunk by chunk, keeping their line
+    endings, unless a rule is ``multiline``: the whole file is then
+    read in memory.
+    """
+    matchers = [get_matcher(rule.text, rule.regex, rule.multiline) for rule in rules]
+    if (
+        not any(rule.multiline for rule in rules)
+        and all(matcher.streamable for matcher in matchers)
+        and os.path.getsize(filepath) >= STREAM_THRESHOLD
+    ):
+        stage = [
+            (rule, matcher) + _evaluate(rule) for rule, matcher in zip(rules, matchers)
+        ]
+        prefilter = get_prefilter(tuple((rule.text, rule.regex) for rule in rules))
+        matched = _patch_stream(filepath, stage, prefilter)
+        return [rule.name for i, rule in enumerate(rules) if i in matched]
+
+    with open(filepath, "rb") as f:
+        raw = f.read()
+    if all(m.needle is not None and raw.find(m.needle) == -1 for m in matchers):
+        return []
+
+    content = raw.decode(matchers[0].encoding)
+    if "\r" in content:
+        content = content.replace("\r\n", "\n").replace("\r", "\n")
+    patched = content
+    matched = set()
+    stage = []
+    for rule, matcher in zip(rules + [None], matchers + [None]):
+        if rule is not None and not rule.multiline:
+            stage.append((rule, matcher))
+            continue
+        if stage:
+            patched = _apply_line_rules(patched, stage, matched)
+            stage = []
+        if rule is not None and matcher.may_match(patched):
+            replacement, addition = _evaluate(rule)
+            spans, patched = _patch_content(
+                patched, rule, matcher, replacement, addition
+            )
+            if spans:
+                matched.add(rule.name)
+
+    if patched != content:
+        write_atomic(filepath, [patched])
+    return [rule.name for rule in rules if rule.name in matched]
+
+
+def _apply_line_rules(content, stage, matched):
+    """Apply the ``(rule, matcher)`` of ``stage`` to the lines of
+    ``content``, adding the names of those that matched to ``matched``.
+    """
+    if not any(matcher.may_match(content) for _, matcher in stage):
+        return content
+    prefilter = get_prefilter(tuple((rule.text, rule.regex) for rule, _ in stage))
+    evaluated = [_evaluate(rule) for rule, _ in stage]
+    patched = []
+    for line in io.StringIO(content):
+        if prefilter is not None and not prefilter.search(line):
+            patched.append(line)
+            continue
+        lines = [line]
+        for (rule, matcher), (replacement, addition) in zip(stage, evaluated):
+            matches, lines = _patch_lines(lines, rule, matcher, replacement, addition)
+            if matches:
+                matched.add(rule.name)
+        patched.extend(lines)
+    return "".join(patched)
+
+
+@functools.lru_cache(maxsize=16)
+def get_prefilter(texts):
+    """Regular expression matching lines matching any of ``texts``.
+
+    ``texts`` are ``(text, regex)`` pairs, combined in an alternation.
+    ``None`` when they can't be combined, as one of them relies on
+    backreferences or global flags.
+    """
+    alternatives = []
+    for text, regex in texts:
+        if not regex:
+            alternatives.append(re.escape(text))
+        elif _UNCOMBINABLE_RE.search(text):
+            return None
+        else:
+            alternatives.append("(?:%s)" % text)
+    try:
+        return re.compile("|".join(alternatives))
+    except re.error:
+        return None
+
+
+def patch_file(filepath, opts):
+    """Patch ``filepath`` as described by the ``gearbox patch`` options.
+
+    The file is only written, atomically, when its content changed.
+    Files of :data:`STREAM_THRESHOLD` bytes or more are patched with
+    :func:`patch_file_streaming`. Returns whether the file matched,
+    with ``--multiline`` the first and last line of each match.
+    """
+    matcher = get_matcher(opts.text, opts.regex, opts.multiline)
+    if not matcher.may_match_file(filepath):
+        return False
+
+    if (
+        matcher.streamable
+        and not opts.multiline
+        and os.path.getsize(filepath) >= STREAM_THRESHOLD
+    ):
+        return patch_file_streaming(filepath, opts, matcher)
+
+    with open(filepath) as f:
+        content = f.read()
+    if not matcher.may_match(content):
+        return False
+
+    replacement, addition = _evaluate(opts)
+    if opts.multiline:
+        matches, patched = _patch_content(content, opts, matcher, replacement, addition)
+        if patched != content:
+            write_atomic(filepath, [patched])
+        return matches
+
+    if (
+        replacement
+        and replacement.strip()
+        and not (opts.delete or opts.addition or opts.regex)
+        and opts.text
+        and "\n" not in opts.text
+    ):
+        # Replacing plain text can't make lines blank, which would drop
+        # them, so the whole content can be replaced at once.
+        lines = [content.replace(opts.text, replacement)]
+    else:
+        matches, lines = _patch_lines(
+            io.StringIO(content), opts, matcher, replacement, addition
+        )
+        if not matches:
+            return False
+
+    if "".join(lines) != content:
+        write_atomic(filepath, lines)
+    return True
+
+
+def patch_file_streaming(filepath, opts, matcher):
+    """Patch ``filepath`` without loading it in memory.
+
+    The file is mapped in memory and read in chunks of about
+    :data:`STREAM_CHUNK_SIZE` bytes, ending at line boundaries. Chunks
+    that don't match are not decoded, and are copied to the patched
+    file by the kernel, through ``os.copy_file_range`` or
+    ``os.sendfile``, so the memory used doesn't depend on the size of
+    the file. Unlike :func:`patch_file`, line endings are preserved.
+    """
+    replacement, addition = _evaluate(opts)
+    return bool(_patch_stream(filepath, [(opts, matcher, replacement, addition)]))
+
+
+def _patch_stream(filepath, stage, prefilter=None):
+    """Patch the lines of ``filepath`` chunk by chunk, for
+    :func:`patch_file_streaming`.
+
+    ``stage`` lists the ``(opts, matcher, replacement, addition)`` to
+    apply in order to each line, only to the lines matching
+    ``prefilter`` when given. Returns the indexes in ``stage`` of those
+    that matched.
+    """
+    encoding = stage[0][1].encoding
+    needles = [matcher.needle for _, matcher, _, _ in stage]
+    matched = set()
+    with open(filepath, "rb") as src, contextlib.ExitStack() as stack:
+        src_fd = src.fileno()
+        size = os.fstat(src_fd).st_size
+        if not size:
+            return matched
+        data = stack.enter_context(mmap.mmap(src_fd, 0, access=mmap.ACCESS_READ))
+        if hasattr(data, "madvise"):
+            data.madvise(mmap.MADV_SEQUENTIAL)
+        output = None
+        copied = pos = 0
+        while pos < size:
+            _release_pages(data, pos)
+            end = data.find(b"\n", min(pos + STREAM_CHUNK_SIZE, size) - 1)
+            end = size if end == -1 else end + 1
+            chunk = data[pos:end]
+            if all(n is not None and chunk.find(n) == -1 for n in needles):
+                pos = end
+                continue
+            text = chunk.decode(encoding)
+            normalized = text.replace("\r\n", "\n")
+            if not any(matcher.may_match(normalized) for _, matcher, _, _ in stage):
+                pos = end
+                continue
+
+            patched = []
+            for line in io.StringIO(text):
+                ending = ""
+                if line.endswith("\r\n"):
+                    ending = "\r\n"
+                elif line.endswith("\n"):
+                    ending = "\n"
+                body = line[: len(line) - len(ending)]
+                lines = [body + "\n" if ending else body]
+                if prefilter is not None and not prefilter.search(lines[0]):
+                    patched.append(line)
+                    continue
+                for i, (opts, matcher, replacement, addition) in enumerate(stage):
+                    matches, lines = _patch_lines(
+                        lines, opts, matcher, replacement, addition
+                    )
+                    if matches:
+                        matched.add(i)
+                for patched_line in lines:
+                    if ending and patched_line.endswith("\n"):
+                        patched_line = patched_line[:-1] + ending
+                    patched.append(patched_line)
+            patched = "".join(patched).encode(encoding)
+            if patched != chunk:
+                if output is None:
+                    output = stack.enter_context(
+                        atomic_output(filepath, "wb", buffering=0)
+                    )
+                _copy_range(data, src_fd, output.fileno(), copied, pos - copied)
+                _write_all(output.fileno(), patched)
+                copied = end
+            pos = end
+        if output is not None:
+            _copy_range(data, src_fd, output.fileno(), copied, size - copied)
+    return matched
+
+
+def _evaluate(opts):
+    """The replacement and addition to apply, evaluated with ``--eval``"""
+    replacement = opts.replacement
+    if opts.eval and replacement:
+        replacement = str(eval(replacement, globals()))
+
+    addition = opts.addition
+    if opts.eval and addition:
+        addition = str(eval(addition, globals()))
+    return replacement, addition
+
+
+def _patch_lines(lines, opts, matcher, replacement, addition):
+    """Patch ``lines``, returns whether any matched and the patched lines"""
+    matches, patched_lines = False, []
+    for line in lines:
+        if opts.replacement:
+            patched, count = matcher.subn(replacement, line)
+        else:
+            patched, count = line, matcher.search(line)
+        if not count:
+            patched_lines.append(line)
+            continue
+
+        matches = True
+        empty_line = not line.strip()
+        if empty_line or patched.strip() and not opts.delete:
+            if opts.addition and not patched.endswith("\n"):
+                # The last line, the addition still goes after it.
+                patched += "\n"
+            patched_lines.append(patched)
+
+        if opts.addition:
+            patched_lines.append(addition + "\n")
+    return matches, patched_lines
+
+
+def _patch_content(content, opts, matcher, replacement, addition):
+    """Patch the whole ``content`` at once, for ``--multiline``.
+
+    Matches are grouped by the lines they touch, which are appended
+    after or deleted together. Returns the first and last line number
+    of each group, and the patched content.
+    """
+    groups = []
+    for match in matcher.finditer(content):
+        start = content.rfind("\n", 0, match.start()) + 1
+        end = _line_end(content, max(match.end() - 1, match.start()))
+        if groups and start < groups[-1][1]:
+            groups[-1][1] = end
+            groups[-1][2].append(match)
+        else:
+            groups.append([start, end, [match]])
+
+    spans, patched = [], []
+    line, copied = 1, 0
+    for start, end, group in groups:
+        line += content.count("\n", copied, start)
+        spans.append((line, line + content.count("\n", start, end - 1)))
+        line += content.count("\n", start, end)
+        patched.append(content[copied:start])
+        patched.append(_patch_group(content, group, start, end, opts, replacement))
+        if opts.addition:
+            if not content.endswith("\n", 0, end):
+                patched.append("\n")
+            patched.append(addition + "\n")
+        copied = end
+    patched.append(content[copied:])
+    return spans, "".join(patched)
+
+
+def _patch_group(content, group, start, end, opts, replacement):
+    """Lines from ``start`` to ``end`` of ``content``, with the ``group`` of
+    matches within them replaced or deleted.
+    """
+    lines = content[start:end]
+    if opts.delete:
+        return ""
+    if not opts.replacement:
+        return lines
+
+    patched = []
+    copied = start
+    for match in group:
+        patched.append(content[copied : match.start()])
+        patched.append(match.expand(replacement) if opts.regex else replacement)
+        copied = match.end()
+    patched.append(content[copied:end])
+    patched = "".join(patched)
+    if lines.strip() and not patched.strip():
+        # As when patching lines, lines left blank are removed.
+        return ""
+    return patched
+
+
+def _line_end(content, pos):
+    """Offset after the end of the line of ``content`` at ``pos``"""
+    end = content.find("\n", pos)
+    return len(content) if end == -1 else end + 1
+
+
+def _release_pages(data, end):
+    """Let the pages of ``data`` before ``end`` out of the resident memory"""
+    end -= end % mmap.PAGESIZE
+    if end and hasattr(data, "madvise"):
+        data.madvise(mmap.MADV_DONTNEED, 0, end)
+
+
+def _copy_range(data, src_fd, dst_fd, offset, count):
+    """Append ``count`` bytes of ``src_fd`` from ``offset`` to ``dst_fd``.
+
+    The copy is done by the kernel when possible, otherwise from
+    ``data``, the mapped content of ``src_fd``.
+    """
+    end = offset + count
+    while offset < end:
+        try:
+            copied = os.copy_file_range(src_fd, dst_fd, end - offset, offset)
+        except (AttributeError, OSError):
+            try:
+                copied = os.sendfile(dst_fd, src_fd, offset, end - offset)
+            except (AttributeError, OSError):
+                copied = os.write(dst_fd, data[offset : min(end, offset + 2**20)])
+        if not copied:
+            raise OSError("Unexpected end of file while copying")
+        offset += copied
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view) :]
+
+
+class Matcher:
+    """Looks up the text of ``gearbox patch`` in files and their lines.
+
+    Regular expressions are compiled once. Whole files are checked
+    before their lines are: plain text with a single search of their
+    bytes, so that files not containing it are never decoded, regular
+    expressions with a single search of their content.
+
+    :param multiline: Whether the text is looked up in whole contents
+                      rather than in lines, regular expressions are
+                      then compiled with ``re.MULTILINE`` and
+                      ``re.DOTALL``.
+    :param encoding: Encoding files are read with, the default one when
+                     ``None``.
+    """
+
+    def __init__(self, text, regex=False, multiline=False, encoding=None):
+        self.text = text
+        self.regex = regex
+        self.multiline = multiline
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        #: Whether files can be split in chunks at their newline bytes.
+        self.streamable = codecs.lookup(self.encoding).name in _SEARCHABLE_ENCODINGS
+        self.pattern = self.content_pattern = self.needle = None
+        if multiline:
+            if regex:
+                self.pattern = re.compile(text, re.MULTILINE | re.DOTALL)
+            else:
+                self.pattern = re.compile(re.escape(text))
+            self.content_pattern = self.pattern
+        elif regex:
+            self.pattern = re.compile(text)
+            if not _CROSS_LINE_UNSAFE_RE.search(text):
+                self.content_pattern = re.compile(text, re.MULTILINE)
+        if self.streamable and not regex:
+            # Line endings are translated when decoding, so only the
+            # longest part of the text without any can be found in the
+            # bytes.
+            needle = max(re.split(r"[\r\n]+", text), key=len)
+            if needle:
+                self.needle = needle.encode(self.encoding)
+
+    def may_match_file(self, filepath):
+        """Whether ``filepath`` might contain the text, without decoding it"""
+        if self.needle is None:
+            return True
+        with open(filepath, "rb") as f:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    return data.find(self.needle) != -1
+            except ValueError:
+                # Empty files can't be mapped, nor match.
+                return False
+
+    def may_match(self, content):
+        """Whether any line of ``content`` might match"""
+        if self.content_pattern is not None:
+            return self.content_pattern.search(content) is not None
+        if self.pattern is not None:
+            return True
+        return self.text in content
+
+    def search(self, line):
+        """Whether ``line`` matches"""
+        if self.pattern is not None:
+            return self.pattern.search(line) is not None
+        return self.text in line
+
+    def finditer(self, content):
+        """Matches in the whole ``content``, for ``--multiline``"""
+        return self.pattern.finditer(content)
+
+    def subn(self, replacement, line):
+        """``line`` with the matches replaced, and how many there were"""
+        if self.pattern is not None:
+            return self.pattern.subn(replacement, line)
+        count = line.count(self.text)
+        if not count:
+            return line, 0
+        return line.replace(self.text, replacement), count
+
+
+@functools.lru_cache(maxsize=16)
+def get_matcher(text, regex=False, multiline=False):
+    """The :class:`Matcher` of ``text``, shared by all the files patched"""
+    return Matcher(text, regex, multiline)
+
+
+def write_atomic(filepath, lines):
+    """Replace the content of ``filepath`` with ``lines``, see :func:`atomic_output`"""
+    with atomic_output(filepath) as f:
+        f.writelines(lines)
+
+
+@contextlib.contextmanager
+def atomic_output(filepath, mode="w", **kw):
+    """File object replacing ``filepath`` once the context exits.
+
+    It is a temporary file next to ``filepath``, renamed over it, so the
+    file is never seen half written. Symbolic links are followed and the
+    file permissions are kept. ``mode`` and ``kw`` are passed to
+    :func:`os.fdopen`.
+    """
+    filepath = os.path.realpath(filepath)
+    dirname, basename = os.path.split(filepath)
+    fd, tmpname = tempfile.mkstemp(prefix=".%s." % basename, dir=dirname)
+    try:
+        with os.fdopen(fd, mode, **kw) as f:
+            yield f
+        shutil.copymode(filepath, tmpname)
+        os.replace(tmpname, filepath)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
@@ -4,11 +4,16 @@ from argparse import RawDescriptionHelpFormatter
 
 from gearbox.command import Command
 from gearbox.template import GearBoxTemplate
+from gearbox.utils.lazy import lazy_import
+
+walk_files = lazy_import("gearbox.utils.walk", "walk_files")
 
 _OUTPUT_STEM = re.compile(r"^\{\{# gearbox: output-stem=([A-Za-z0-9_{}-]+) \}\}$")
 
 
 class ScaffoldCommand(Command):
+    summary = "Creates a new file from a scaffold template"
+
     def get_description(self):
         return """Creates a new file from a scaffold template
 
@@ -22,6 +27,10 @@ which will create a SomethingModel, SomethingController and something.html
 using model/model.py.template, controllers/controller.py.template and
 templates/template.html.template scaffolds of the current project.
 
+Version control, build, cache and virtualenv directories, like .git,
+build, __pycache__ or node_modules, and the files ignored by .gitignore
+files are not looked into.
+
 A template can set its output filename stem with a first-line Tempita comment:
 
     {{# gearbox: output-stem=test_{target} }}
@@ -175,11 +184,8 @@ extension.
                 of.write(text)
 
     def _lookup(self, template, where):
-        template_filename = None
-        for root, __, files in os.walk(where):
-            for f in files:
-                fname, fext = os.path.splitext(f)
-                if fext == ".template" and os.path.splitext(fname)[0] == template:
-                    template_filename = os.path.join(root, f)
-                    break
-        return template_filename
+        for relpath in walk_files(where):
+            fname, fext = os.path.splitext(os.path.basename(relpath))
+            if fext == ".template" and os.path.splitext(fname)[0] == template:
+                return os.path.join(where, relpath)
+        return None
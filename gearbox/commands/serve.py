@@ -10,21 +10,43 @@
 
 import atexit
 import errno
+import json
 import logging
 import os
 import re
-import subprocess
+import signal
 import sys
 import time
 
-import hupper
-import hupper.reloader
-from paste.deploy import loadapp, loadserver
-from paste.deploy.converters import asbool
-
 from gearbox.command import Command
+from gearbox.utils.lazy import lazy_import
 from gearbox.utils.log import setup_logging
 
+glob = lazy_import("glob")
+random = lazy_import("random")
+socket = lazy_import("socket")
+subprocess = lazy_import("subprocess")
+configgraph = lazy_import("gearbox.utils.configgraph")
+sockets = lazy_import("gearbox.utils.sockets")
+control = lazy_import("gearbox.utils.control")
+hupper = lazy_import("hupper")
+loadwsgi = lazy_import("paste.deploy.loadwsgi")
+metrics = lazy_import("gearbox.utils.metrics")
+monitor = lazy_import("gearbox.utils.monitor")
+profiler = lazy_import("gearbox.utils.profiler")
+zygote = lazy_import("gearbox.utils.zygote")
+loadapp = lazy_import("paste.deploy", "loadapp")
+loadserver = lazy_import("paste.deploy", "loadserver")
+asbool = lazy_import("paste.deploy.converters", "asbool")
+RecycleMiddleware = lazy_import("gearbox.utils.supervisor", "RecycleMiddleware")
+RestartPolicy = lazy_import("gearbox.utils.supervisor", "RestartPolicy")
+Supervisor = lazy_import("gearbox.utils.supervisor", "Supervisor")
+classify_exit = lazy_import("gearbox.utils.supervisor", "classify_exit")
+describe_returncode = lazy_import("gearbox.utils.supervisor", "describe_returncode")
+process_rss = lazy_import("gearbox.utils.supervisor", "process_rss")
+stop_process = lazy_import("gearbox.utils.supervisor", "stop_process")
+terminate = lazy_import("gearbox.utils.supervisor", "terminate")
+
 MAXFD = 1024
 
 kill = os.kill
@@ -35,9 +57,12 @@ class DaemonizeException(Exception):
 
 
 class ServeCommand(Command):
+    summary = "Serves a web application that uses a PasteDeploy configuration file"
+
     _scheme_re = re.compile(r"^[a-z][a-z]+:", re.I)
 
     _monitor_environ_key = "PASTE_MONITOR_SHOULD_RUN"
+    _restarts_environ_key = "GEARBOX_MONITOR_RESTARTS"
 
     possible_subcommands = ("start", "stop", "restart", "status")
 
@@ -82,6 +107,64 @@ class ServeCommand(Command):
                 action="store_true",
                 help="Run in daemon (background) mode",
             )
+            parser.add_argument(
+                "--workers",
+                dest="workers",
+                type=int,
+                default=0,
+                metavar="N",
+                help=(
+                    "Fork N worker processes serving from a socket shared with "
+                    "the master process (requires a gearbox server runner)"
+                ),
+            )
+            parser.add_argument(
+                "--graceful-timeout",
+                dest="graceful_timeout",
+                type=float,
+                default=30,
+                metavar="SECONDS",
+                help=(
+                    "Seconds workers have to finish their requests when "
+                    "stopped or restarted (default: 30)"
+                ),
+            )
+            parser.add_argument(
+                "--max-requests",
+                dest="max_requests",
+                type=int,
+                default=0,
+                metavar="N",
+                help="Recycle workers after they served N requests",
+            )
+            parser.add_argument(
+                "--max-requests-jitter",
+                dest="max_requests_jitter",
+                type=int,
+                default=0,
+                metavar="N",
+                help=(
+                    "Add a random number of requests, up to N, to the "
+                    "--max-requests of each worker, so that they are not "
+                    "all recycled at once"
+                ),
+            )
+            parser.add_argument(
+                "--max-rss",
+                dest="max_rss",
+                type=int,
+                default=0,
+                metavar="MB",
+                help="Recycle workers using more than MB megabytes of memory",
+            )
+            parser.add_argument(
+                "--max-age",
+                dest="max_age",
+                type=float,
+                default=0,
+                metavar="SECONDS",
+                help="Recycle workers running for more than SECONDS",
+            )
         parser.add_argument(
             "--pid-file",
             dest="pid_file",
@@ -99,24 +182,62 @@ class ServeCommand(Command):
         parser.add_argument(
             "--reload-interval",
             dest="reload_interval",
+            type=float,
             default=1,
             help=(
-                "Seconds between checking files (low number can cause "
-                "significant CPU usage)"
+                "Seconds between checking files when inotify is not "
+                "available (low number can cause significant CPU usage)"
             ),
         )
+        if hasattr(os, "fork"):
+            parser.add_argument(
+                "--reload-mode",
+                dest="reload_mode",
+                choices=("restart", "zygote"),
+                default="restart",
+                help=(
+                    "How --reload reloads the application: restart the whole "
+                    "command, or fork a fresh server from a process with the "
+                    "third-party modules already imported (default: restart)"
+                ),
+            )
         parser.add_argument(
             "--monitor-restart",
             dest="monitor_restart",
             action="store_true",
             help="Auto-restart server if it dies",
         )
+        parser.add_argument(
+            "--monitor-max-failures",
+            dest="monitor_max_failures",
+            type=int,
+            default=5,
+            metavar="N",
+            help=(
+                "Give up restarting the server once it died N times within "
+                "--monitor-failure-window seconds (default: %(default)s)"
+            ),
+        )
+        parser.add_argument(
+            "--monitor-failure-window",
+            dest="monitor_failure_window",
+            type=float,
+            default=60,
+            metavar="SECONDS",
+            help="See --monitor-max-failures (default: %(default)s)",
+        )
         parser.add_argument(
             "--status",
             action="store_true",
             dest="show_status",
             help="Show the status of the (presumably daemonized) server",
         )
+        parser.add_argument(
+            "--json",
+            dest="json",
+            action="store_true",
+            help="Report the status as JSON",
+        )
 
         if hasattr(os, "setuid"):
             # I don't think these are available on Windows
@@ -142,13 +263,80 @@ class ServeCommand(Command):
                 "gearbox.pid file)"
             ),
         )
+        parser.add_argument(
+            "--stop-timeout",
+            dest="stop_timeout",
+            type=float,
+            default=None,
+            metavar="SECONDS",
+            help=(
+                "Seconds a stopped server has to exit before being killed "
+                "(default: --graceful-timeout plus 10 seconds)"
+            ),
+        )
+
+        parser.add_argument(
+            "--metrics",
+            dest="metrics",
+            action="store_true",
+            help=(
+                "Record request latency, throughput and status codes and "
+                "expose them in the Prometheus text format"
+            ),
+        )
+        parser.add_argument(
+            "--metrics-address",
+            dest="metrics_address",
+            metavar="ADDRESS",
+            help=(
+                "host:port or Unix socket path of the metrics endpoint, "
+                "workers add their number to the port or path "
+                "(default: 127.0.0.1:9180)"
+            ),
+        )
+
+        parser.add_argument(
+            "--profile",
+            dest="profile",
+            action="store_true",
+            help=(
+                "Sample the stacks of the requests being served and write "
+                "them in flamegraph collapsed format on SIGUSR2 and at exit"
+            ),
+        )
+        parser.add_argument(
+            "--profile-dir",
+            dest="profile_dir",
+            metavar="DIR",
+            default="gearbox-profile",
+            help="Where profiles are written (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--profile-rate",
+            dest="profile_rate",
+            type=int,
+            default=100,
+            metavar="HZ",
+            help="Stack samples per second (default: %(default)s)",
+        )
+        parser.add_argument(
+            "--profile-ratio",
+            dest="profile_ratio",
+            type=float,
+            default=0.0,
+            metavar="RATIO",
+            help=(
+                "Fraction of requests also profiled with cProfile, requests "
+                "with an X-Gearbox-Profile header always are (default: 0)"
+            ),
+        )
 
         parser.add_argument("args", nargs="*")
 
         return parser
 
     def get_description(self):
-        return "Serves a web application that uses a PasteDeploy configuration file"
+        return self.summary
 
     @classmethod
     def out(cls, msg, error=False):  # pragma: no cover
@@ -159,6 +347,7 @@ class ServeCommand(Command):
             log.info(msg)
 
     def take_action(self, opts):
+        self.started = time.time()
         if opts.stop_daemon:
             return self.stop_daemon(opts)
 
@@ -193,15 +382,30 @@ class ServeCommand(Command):
         if opts.monitor_restart and not os.environ.get(self._monitor_environ_key):
             # gearbox serve was started with an angel and we are not already inside the angel.
             # Switch this process to being the angel and start a new one with the real server.
-            return self.restart_with_monitor()
+            return self.restart_with_monitor(opts)
 
-        if opts.reload and not hupper.is_active():
+        use_zygote = opts.reload and getattr(opts, "reload_mode", None) == "zygote"
+        if use_zygote:
+            if not zygote.is_child():
+                if self.verbose > 1:
+                    self.out("Running zygote reloader")
+                status = zygote.Zygote(
+                    monitor_factory=monitor.find_monitor_factory(
+                        logging.getLogger("gearbox")
+                    ),
+                    out=self.out,
+                    files=configgraph.config_files(opts.config_file),
+                    reload_interval=opts.reload_interval,
+                ).run()
+                if not zygote.is_child():
+                    return status
+        elif opts.reload and not hupper.is_active():
             if self.verbose > 1:
                 self.out("Running reloading file monitor")
             reloader = hupper.reloader.Reloader(
                 worker_path="gearbox.main.main",
                 reload_interval=opts.reload_interval,
-                monitor_factory=hupper.reloader.find_default_monitor_factory(
+                monitor_factory=monitor.find_monitor_factory(
                     logging.getLogger("gearbox")
                 ),
                 logger=logging.getLogger("gearbox"),
@@ -209,10 +413,18 @@ class ServeCommand(Command):
             reloader.run()
 
         if hupper.is_active():
-            # Tack also config file changes
-            hupper.get_reloader().watch_files([opts.config_file])
+            # Track also changes of the config file and the files it includes
+            hupper.get_reloader().watch_files(
+                configgraph.config_files(opts.config_file)
+            )
+
+        replacing = None
+        if cmd == "restart":
+            replacing = self.take_over_listeners(opts)
+            if replacing:
+                opts.daemon = True
 
-        if cmd == "restart" or cmd == "stop":
+        if cmd == "stop" or (cmd == "restart" and not replacing):
             result = self.stop_daemon(opts)
             if result:
                 if cmd == "restart":
@@ -255,7 +467,7 @@ class ServeCommand(Command):
 
         if getattr(opts, "daemon", False):
             try:
-                self.daemonize(opts)
+                self.daemonize(opts, replacing)
             except DaemonizeException as ex:
                 if self.verbose > 0:
                     self.out(str(ex))
@@ -295,6 +507,9 @@ class ServeCommand(Command):
             self.out("Failed to load application", error=True)
             raise
 
+        if use_zygote:
+            zygote.report_loaded(configgraph.config_files(opts.config_file))
+
         if self.verbose > 0:
             if hasattr(os, "getpid"):
                 msg = "Starting server in PID %i." % os.getpid()
@@ -302,7 +517,45 @@ class ServeCommand(Command):
                 msg = "Starting server."
             self.out(msg)
 
-        def serve():
+        def instrument(app):
+            if getattr(opts, "profile", False):
+                app = profiler.ProfilerMiddleware(
+                    app, sampler, opts.profile_dir, opts.profile_ratio
+                )
+            if getattr(opts, "metrics", False):
+                app = metrics.MetricsMiddleware(app, registry)
+            return app
+
+        registry = sampler = None
+        if getattr(opts, "metrics", False):
+            restarts = int(os.environ.get(self._restarts_environ_key) or 0)
+            registry = metrics.MetricsRegistry(restarts)
+        if getattr(opts, "profile", False):
+            sampler = profiler.SamplingProfiler(opts.profile_rate, opts.profile_dir)
+        app = instrument(app)
+
+        def serve(app, slot=None):
+            if sampler is not None:
+                sampler.start()
+                self.out(
+                    "Profiling at %d Hz, send SIGUSR2 to write %s"
+                    % (opts.profile_rate, sampler.filename)
+                )
+            if getattr(opts, "metrics", False):
+                address = opts.metrics_address or metrics.DEFAULT_ADDRESS
+                bind_timeout = 0
+                if slot is not None:
+                    address = metrics.worker_address(address, slot)
+                    bind_timeout = getattr(opts, "graceful_timeout", 30) + 10
+                try:
+                    metrics.serve_metrics(registry, address, bind_timeout)
+                except OSError as e:
+                    self.out("Cannot serve metrics on %s: %s" % (address, e), True)
+                else:
+                    self.out("Serving metrics on %s" % address)
+            stats_server = None
+            if slot is not None and registry is not None and opts.pid_file:
+                stats_server = self.start_stats_server(opts.pid_file, slot, registry)
             try:
                 server(app)
             except (SystemExit, KeyboardInterrupt) as e:
@@ -313,12 +566,196 @@ class ServeCommand(Command):
                 else:
                     msg = ""
                 self.out("Exiting%s (-v to see traceback)" % msg)
+            finally:
+                if sampler is not None:
+                    sampler.stop()
+                    self.out("Profile written to %s" % sampler.filename)
+                if stats_server is not None:
+                    stats_server.close()
+
+        if hasattr(os, "fork"):
+            server_context = self.loadservercontext(
+                server_spec, name=server_name, relative_to=base, global_conf=parsed_vars
+            )
+            server_conf = server_context.config()
+            reuse_port = asbool(server_conf.get("reuseport", False))
+            workers = getattr(opts, "workers", 0)
+            if not workers and reuse_port:
+                workers = int(server_conf.get("processes", 1))
+
+            recycling = [
+                "--" + name.replace("_", "-")
+                for name in ("max_requests", "max_rss", "max_age")
+                if getattr(opts, name, 0)
+            ]
+            if recycling and not workers:
+                self.out(
+                    "Error: %s can only be used with --workers" % ", ".join(recycling)
+                )
+                return 2
+
+            if workers:
+
+                def reload_app():
+                    app = self.loadapp(
+                        app_spec,
+                        name=app_name,
+                        relative_to=base,
+                        global_conf=parsed_vars,
+                    )
+                    return instrument(app)
+
+                return self.serve_workers(
+                    opts,
+                    workers,
+                    server_conf,
+                    serve,
+                    app,
+                    reload_app,
+                    reuse_port,
+                    replacing,
+                    registry,
+                    server_context.object,
+                )
+
+            if opts.pid_file and adopts_inherited_sockets(server_context):
+                # Listen from here, so that the socket can be handed over
+                # to the server replacing this one on restart.
+                if sockets.inherited_socket() is None:
+                    host, port = server_address(server_conf, server_context.object)
+                    listener = sockets.bind_socket(
+                        host, port, server_backlog(server_conf)
+                    )
+                    sockets.set_inherited_sockets([listener])
+                if replacing:
+                    self.replace_server(opts.pid_file, replacing)
+                self.start_control_server(
+                    opts.pid_file, lambda: self.server_status(registry)
+                )
+                _turn_sigterm_into_systemexit()
+
+        serve(app)
+
+    def serve_workers(
+        self,
+        opts,
+        workers,
+        server_conf,
+        serve,
+        app,
+        reload_app,
+        reuse_port=False,
+        replacing=None,
+        registry=None,
+        runner=None,
+    ):
+        """Serve ``app`` from ``workers`` forked processes.
+
+        The application is loaded once in the master process, so workers
+        share it copy-on-write. On ``SIGHUP`` the application is loaded
+        again and the workers are replaced one by one.
+
+        By default the workers accept connections from a single socket
+        bound by the master. With ``reuse_port`` each worker binds its
+        own ``SO_REUSEPORT`` socket instead and the kernel balances the
+        connections between them, each worker then records its PID in
+        its own :func:`worker_pid_file`.
+
+        ``replacing`` is the PID of the server this one is taking the
+        listening socket over from, which is asked to drain and exit
+        once the application is loaded.
+
+        Workers are recycled according to ``--max-requests``, ``--max-rss``
+        and ``--max-age``, see :class:`~gearbox.utils.supervisor.Supervisor`.
+
+        ``registry`` is the :class:`~gearbox.utils.metrics.MetricsRegistry`
+        the workers record requests in, if any.
+
+        ``runner`` is the server runner or factory, whose defaults are
+        followed by :func:`server_address`.
+        """
+        host, port = server_address(server_conf, runner)
+        backlog = server_backlog(server_conf)
+        listener = sockets.inherited_socket()
+        if listener is None or reuse_port:
+            # Bound upfront even when workers bind their own socket, so that
+            # configuration errors are reported once by the master.
+            listener = sockets.bind_socket(host, port, backlog, reuse_port=reuse_port)
+        if reuse_port:
+            listener.close()
+        else:
+            sockets.set_inherited_sockets([listener])
+        self.out(
+            "Master PID %s listening on %s:%s with %d workers%s"
+            % (os.getpid(), host, port, workers, " (reuseport)" if reuse_port else "")
+        )
 
-        serve()
+        current = {"app": app}
+
+        def on_reload():
+            self.out("Reloading application")
+            current["app"] = reload_app()
+
+        def serve_worker(slot):
+            app = current["app"]
+            if getattr(opts, "max_requests", 0):
+                max_requests = opts.max_requests + random.randint(
+                    0, max(opts.max_requests_jitter, 0)
+                )
+                app = RecycleMiddleware(app, max_requests, supervisor.request_recycle)
+            if not reuse_port:
+                return serve(app, slot)
+
+            sockets.set_inherited_sockets(
+                [sockets.bind_socket(host, port, backlog, reuse_port=True)]
+            )
+            pid_file = None
+            if opts.pid_file:
+                pid_file = worker_pid_file(opts.pid_file, slot)
+                with open(pid_file, "w") as f:
+                    f.write(str(os.getpid()))
+            try:
+                serve(app, slot)
+            finally:
+                # A replacement worker might own the file already.
+                if pid_file and read_pidfile(pid_file) == os.getpid():
+                    os.unlink(pid_file)
+
+        def on_start():
+            if replacing:
+                self.replace_server(opts.pid_file, replacing)
+            if opts.pid_file:
+                self.start_control_server(
+                    opts.pid_file,
+                    lambda: self.server_status(registry, supervisor, opts.pid_file),
+                )
+
+        supervisor = Supervisor(
+            serve_worker,
+            workers,
+            self.out,
+            graceful_timeout=getattr(opts, "graceful_timeout", 30),
+            on_reload=on_reload,
+            on_start=on_start,
+            max_rss=getattr(opts, "max_rss", 0) * 2**20,
+            max_age=getattr(opts, "max_age", 0),
+        )
+        try:
+            return supervisor.run()
+        finally:
+            listener.close()
 
     def loadserver(self, server_spec, name, relative_to, **kw):  # pragma:no cover
         return loadserver(server_spec, name=name, relative_to=relative_to, **kw)
 
+    def loadserverconf(self, server_spec, name, relative_to, **kw):  # pragma:no cover
+        return self.loadservercontext(server_spec, name, relative_to, **kw).config()
+
+    def loadservercontext(self, server_spec, name, relative_to, **kw):
+        return loadwsgi.loadcontext(
+            loadwsgi.SERVER, server_spec, name=name, relative_to=relative_to, **kw
+        )
+
     def loadapp(self, app_spec, name, relative_to, **kw):  # pragma: no cover
         return loadapp(app_spec, name=name, relative_to=relative_to, **kw)
 
@@ -357,9 +794,9 @@ class ServeCommand(Command):
             argv.insert(0, sys.executable)
         return argv
 
-    def daemonize(self, opts):  # pragma: no cover
+    def daemonize(self, opts, replacing=None):  # pragma: no cover
         pid = live_pidfile(opts.pid_file)
-        if pid:
+        if pid and pid != replacing:
             raise DaemonizeException(
                 "Daemon is already running (PID: %s from PID file %s)"
                 % (pid, opts.pid_file)
@@ -388,7 +825,11 @@ class ServeCommand(Command):
         if maxfd == resource.RLIM_INFINITY:
             maxfd = MAXFD
             # Iterate through and close all file descriptors.
+        # Except for the listening sockets taken over on restart.
+        keep_fds = {s.fileno() for s in sockets.inherited_sockets()}
         for fd in range(0, maxfd):
+            if fd in keep_fds:
+                continue
             try:
                 os.close(fd)
             except OSError:  # ERROR, fd wasn't open to begin with (ignored)
@@ -465,66 +906,280 @@ class ServeCommand(Command):
                 self.out("Could not delete: %s" % e)
                 return 2
             return 1
-        for j in range(10):
-            if not live_pidfile(pid_file):
-                break
-            import signal
-
-            kill(pid, signal.SIGTERM)
-            time.sleep(1)
-        else:
-            self.out("failed to kill web process %s" % pid)
+        timeout = getattr(opts, "stop_timeout", None)
+        if timeout is None:
+            timeout = getattr(opts, "graceful_timeout", 30) + 10
+        try:
+            # A daemon runs in its own session, along with its workers.
+            kill_group = hasattr(os, "getsid") and os.getsid(pid) != os.getsid(0)
+            elapsed, killed = stop_process(pid, timeout, kill_group=kill_group)
+        except (TimeoutError, OSError) as e:
+            self.out("failed to kill web process %s: %s" % (pid, e))
             return 3
-        if os.path.exists(pid_file):
+        if killed:
+            self.out(
+                "Server in PID %s did not stop within %ss, killed it (%.3fs)"
+                % (pid, timeout, elapsed)
+            )
+        elif self.verbose > 0:
+            self.out("Server in PID %s stopped in %.3fs" % (pid, elapsed))
+        # The server removes its own files, unless it was killed.
+        if read_pidfile(pid_file) == pid:
             os.unlink(pid_file)
+        if killed and os.path.exists(control.socket_path(pid_file)):
+            os.unlink(control.socket_path(pid_file))
         return 0
 
+    def take_over_listeners(self, opts):
+        """Receive the listening sockets of the running server.
+
+        Returns the PID of the server, ``None`` when it doesn't answer on
+        its control socket and must be stopped before being restarted.
+        """
+        pid_file = opts.pid_file or "gearbox.pid"
+        path = control.socket_path(pid_file)
+        if not hasattr(socket, "recv_fds") or not os.path.exists(path):
+            return None
+        try:
+            response, listeners = control.request(path, "listeners")
+        except (OSError, ValueError) as e:
+            self.out("Cannot take over the listening sockets: %s" % e)
+            return None
+        opts.pid_file = pid_file
+        sockets.set_inherited_sockets(listeners)
+        self.out(
+            "Took over %d listening sockets from PID %s"
+            % (len(listeners), response["pid"])
+        )
+        return response["pid"]
+
+    def replace_server(self, pid_file, pid):
+        """Ask the server in ``pid`` to drain its connections and exit"""
+        try:
+            control.request(control.socket_path(pid_file), "drain")
+        except (OSError, ValueError) as e:
+            self.out("Cannot ask PID %s to drain (%s), terminating it" % (pid, e))
+            try:
+                kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        else:
+            self.out("Replacing server in PID %s" % pid)
+
+    def start_control_server(self, pid_file, status=None):
+        """Answer ``gearbox serve restart`` and ``gearbox serve status`` on
+        the socket next to ``pid_file``.
+
+        ``status`` returns the response to ``status`` requests.
+        """
+
+        def listeners(reply):
+            fds = [s.fileno() for s in sockets.inherited_sockets()]
+            reply({"pid": os.getpid()}, fds)
+
+        def drain(reply):
+            reply({"pid": os.getpid()})
+            self.out("Replaced by a new server, draining connections")
+            kill(os.getpid(), signal.SIGTERM)
+
+        commands = {"listeners": listeners, "drain": drain}
+        if status is not None:
+            commands["status"] = lambda reply: reply(status())
+        server = control.ControlServer(control.socket_path(pid_file), commands)
+        try:
+            server.start()
+        except OSError as e:
+            self.out("Cannot create control socket %s: %s" % (server.path, e), True)
+            return None
+        atexit.register(server.close)
+        return server
+
+    def start_stats_server(self, pid_file, slot, registry):
+        """Answer the master asking for the request statistics of the worker
+        in ``slot``, on a socket next to its :func:`worker_pid_file`.
+        """
+        server = control.ControlServer(
+            control.socket_path(worker_pid_file(pid_file, slot)),
+            {"stats": lambda reply: reply(registry.snapshot().to_dict())},
+        )
+        try:
+            server.start()
+        except OSError as e:
+            self.out("Cannot create stats socket %s: %s" % (server.path, e), True)
+            return None
+        return server
+
+    def server_status(self, registry=None, supervisor=None, pid_file=None):
+        """Runtime status of this server, answered to ``gearbox serve status``.
+
+        Request statistics are only available when ``registry`` records
+        them. With a ``supervisor``, they are collected from each of its
+        workers through their stats socket and combined.
+        """
+        status = {
+            "pid": os.getpid(),
+            "started": self.started,
+            "uptime": time.time() - self.started,
+            "rss": process_rss(os.getpid()),
+            "workers": [],
+        }
+        total = None
+        if registry is not None and supervisor is None:
+            total = registry.snapshot()
+        if supervisor is not None:
+            workers = sorted(supervisor.workers.values(), key=lambda w: w.slot)
+            for worker in workers:
+                if worker.retiring:
+                    continue
+                stats = None
+                if registry is not None:
+                    path = control.socket_path(worker_pid_file(pid_file, worker.slot))
+                    try:
+                        response, _ = control.request(path, "stats", timeout=1.0)
+                    except (OSError, ValueError) as e:
+                        self.out("Cannot get stats of worker %d: %s" % (worker.slot, e))
+                    else:
+                        stats = metrics.RequestStats.from_dict(response)
+                        if total is None:
+                            total = metrics.RequestStats()
+                        total.merge(stats)
+                info = {
+                    "slot": worker.slot,
+                    "pid": worker.pid,
+                    "uptime": worker.age,
+                    "rss": process_rss(worker.pid),
+                }
+                info.update(request_summary(stats))
+                status["workers"].append(info)
+        status.update(request_summary(total))
+        return status
+
     def show_status(self, opts):  # pragma: no cover
         pid_file = opts.pid_file or "gearbox.pid"
-        if not os.path.exists(pid_file):
-            self.out("No PID file %s" % pid_file)
-            return 1
         pid = read_pidfile(pid_file)
-        if not pid:
-            self.out("No PID in file %s" % pid_file)
-            return 1
-        pid = live_pidfile(pid_file)
-        if not pid:
-            self.out("PID %s in %s is not running" % (pid, pid_file))
+        if not os.path.exists(pid_file):
+            error = "No PID file %s" % pid_file
+        elif not pid:
+            error = "No PID in file %s" % pid_file
+        elif not live_pidfile(pid_file):
+            error = "PID %s in %s is not running" % (pid, pid_file)
+        else:
+            error = None
+        if error:
+            if getattr(opts, "json", False):
+                self.write_json({"running": False, "pid": pid, "error": error})
+            else:
+                self.out(error)
             return 1
-        self.out("Server running in PID %s" % pid)
+
+        try:
+            status, _ = control.request(control.socket_path(pid_file), "status")
+        except (OSError, ValueError):
+            # Not a gearbox server, or one predating status requests.
+            status = {"pid": pid, "rss": process_rss(pid), "workers": []}
+            for slot, filename in worker_pid_files(pid_file):
+                worker_pid = live_pidfile(filename)
+                if worker_pid:
+                    status["workers"].append(
+                        {
+                            "slot": slot,
+                            "pid": worker_pid,
+                            "rss": process_rss(worker_pid),
+                        }
+                    )
+        status["running"] = True
+
+        if getattr(opts, "json", False):
+            self.write_json(status)
+            return 0
+        self.out("Server running in PID %s%s" % (pid, describe_process(status)))
+        if "requests" in status:
+            self.out("Requests: %s" % describe_requests(status))
+        for worker in status["workers"]:
+            msg = "Worker %d running in PID %s%s" % (
+                worker["slot"],
+                worker["pid"],
+                describe_process(worker),
+            )
+            if worker.get("requests") is not None:
+                msg += ", %s" % describe_requests(worker)
+            self.out(msg)
         return 0
 
-    def restart_with_monitor(self):  # pragma: no cover
+    def write_json(self, data):  # pragma: no cover
+        sys.stdout.write(json.dumps(data, sort_keys=True) + "\n")
+        sys.stdout.flush()
+
+    def restart_with_monitor(self, opts):  # pragma: no cover
+        """Run the server in a subprocess, restarting it when it crashes.
+
+        Restarts are delayed more and more while the server keeps
+        crashing, until it crashed ``--monitor-max-failures`` times within
+        ``--monitor-failure-window`` seconds. A server exiting successfully,
+        stopped by a signal or failing on a configuration error is not
+        restarted.
+        """
         if self.verbose > 0:
             self.out("Starting subprocess with angel")
 
-        while True:
-            args = self.get_fixed_argv()
-            new_environ = os.environ.copy()
-            new_environ[self._monitor_environ_key] = "true"
-            proc = None
-            try:
-                try:
-                    _turn_sigterm_into_systemexit()
-                    proc = subprocess.Popen(args, env=new_environ)
-                    proc = None
-                except KeyboardInterrupt:
-                    self.out("^C caught in monitor process")
-                    if self.verbose > 1:
-                        raise
+        policy = RestartPolicy(
+            max_failures=getattr(opts, "monitor_max_failures", 5),
+            window=getattr(opts, "monitor_failure_window", 60),
+        )
+        args = self.get_fixed_argv()
+        new_environ = os.environ.copy()
+        new_environ[self._monitor_environ_key] = "true"
+        _turn_sigterm_into_systemexit()
+        proc = None
+        try:
+            while True:
+                new_environ[self._restarts_environ_key] = str(policy.restarts)
+                proc = subprocess.Popen(args, env=new_environ)
+                returncode = proc.wait()
+                proc = None
+
+                reason = classify_exit(returncode)
+                if reason == "clean":
+                    return 0
+                if reason != "crashed":
+                    self.out(
+                        "Server %s, not restarting it" % describe_returncode(returncode)
+                    )
+                    return returncode if reason == "fatal" else 0
+
+                delay = policy.failed()
+                if delay is None:
+                    self.out(
+                        "Server %s, it died %d times within %gs, giving up"
+                        % (
+                            describe_returncode(returncode),
+                            policy.recent_failures,
+                            policy.window,
+                        ),
+                        error=True,
+                    )
                     return 1
-            finally:
-                if proc is not None:
-                    import signal
-
-                    try:
-                        kill(proc.pid, signal.SIGTERM)
-                    except (OSError, IOError):
-                        pass
-
-            if self.verbose > 0:
-                self.out("%s %s %s" % ("-" * 20, "Server died, restarting", "-" * 20))
+                self.out(
+                    "Server %s (%d failures within %gs), restarting in %.1fs"
+                    % (
+                        describe_returncode(returncode),
+                        policy.recent_failures,
+                        policy.window,
+                        delay,
+                    )
+                )
+                time.sleep(delay)
+        except (KeyboardInterrupt, SystemExit):
+            self.out("Stopping monitored server")
+            if self.verbose > 1:
+                raise
+            return 1
+        finally:
+            if proc is not None:
+                try:
+                    stop_process(proc.pid, getattr(opts, "graceful_timeout", 30) + 10)
+                except (TimeoutError, OSError):
+                    pass
 
     def change_user_group(self, user, group):  # pragma: no cover
         if not user and not group:
@@ -584,6 +1239,134 @@ def live_pidfile(pidfile):  # pragma: no cover
     return None
 
 
+def server_address(server_conf, runner=None):
+    """The ``(host, port)`` the server configured by ``server_conf`` listens on.
+
+    Follows the defaults of ``runner``, the server runner or factory the
+    server is started with: :func:`cherrypy_server_runner` listens on
+    127.0.0.1 and accepts a ``host:port`` host, the other servers on
+    0.0.0.0, :func:`wsgiref_server_runner` on port 4443 when both its
+    certificate and key files are set, and 8080 otherwise.
+    """
+    if runner is cherrypy_server_runner:
+        host = server_conf.get("host") or "127.0.0.1"
+        port = server_conf.get("port")
+        if not port and server_conf.get("ssl_pem"):
+            port = 4443
+        if not port and ":" in host and not host.startswith("["):
+            host, port = host.rsplit(":", 1)
+        port = port or 8080
+    else:
+        host = server_conf.get("host", "0.0.0.0")
+        secure = runner is wsgiref_server_runner and (
+            server_conf.get("wsgiref.certfile") and server_conf.get("wsgiref.keyfile")
+        )
+        port = server_conf.get("port", 4443 if secure else 8080)
+    return host.strip("[]"), int(port)
+
+
+def server_backlog(server_conf):
+    """Size of the listen queue configured for the server"""
+    return int(
+        server_conf.get("backlog")
+        or server_conf.get("wsgiref.backlog")
+        or server_conf.get("asyncio.backlog")
+        or sockets.DEFAULT_BACKLOG
+    )
+
+
+def adopts_inherited_sockets(server_context):
+    """Whether the server serves from the :func:`sockets.inherited_socket`.
+
+    That's the case of the gearbox server runners.
+    """
+    return getattr(server_context.object, "__module__", None) == __name__
+
+
+def worker_pid_file(pid_file, slot):
+    """PID file of the worker in ``slot`` of the server using ``pid_file``.
+
+    ``gearbox.pid`` becomes ``gearbox.0.pid`` for the first worker.
+    """
+    root, ext = os.path.splitext(pid_file)
+    return "%s.%d%s" % (root, slot, ext)
+
+
+def worker_pid_files(pid_file):
+    """The ``(slot, filename)`` of the existing worker PID files of ``pid_file``"""
+    root, ext = os.path.splitext(pid_file)
+    found = []
+    for filename in glob.glob("%s.*%s" % (glob.escape(root), glob.escape(ext))):
+        slot = filename[len(root) + 1 : len(filename) - len(ext)]
+        if slot.isdigit():
+            found.append((int(slot), filename))
+    return sorted(found)
+
+
+def request_summary(stats):
+    """Requests served and being served, and latency quantiles in seconds,
+    from :class:`~gearbox.utils.metrics.RequestStats`, when recorded.
+    """
+    if stats is None:
+        return {"requests": None, "in_flight": None, "latency": None}
+    latency = stats.latency
+    return {
+        "requests": latency.count,
+        "in_flight": stats.in_flight,
+        "latency": {
+            "p50": latency.quantile(0.5) / 10**6,
+            "p99": latency.quantile(0.99) / 10**6,
+        },
+    }
+
+
+def describe_process(status):
+    """Uptime and memory of a process from its ``gearbox serve status``"""
+    details = ""
+    if status.get("uptime") is not None:
+        details += ", up %s" % format_duration(status["uptime"])
+    if status.get("rss") is not None:
+        details += ", RSS %s" % format_size(status["rss"])
+    return details
+
+
+def describe_requests(status):
+    """Request statistics from a ``gearbox serve status``"""
+    if status.get("requests") is None:
+        return "not recorded, serve with --metrics to record them"
+    return "%d served, %d in flight, p50 %s, p99 %s" % (
+        status["requests"],
+        status["in_flight"],
+        format_duration(status["latency"]["p50"]),
+        format_duration(status["latency"]["p99"]),
+    )
+
+
+def format_duration(seconds):
+    if seconds < 1:
+        return "%.1fms" % (seconds * 1000)
+    if seconds < 60:
+        return "%.1fs" % seconds
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    if days:
+        return "%dd%02dh%02dm" % (days, hours, minutes)
+    if hours:
+        return "%dh%02dm%02ds" % (hours, minutes, seconds)
+    return "%dm%02ds" % (minutes, seconds)
+
+
+def format_size(size):
+    if size < 1024:
+        return "%dB" % size
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if size < 1024:
+            break
+    return "%.1f%s" % (size, unit)
+
+
 def read_pidfile(filename):
     if os.path.exists(filename):
         try:
@@ -600,15 +1383,7 @@ def _turn_sigterm_into_systemexit():  # pragma: no cover
     """
     Attempts to turn a SIGTERM exception into a SystemExit exception.
     """
-    try:
-        import signal
-    except ImportError:
-        return
-
-    def handle_term(signo, frame):
-        raise SystemExit
-
-    signal.signal(signal.SIGTERM, handle_term)
+    signal.signal(signal.SIGTERM, terminate)
 
 
 # For paste.deploy server instantiation (egg:gearbox#wsgiref)
@@ -631,12 +1406,36 @@ def wsgiref_server_runner(wsgi_app, global_conf, **kw):  # pragma: no cover
 
         The file names should contain full paths.
 
+    ``wsgiref.threaded``
+
+        Serve each connection in a new thread.
+
+    ``wsgiref.threads``, ``wsgiref.queue_size``
+
+        Serve connections from a pool of ``wsgiref.threads`` threads.
+        When more than ``wsgiref.queue_size`` connections (by default
+        four per thread) are waiting for a thread, new connections are
+        answered with ``503 Service Unavailable``.
+
+    ``wsgiref.backlog``
+
+        Size of the listen queue of the server socket.
+
+    ``wsgiref.keepalive``, ``wsgiref.keepalive_timeout``, ``wsgiref.keepalive_requests``
+
+        Speak HTTP/1.1 and keep connections open between requests, until
+        they are idle for ``wsgiref.keepalive_timeout`` seconds (default 5)
+        or served ``wsgiref.keepalive_requests`` requests (default 100).
+
     """
     from wsgiref.simple_server import WSGIServer, make_server
 
     host = kw.get("host", "0.0.0.0")
     port = int(kw.get("port", 8080))
     threaded = asbool(kw.get("wsgiref.threaded", False))
+    threads = int(kw.get("wsgiref.threads", 0))
+    backlog = kw.get("wsgiref.backlog")
+    keepalive = asbool(kw.get("wsgiref.keepalive", False))
 
     server_class = WSGIServer
     certfile = kw.get("wsgiref.certfile")
@@ -664,27 +1463,125 @@ def wsgiref_server_runner(wsgi_app, global_conf, **kw):  # pragma: no cover
         port = int(kw.get("port", 4443))
         server_class = SecureWSGIServer
 
-    if threaded:
+    if threads:
+        from gearbox.utils.wsgiserver import ThreadPoolMixIn
+
+        class GearboxWSGIServer(
+            sockets.InheritedSocketMixIn, ThreadPoolMixIn, server_class
+        ):
+            pool_size = threads
+            max_queued = int(kw.get("wsgiref.queue_size", threads * 4))
+            request_queue_size = int(backlog or sockets.DEFAULT_BACKLOG)
+
+        server_type = "Pooled"
+    elif threaded:
         from socketserver import ThreadingMixIn
 
-        class GearboxWSGIServer(ThreadingMixIn, server_class):
+        class GearboxWSGIServer(
+            sockets.InheritedSocketMixIn, ThreadingMixIn, server_class
+        ):
             pass
 
         server_type = "Threaded"
     else:
 
-        class GearboxWSGIServer(server_class):
+        class GearboxWSGIServer(sockets.InheritedSocketMixIn, server_class):
             pass
 
         server_type = "Standard"
 
-    server = make_server(host, port, wsgi_app, server_class=GearboxWSGIServer)
+    if backlog:
+        GearboxWSGIServer.request_queue_size = int(backlog)
+
+    from gearbox.utils.wsgiserver import (
+        GearboxWSGIRequestHandler,
+        KeepAliveWSGIRequestHandler,
+    )
+
+    handler_class = GearboxWSGIRequestHandler
+    if keepalive:
+
+        class handler_class(KeepAliveWSGIRequestHandler):
+            timeout = float(kw.get("wsgiref.keepalive_timeout", 5))
+            max_requests = int(kw.get("wsgiref.keepalive_requests", 100))
+
+        server_type += " Keep-Alive"
+
+    server = make_server(
+        host,
+        port,
+        wsgi_app,
+        server_class=GearboxWSGIServer,
+        handler_class=handler_class,
+    )
     if certfile and keyfile:
         server_type += " Secure"
         scheme += "s"
     ServeCommand.out(
         "Starting %s HTTP server on %s://%s:%s" % (server_type, scheme, host, port)
     )
+    try:
+        server.serve_forever()
+    finally:
+        # Lets the requests being served complete.
+        server.server_close()
+
+
+# For paste.deploy server instantiation (egg:gearbox#asyncio)
+def asyncio_server_runner(wsgi_app, global_conf, **kw):  # pragma: no cover
+    """
+    Entry point for gearbox's asyncio based WSGI server
+
+    Connections are handled by an asyncio event loop, while the
+    application runs in a pool of threads. Unlike gevent, this
+    requires no monkey patching.
+
+    Additional parameters:
+
+    ``asyncio.threads``
+
+        Number of threads running the application (default 10).
+
+    ``asyncio.keepalive_timeout``
+
+        Seconds a connection can stay idle between requests (default 5).
+
+    ``asyncio.body_timeout``
+
+        Seconds a client can take to send each part of the request body,
+        slower clients are answered 408 Request Timeout (default 30).
+
+    ``asyncio.max_body_size``
+
+        Largest chunked request body accepted, in bytes (default 10MB).
+
+    ``asyncio.backlog``
+
+        Size of the listen queue of the server socket.
+
+    ``asyncio.graceful_timeout``
+
+        Seconds the requests in progress have to complete when the server
+        is stopped (default 30).
+
+    """
+    from gearbox.utils.aioserver import AsyncioWSGIServer
+
+    host = kw.get("host", "0.0.0.0")
+    port = int(kw.get("port", 8080))
+    server = AsyncioWSGIServer(
+        wsgi_app,
+        host,
+        port,
+        threads=int(kw.get("asyncio.threads", 10)),
+        sock=sockets.inherited_socket(),
+        keepalive_timeout=float(kw.get("asyncio.keepalive_timeout", 5)),
+        body_timeout=float(kw.get("asyncio.body_timeout", 30)),
+        max_body_size=int(kw.get("asyncio.max_body_size", 10 * 1024 * 1024)),
+        backlog=int(kw.get("asyncio.backlog", sockets.DEFAULT_BACKLOG)),
+        graceful_timeout=float(kw.get("asyncio.graceful_timeout", 30)),
+    )
+    ServeCommand.out("Starting asyncio HTTP server on http://%s:%s" % (host, port))
     server.serve_forever()
 
 
@@ -702,7 +1599,8 @@ def gevent_server_factory(global_config, **kw):
 
     def _gevent_serve(wsgi_app):
         ServeCommand.out("Starting Gevent HTTP server on http://%s:%s" % (host, port))
-        WSGIServer((host, port), wsgi_app).serve_forever()
+        listener = sockets.inherited_socket() or (host, port)
+        WSGIServer(listener, wsgi_app).serve_forever()
 
     return _gevent_serve
 
@@ -800,7 +1698,19 @@ def cherrypy_server_runner(
 
     import cheroot.wsgi as wsgiserver
 
-    server = wsgiserver.Server(bind_addr, app, server_name=server_name, **kwargs)
+    server_class = wsgiserver.Server
+    listener = sockets.inherited_socket()
+    if listener is not None:
+
+        class InheritedSocketServer(wsgiserver.Server):
+            def bind(self, family, type, proto=0):
+                self.socket = listener
+                self.bind_addr = listener.getsockname()[:2]
+                return listener
+
+        server_class = InheritedSocketServer
+
+    server = server_class(bind_addr, app, server_name=server_name, **kwargs)
 
     server.ssl_certificate = server.ssl_private_key = ssl_pem
     if protocol_version:
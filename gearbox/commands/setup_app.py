@@ -1,14 +1,17 @@
 import importlib
 import os
 
-from paste.deploy import appconfig
-
 from gearbox.command import Command
+from gearbox.utils.lazy import lazy_import
+
+appconfig = lazy_import("paste.deploy", "appconfig")
 
 
 class SetupAppCommand(Command):
+    summary = "Setup an application, given a config file"
+
     def get_description(self):
-        return "Setup an application, given a config file"
+        return self.summary
 
     def get_parser(self, prog_name):
         parser = super().get_parser(prog_name)
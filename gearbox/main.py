@@ -1,6 +1,4 @@
 import argparse
-import importlib.metadata
-import inspect
 import logging
 import os
 import re
@@ -9,11 +7,38 @@ import warnings
 
 from .commandmanager import CommandManager
 from .commands.help import HelpAction, HelpCommand
-from .utils.plugins import find_local_distribution
+from .utils.lazy import lazy_import
+from .utils.plugins import find_local_distribution, get_entry_point_index
+
+inspect = lazy_import("inspect")
+metadata = lazy_import("importlib.metadata")
 
 log = logging.getLogger("gearbox")
 
 
+class _GearboxVersion:
+    """Looks up the gearbox version only when it gets printed."""
+
+    def __get__(self, obj, objtype=None):
+        version = get_entry_point_index().version("gearbox")
+        if version is None:
+            try:
+                version = metadata.version("gearbox")
+            except metadata.PackageNotFoundError:
+                version = "unknown"
+        return version
+
+
+class _VersionAction(argparse.Action):
+    def __init__(self, option_strings, dest, app, help=None):
+        super().__init__(option_strings, dest=argparse.SUPPRESS, nargs=0, help=help)
+        self.app = app
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        parser._print_message("%s %s\n" % (parser.prog, self.app.VERSION), sys.stdout)
+        parser.exit()
+
+
 class GearBox:
     NAME = os.path.splitext(os.path.basename(sys.argv[0]))[0]
     LOG_DATE_FORMAT = "%H:%M:%S"
@@ -22,10 +47,7 @@ class GearBox:
     )
     DEFAULT_VERBOSE_LEVEL = 1
 
-    try:
-        VERSION = importlib.metadata.version("gearbox")
-    except importlib.metadata.PackageNotFoundError:
-        VERSION = "unknown"
+    VERSION = _GearboxVersion()
 
     def __init__(self):
         self.command_manager = CommandManager("gearbox.commands")
@@ -37,8 +59,9 @@ class GearBox:
         parser = self.parser
         parser.add_argument(
             "--version",
-            action="version",
-            version="%(prog)s {0}".format(self.VERSION),
+            action=_VersionAction,
+            app=self,
+            help="show program's version number and exit",
         )
 
         verbose_group = parser.add_mutually_exclusive_group()
@@ -198,11 +221,10 @@ class GearBox:
                 self.load_commands_for_package(ep.module, search_paths=[search_path])
 
     def load_commands_for_package(self, package_name, search_paths=None):
+        index = get_entry_point_index()
         candidates = [package_name]
         top_level_package = package_name.split(".", 1)[0]
-        for candidate in importlib.metadata.packages_distributions().get(
-            top_level_package, []
-        ):
+        for candidate in index.packages_distributions().get(top_level_package, []):
             if candidate not in candidates:
                 candidates.append(candidate)
 
@@ -211,8 +233,7 @@ class GearBox:
             for path in search_paths:
                 if not path:
                     continue
-                path_distributions = importlib.metadata.distributions(path=[path])
-                local_distributions.extend(path_distributions)
+                local_distributions.extend(index.distributions(path=[path]))
 
         normalized_candidates = set(
             self._normalize_dist_name(name) for name in candidates
@@ -221,25 +242,15 @@ class GearBox:
 
         for dist in local_distributions:
             matched = False
-            dist_name = dist.metadata.get("Name")
-            if (
-                dist_name
-                and self._normalize_dist_name(dist_name) in normalized_candidates
-            ):
-                candidate_name = dist_name
-                if candidate_name not in candidates:
-                    candidates.append(candidate_name)
+            if self._normalize_dist_name(dist.name) in normalized_candidates:
+                if dist.name not in candidates:
+                    candidates.append(dist.name)
                 matched = True
 
-            top_level_names = dist.read_text("top_level.txt")
-            if top_level_names:
-                for top_level_name in top_level_names.splitlines():
-                    if top_level_name.strip() == top_level_package:
-                        candidate_name = dist.metadata.get("Name")
-                        if candidate_name and candidate_name not in candidates:
-                            candidates.append(candidate_name)
-                        matched = True
-                        break
+            if top_level_package in dist.top_level:
+                if dist.name not in candidates:
+                    candidates.append(dist.name)
+                matched = True
             if matched:
                 local_candidate_distributions.append(dist)
 
@@ -256,15 +267,15 @@ class GearBox:
 
         for candidate in candidates:
             if any(
-                self._normalize_dist_name(dist.metadata.get("Name", ""))
+                self._normalize_dist_name(dist.name)
                 == self._normalize_dist_name(candidate)
                 for dist in local_candidate_distributions
             ):
                 continue
 
             try:
-                dist = importlib.metadata.distribution(candidate)
-            except importlib.metadata.PackageNotFoundError:
+                dist = metadata.distribution(candidate)
+            except metadata.PackageNotFoundError:
                 continue
             found_distribution = True
             loaded_commands = False
@@ -1,13 +1,14 @@
 import os
 
-from tempita import Template
-
 from .utils.copydir import copy_dir
+from .utils.lazy import lazy_import
+
+tempita = lazy_import("tempita")
 
 
 class GearBoxTemplate:
     def template_renderer(self, content, vars, filename=None):
-        tmpl = Template(content, name=filename)
+        tmpl = tempita.Template(content, name=filename)
         return tmpl.substitute(vars)
 
     def pre(self, template_dir, output_dir, vars):
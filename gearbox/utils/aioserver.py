@@ -0,0 +1,610 @@
+import asyncio
+import concurrent.futures
+import email.utils
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from urllib.parse import unquote_to_bytes
+
+from .sockets import DEFAULT_BACKLOG
+from .wsgiserver import FileWrapper
+
+_BODYLESS_STATUS = ("204", "304")
+
+
+class BadRequest(Exception):
+    pass
+
+
+class RequestTimeout(TimeoutError):
+    """Raised by ``wsgi.input`` when the client is too slow sending the body"""
+
+
+class AsyncioWSGIServer:
+    """WSGI server built on asyncio streams.
+
+    Connections are accepted and HTTP is parsed on the event loop, so
+    idle and slow clients only cost a coroutine. The application is
+    called in a pool of ``threads`` threads, which block on the event
+    loop while the client is not keeping up with the response, so
+    streamed bodies are never buffered in memory as a whole.
+
+    :param app: The WSGI application to serve.
+    :param host: Address to listen on, ignored when ``sock`` is given.
+    :param port: Port to listen on, ignored when ``sock`` is given.
+    :param threads: Number of threads running the application.
+    :param sock: Already bound socket to serve from.
+    :param keepalive_timeout: Seconds a connection can stay idle between requests.
+    :param body_timeout: Seconds the client can take to send each part of
+                         the request body, after which it is answered
+                         with ``408 Request Timeout`` and disconnected.
+    :param max_body_size: Largest chunked request body accepted, in bytes.
+    :param backlog: Size of the listen queue of the socket.
+    :param graceful_timeout: Seconds the requests in progress have to
+                             complete once the server is stopped, by
+                             :meth:`shutdown`, ``SIGTERM`` or ``SIGINT``.
+    """
+
+    #: Signals stopping the server, when served from the main thread.
+    STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+    #: Largest request line and headers accepted.
+    max_header_size = 65536
+
+    #: Bytes of request body left unread by the application that are
+    #: skipped to serve the next request, larger leftovers close the
+    #: connection instead.
+    max_drain = 65536
+
+    #: Output buffered for a client before the application is paused.
+    write_buffer_size = 65536
+
+    def __init__(
+        self,
+        app,
+        host="0.0.0.0",
+        port=8080,
+        threads=10,
+        sock=None,
+        keepalive_timeout=5,
+        max_body_size=10 * 1024 * 1024,
+        backlog=DEFAULT_BACKLOG,
+        body_timeout=30,
+        graceful_timeout=30,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.threads = threads
+        self.sock = sock
+        self.keepalive_timeout = keepalive_timeout
+        self.body_timeout = body_timeout
+        self.max_body_size = max_body_size
+        self.backlog = backlog
+        self.graceful_timeout = graceful_timeout
+        self.started = threading.Event()
+        self.server_port = None
+        self._loop = None
+        self._stop = None
+        self._executor = None
+        self._connections = set()
+        # Connections waiting for their next request.
+        self._idle = set()
+
+    def serve_forever(self):
+        """Serve requests until :meth:`shutdown` is called or a stop signal
+        is received, then let the requests in progress complete.
+        """
+        asyncio.run(self._serve())
+
+    def shutdown(self):
+        """Stop :meth:`serve_forever`, can be called from any thread"""
+        self.started.wait()
+        self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            self.threads, thread_name_prefix="gearbox-asyncio"
+        )
+        if self.sock is not None:
+            listen = {"sock": self.sock}
+        else:
+            listen = {"host": self.host, "port": self.port, "reuse_address": True}
+        server = await asyncio.start_server(
+            self._handle_connection,
+            limit=self.max_header_size,
+            backlog=self.backlog,
+            **listen,
+        )
+        self.server_port = server.sockets[0].getsockname()[1]
+        previous_handlers = self._install_signal_handlers()
+        self.started.set()
+        try:
+            async with server:
+                await self._stop.wait()
+                server.close()
+                await self._drain()
+        finally:
+            for signum, handler in previous_handlers.items():
+                self._loop.remove_signal_handler(signum)
+                signal.signal(signum, handler)
+            # Off the event loop, which application threads still use.
+            await asyncio.to_thread(
+                self._executor.shutdown, wait=True, cancel_futures=True
+            )
+
+    def _install_signal_handlers(self):
+        """Stop on :data:`STOP_SIGNALS`, returns the previous handlers"""
+        if threading.current_thread() is not threading.main_thread():
+            return {}
+        previous_handlers = {}
+        for signum in self.STOP_SIGNALS:
+            previous_handlers[signum] = signal.getsignal(signum)
+            self._loop.add_signal_handler(signum, self._stop.set)
+        return previous_handlers
+
+    async def _drain(self):
+        """Close idle connections and wait for the requests in progress"""
+        for task in self._idle:
+            task.cancel()
+        if self._connections:
+            _, pending = await asyncio.wait(
+                self._connections, timeout=self.graceful_timeout
+            )
+            for task in pending:
+                task.cancel()
+
+    async def _handle_connection(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=self.write_buffer_size)
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (
+            ConnectionError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+        ):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def _handle_request(self, reader, writer):
+        """Serve one request, returns whether the connection can be reused"""
+        if self._stop.is_set():
+            return False
+        task = asyncio.current_task()
+        self._idle.add(task)
+        try:
+            head = await asyncio.wait_for(
+                reader.readuntil(b"\r\n\r\n"), self.keepalive_timeout
+            )
+        except asyncio.LimitOverrunError:
+            await _send_error(writer, "431 Request Header Fields Too Large")
+            return False
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return False
+        finally:
+            self._idle.discard(task)
+
+        try:
+            environ, keep_alive = self._parse_head(head, writer)
+            if environ.get("HTTP_EXPECT", "").lower() == "100-continue":
+                writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            if environ.pop("gearbox.chunked_input", False):
+                body = await asyncio.wait_for(
+                    _read_chunked(reader, self.max_body_size), self.body_timeout
+                )
+                environ["CONTENT_LENGTH"] = str(len(body))
+                body_input = BufferedInput(body)
+            else:
+                body_input = StreamInput(
+                    reader,
+                    int(environ.get("CONTENT_LENGTH") or 0),
+                    self._loop,
+                    self.body_timeout,
+                )
+        except BadRequest as e:
+            await _send_error(writer, str(e))
+            return False
+        except asyncio.TimeoutError:
+            await _send_error(writer, "408 Request Timeout")
+            return False
+        environ["wsgi.input"] = body_input
+
+        response = Response(writer, environ, keep_alive, self._stop)
+        await self._loop.run_in_executor(
+            self._executor, self._run_app, environ, response
+        )
+        if not response.keep_alive or body_input.timed_out:
+            return False
+        leftover = body_input.unread
+        if leftover > self.max_drain:
+            return False
+        if leftover:
+            try:
+                await asyncio.wait_for(reader.readexactly(leftover), self.body_timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def _parse_head(self, head, writer):
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ")
+        except ValueError:
+            raise BadRequest("400 Bad Request")
+        if version not in ("HTTP/1.0", "HTTP/1.1"):
+            raise BadRequest("505 HTTP Version Not Supported")
+
+        path, _, query = target.partition("?")
+        sockname = writer.get_extra_info("sockname") or ("", 0)
+        peername = writer.get_extra_info("peername") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": method,
+            "SCRIPT_NAME": "",
+            "PATH_INFO": unquote_to_bytes(path).decode("latin-1"),
+            "QUERY_STRING": query,
+            "SERVER_NAME": str(sockname[0]),
+            "SERVER_PORT": str(sockname[1]),
+            "SERVER_PROTOCOL": version,
+            "REMOTE_ADDR": str(peername[0]),
+            "REMOTE_PORT": str(peername[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            "wsgi.input_terminated": True,
+            "wsgi.file_wrapper": FileWrapper,
+        }
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(":")
+            if not sep or not name or name != name.strip():
+                raise BadRequest("400 Bad Request")
+            key = name.upper().replace("-", "_")
+            value = value.strip()
+            if key == "CONTENT_TYPE" or key == "CONTENT_LENGTH":
+                environ[key] = value
+                continue
+            key = "HTTP_" + key
+            if key in environ:
+                value = environ[key] + "," + value
+            environ[key] = value
+
+        connection = environ.get("HTTP_CONNECTION", "").lower()
+        if version == "HTTP/1.1":
+            keep_alive = "close" not in connection
+        else:
+            keep_alive = "keep-alive" in connection
+
+        if "chunked" in environ.get("HTTP_TRANSFER_ENCODING", "").lower():
+            environ.pop("CONTENT_LENGTH", None)
+            environ["gearbox.chunked_input"] = True
+        elif environ.get("CONTENT_LENGTH"):
+            if not environ["CONTENT_LENGTH"].isdigit():
+                raise BadRequest("400 Bad Request")
+        return environ, keep_alive
+
+    def _run_app(self, environ, response):
+        """Call the application, in one of the threads of the executor"""
+        result = None
+        try:
+            result = self.app(environ, response.start_response)
+            if isinstance(result, FileWrapper) and response.sendfile(result):
+                return
+            if (
+                isinstance(result, (list, tuple))
+                and len(result) == 1
+                and response.headers is not None
+                and response.get_header("Content-Length") is None
+            ):
+                response.headers.append(("Content-Length", str(len(result[0]))))
+            for data in result:
+                if data:
+                    response.write(data)
+            response.finish()
+        except ConnectionError:
+            # The client went away.
+            response.keep_alive = False
+        except RequestTimeout:
+            response.keep_alive = False
+            if not response.headers_sent:
+                response.status = "408 Request Timeout"
+                response.headers = [
+                    ("Content-Type", "text/plain"),
+                    ("Content-Length", "16"),
+                    ("Connection", "close"),
+                ]
+                response.write(b"Request Timeout\n")
+                response.finish()
+        except Exception:
+            traceback.print_exc(file=environ["wsgi.errors"])
+            if response.headers_sent:
+                # The response can't be completed anymore.
+                response.keep_alive = False
+                return
+            response.status = "500 Internal Server Error"
+            response.headers = [
+                ("Content-Type", "text/plain"),
+                ("Content-Length", "22"),
+            ]
+            response.write(b"Internal Server Error\n")
+            response.finish()
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+class Response:
+    """Response to a request served by :class:`AsyncioWSGIServer`.
+
+    ``start_response`` and ``write`` are meant to be called from the
+    application thread, the output is written on the event loop and
+    ``write`` waits for it to be flushed to the client. Connections are
+    not kept alive once the ``stopping`` event is set.
+    """
+
+    def __init__(self, writer, environ, keep_alive, stopping=None):
+        self.writer = writer
+        self.environ = environ
+        self.keep_alive = keep_alive
+        self.stopping = stopping
+        self.loop = asyncio.get_running_loop()
+        self.status = None
+        self.headers = None
+        self.headers_sent = False
+        self.chunked = False
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if self.headers_sent:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("Headers already set")
+        self.status = status
+        self.headers = list(headers)
+        return self.write
+
+    def get_header(self, name):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return None
+
+    def write(self, data):
+        if self.status is None:
+            raise AssertionError("write() before start_response()")
+        asyncio.run_coroutine_threadsafe(self._write(data), self.loop).result()
+
+    def finish(self):
+        asyncio.run_coroutine_threadsafe(self._finish(), self.loop).result()
+
+    def sendfile(self, file_wrapper):
+        """Send the :class:`FileWrapper` response, ``False`` if it's no regular file"""
+        fd = file_wrapper.fileno()
+        if fd is None or self.status is None:
+            return False
+        filelike = file_wrapper.filelike
+        offset = filelike.tell()
+        count = max(os.fstat(fd).st_size - offset, 0)
+        length = self.get_header("Content-Length")
+        if length is None:
+            self.headers.append(("Content-Length", str(count)))
+        else:
+            count = min(count, int(length))
+        asyncio.run_coroutine_threadsafe(
+            self._sendfile(filelike, offset, count), self.loop
+        ).result()
+        return True
+
+    async def _write(self, data):
+        if not self.headers_sent:
+            self._send_headers()
+        if data and self.environ["REQUEST_METHOD"] != "HEAD":
+            if self.chunked:
+                data = b"%x\r\n%s\r\n" % (len(data), data)
+            self.writer.write(data)
+        await self.writer.drain()
+
+    async def _sendfile(self, filelike, offset, count):
+        self._send_headers()
+        await self.writer.drain()
+        if count and self.environ["REQUEST_METHOD"] != "HEAD":
+            # Uses os.sendfile, falling back to reading the file for TLS.
+            await self.loop.sendfile(self.writer.transport, filelike, offset, count)
+
+    async def _finish(self):
+        if not self.headers_sent:
+            if self.get_header("Content-Length") is None:
+                self.headers.append(("Content-Length", "0"))
+            self._send_headers()
+        if self.chunked:
+            self.writer.write(b"0\r\n\r\n")
+        await self.writer.drain()
+
+    def _send_headers(self):
+        self.headers_sent = True
+        version = self.environ["SERVER_PROTOCOL"]
+        headers = self.headers
+        names = {name.lower() for name, _ in headers}
+        if self.stopping is not None and self.stopping.is_set():
+            self.keep_alive = False
+        if "connection" in names and self.get_header("Connection").lower() == "close":
+            self.keep_alive = False
+        if (
+            "content-length" not in names
+            and self.environ["REQUEST_METHOD"] != "HEAD"
+            and self.status[:3] not in _BODYLESS_STATUS
+        ):
+            if version == "HTTP/1.1":
+                headers.append(("Transfer-Encoding", "chunked"))
+                self.chunked = True
+            else:
+                self.keep_alive = False
+        if "connection" not in names:
+            if not self.keep_alive:
+                headers.append(("Connection", "close"))
+            elif version == "HTTP/1.0":
+                headers.append(("Connection", "keep-alive"))
+        if "date" not in names:
+            headers.append(("Date", _http_date()))
+        if "server" not in names:
+            headers.append(("Server", "gearbox"))
+
+        lines = ["HTTP/1.1 %s\r\n" % self.status]
+        lines.extend("%s: %s\r\n" % header for header in headers)
+        lines.append("\r\n")
+        self.writer.write("".join(lines).encode("latin-1"))
+
+
+class StreamInput:
+    """``wsgi.input`` reading the request body from the event loop.
+
+    Reads at most ``length`` bytes, so the application can't consume
+    the next request of the connection. Reads waiting more than
+    ``timeout`` seconds for the client raise :class:`RequestTimeout`,
+    so slow clients can't hold application threads.
+    """
+
+    chunk_size = 65536
+
+    def __init__(self, reader, length, loop, timeout=None):
+        self._reader = reader
+        self._loop = loop
+        self._timeout = timeout
+        #: Whether a read timed out, the rest of the body is then lost.
+        self.timed_out = False
+        self._buffer = b""
+        self._pending = length
+
+    @property
+    def unread(self):
+        """Bytes of the body still to be read from the connection"""
+        return self._pending
+
+    def _fill(self, size):
+        size = min(max(size, self.chunk_size), self._pending)
+        try:
+            data = asyncio.run_coroutine_threadsafe(
+                asyncio.wait_for(self._reader.read(size), self._timeout), self._loop
+            ).result()
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            self._pending = 0
+            raise RequestTimeout("Client too slow sending the body")
+        if not data:
+            raise ConnectionError("Client disconnected while sending the body")
+        self._pending -= len(data)
+        self._buffer += data
+
+    def _take(self, size):
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self._buffer) + self._pending
+        while len(self._buffer) < size and self._pending:
+            self._fill(size - len(self._buffer))
+        return self._take(size)
+
+    def readline(self, size=-1):
+        while True:
+            end = self._buffer.find(b"\n") + 1
+            if end or not self._pending:
+                break
+            if size is not None and 0 <= size <= len(self._buffer):
+                break
+            self._fill(self.chunk_size)
+        if not end:
+            end = len(self._buffer)
+        if size is not None and 0 <= size < end:
+            end = size
+        return self._take(end)
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+
+class BufferedInput(StreamInput):
+    """``wsgi.input`` of a request body that was already read in full"""
+
+    def __init__(self, body):
+        super().__init__(None, 0, None)
+        self._buffer = body
+
+
+async def _read_chunked(reader, max_size):
+    body = []
+    size = 0
+    while True:
+        line = await reader.readuntil(b"\r\n")
+        try:
+            chunk_size = int(line.split(b";", 1)[0], 16)
+        except ValueError:
+            raise BadRequest("400 Bad Request")
+        if not chunk_size:
+            # Skip the trailers
+            while await reader.readuntil(b"\r\n") != b"\r\n":
+                pass
+            return b"".join(body)
+        size += chunk_size
+        if size > max_size:
+            raise BadRequest("413 Content Too Large")
+        body.append(await reader.readexactly(chunk_size))
+        await reader.readexactly(2)
+
+
+async def _send_error(writer, status):
+    body = status.encode("latin-1") + b"\n"
+    writer.write(
+        b"HTTP/1.1 %s\r\nContent-Type: text/plain\r\nContent-Length: %d\r\n"
+        b"Connection: close\r\n\r\n%s" % (status.encode("latin-1"), len(body), body)
+    )
+    try:
+        await writer.drain()
+    except ConnectionError:
+        pass
+
+
+_date_cache = [0, ""]
+
+
+def _http_date():
+    now = int(time.time())
+    if _date_cache[0] != now:
+        _date_cache[:] = [now, email.utils.formatdate(now, usegmt=True)]
+    return _date_cache[1]
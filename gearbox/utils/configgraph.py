@@ -0,0 +1,75 @@
+import configparser
+import os
+import re
+
+_CONFIG_URI_RE = re.compile(r"^config:(?P<path>[^#]+)")
+
+# Resolved graphs by root configuration file: the modification time of
+# each file of the graph when it was resolved, and the files in order.
+_cache = {}
+
+
+def config_files(config_file):
+    """Files of the PasteDeploy configuration starting at ``config_file``.
+
+    ``config:`` references, like ``use = config:base.ini#main``, are
+    followed recursively. Paths are resolved relative to the file they
+    appear in, as PasteDeploy does, and ``%(here)s`` is expanded.
+    Referenced files that don't exist are still listed, so that their
+    creation can be noticed.
+
+    The graph is only parsed again when one of its files changed, so
+    this can be called on every reload.
+    """
+    config_file = os.path.abspath(config_file)
+    cached = _cache.get(config_file)
+    if cached is not None:
+        mtimes, files = cached
+        if all(_mtime(f) == mtime for f, mtime in mtimes.items()):
+            return list(files)
+
+    files = []
+    pending = [config_file]
+    while pending:
+        filename = pending.pop(0)
+        if filename in files:
+            continue
+        files.append(filename)
+        pending.extend(_config_references(filename))
+
+    _cache[config_file] = ({f: _mtime(f) for f in files}, files)
+    return list(files)
+
+
+def _config_references(filename):
+    """Paths of the configuration files referenced by ``filename``"""
+    here = os.path.dirname(filename)
+    parser = configparser.ConfigParser(
+        defaults={"here": here, "__file__": filename}, strict=False
+    )
+    parser.optionxform = str
+    try:
+        with open(filename, encoding="utf-8") as f:
+            parser.read_file(f)
+    except (OSError, UnicodeDecodeError, configparser.Error):
+        return []
+
+    references = []
+    for section in parser.sections():
+        for option in parser.options(section):
+            try:
+                value = parser.get(section, option)
+            except configparser.Error:
+                value = parser.get(section, option, raw=True).replace("%(here)s", here)
+            match = _CONFIG_URI_RE.match(value.strip())
+            if match:
+                path = os.path.join(here, match.group("path").strip())
+                references.append(os.path.normpath(path))
+    return references
+
+
+def _mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
@@ -0,0 +1,111 @@
+import json
+import os
+import socket
+import threading
+
+
+def socket_path(pid_file):
+    """Control socket of the server using ``pid_file``.
+
+    ``gearbox.pid`` becomes ``gearbox.sock``.
+    """
+    root, _ = os.path.splitext(pid_file)
+    return root + ".sock"
+
+
+class ControlServer:
+    """Answers the commands sent by ``gearbox serve`` on a Unix socket.
+
+    Each connection sends a command name on a line and gets back a JSON
+    object on a line, possibly along with file descriptors passed as
+    ``SCM_RIGHTS`` ancillary data.
+
+    :param path: Where the socket is created, replacing any existing one.
+    :param commands: Maps command names to callables receiving a
+                     ``reply(response, fds=())`` function to answer with.
+    """
+
+    def __init__(self, path, commands):
+        self.path = path
+        self.commands = commands
+        self._socket = None
+        self._inode = None
+
+    def start(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        sock.bind(self.path)
+        sock.listen(8)
+        self._socket = sock
+        self._inode = os.stat(self.path).st_ino
+        threading.Thread(
+            target=self._serve, name="gearbox-control", daemon=True
+        ).start()
+
+    def close(self):
+        """Stop answering, and remove the socket unless it was replaced"""
+        if self._socket is None:
+            return
+        self._socket.close()
+        self._socket = None
+        try:
+            if os.stat(self.path).st_ino == self._inode:
+                os.unlink(self.path)
+        except OSError:
+            pass
+
+    def _serve(self):
+        while self._socket is not None:
+            try:
+                conn, _ = self._socket.accept()
+            except OSError:
+                return
+            with conn:
+                try:
+                    self._handle(conn)
+                except Exception as e:
+                    _send(conn, {"error": str(e)})
+
+    def _handle(self, conn):
+        conn.settimeout(5)
+        command = conn.makefile("rb").readline().decode("utf-8").strip()
+        handler = self.commands.get(command)
+        if handler is None:
+            _send(conn, {"error": "Unknown command %r" % command})
+            return
+        handler(lambda response, fds=(): _send(conn, response, fds))
+
+
+def _send(conn, response, fds=()):
+    data = json.dumps(response).encode("utf-8") + b"\n"
+    if fds:
+        socket.send_fds(conn, [data], list(fds))
+    else:
+        conn.sendall(data)
+
+
+def request(path, command, timeout=5.0, maxfds=16):
+    """Send ``command`` to the :class:`ControlServer` listening at ``path``.
+
+    Returns the response and the sockets sent along with it.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout)
+        conn.connect(path)
+        conn.sendall(command.encode("utf-8") + b"\n")
+        data, fds, _, _ = socket.recv_fds(conn, 65536, maxfds)
+        received = [socket.socket(fileno=fd) for fd in fds]
+        while data and not data.endswith(b"\n"):
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            data += chunk
+    if not data:
+        raise ValueError("No response to %r from %s" % (command, path))
+    response = json.loads(data.decode("utf-8"))
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response, received
@@ -0,0 +1,71 @@
+import importlib
+import sys
+import types
+
+
+class LazyModule(types.ModuleType):
+    """Proxy of a module that is only imported on first attribute access.
+
+    Used for heavy dependencies that most gearbox invocations never touch,
+    like ``paste.deploy`` or ``hupper``, so that listing commands or
+    printing the version doesn't pay for their import.
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = None
+
+    def _lazy_load(self):
+        module = self.__dict__["_lazy_target"]
+        if module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__["_lazy_target"] = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._lazy_load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._lazy_load(), name, value)
+
+    def __delattr__(self, name):
+        delattr(self._lazy_load(), name)
+
+    def __dir__(self):
+        return dir(self._lazy_load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_lazy_target"] is not None else "unloaded"
+        return "<lazy module %r (%s)>" % (self.__name__, state)
+
+
+class LazyCallable:
+    """Proxy of a callable that imports its module on first call."""
+
+    def __init__(self, module_name, name):
+        self._module_name = module_name
+        self._name = name
+        self._target = None
+
+    def __call__(self, *args, **kwargs):
+        if self._target is None:
+            module = importlib.import_module(self._module_name)
+            self._target = getattr(module, self._name)
+        return self._target(*args, **kwargs)
+
+    def __repr__(self):
+        return "<lazy callable %s.%s>" % (self._module_name, self._name)
+
+
+def lazy_import(module_name, name=None):
+    """Lazily import ``module_name``, or the ``name`` callable from it.
+
+    When the module was already imported the real object is returned,
+    so there is no proxy overhead once the dependency is loaded anyway.
+    """
+    module = sys.modules.get(module_name)
+    if name is None:
+        return module if module is not None else LazyModule(module_name)
+    if module is not None:
+        return getattr(module, name)
+    return LazyCallable(module_name, name)
@@ -1,9 +1,8 @@
 import configparser
 import os
-from logging.config import fileConfig
 
 
-def setup_logging(config_uri, fileConfig=fileConfig):
+def setup_logging(config_uri, fileConfig=None):
     """
     Set up logging via the logging module's fileConfig function with the
     filename specified via ``config_uri`` (a string in the form
@@ -16,6 +15,9 @@ def setup_logging(config_uri, fileConfig=fileConfig):
     parser = configparser.ConfigParser()
     parser.read([path])
     if parser.has_section("loggers"):
+        if fileConfig is None:
+            from logging.config import fileConfig
+
         config_file = os.path.abspath(path)
         config_options = dict(__file__=config_file, here=os.path.dirname(config_file))
 
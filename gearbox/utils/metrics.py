@@ -0,0 +1,427 @@
+import errno
+import http.server
+import logging
+import os
+import socketserver
+import threading
+import time
+
+# Latency is recorded in microseconds in buckets of 2**SUB_BUCKET_BITS
+# linear sub-buckets per power of two, giving less than 1% relative error.
+SUB_BUCKET_BITS = 7
+_SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+_HALF_BUCKETS = _SUB_BUCKETS // 2
+
+#: Upper bounds, in seconds, of the exported latency histogram buckets.
+EXPORTED_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+#: Latency quantiles exported as a summary.
+EXPORTED_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+DEFAULT_ADDRESS = "127.0.0.1:9180"
+
+
+def _bucket_index(value):
+    if value < _SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return _SUB_BUCKETS + (shift - 1) * _HALF_BUCKETS + (value >> shift) - _HALF_BUCKETS
+
+
+def _bucket_range(index):
+    """``(lowest, highest)`` value recorded in the bucket at ``index``"""
+    if index < _SUB_BUCKETS:
+        return index, index
+    shift, offset = divmod(index - _SUB_BUCKETS, _HALF_BUCKETS)
+    shift += 1
+    lowest = (offset + _HALF_BUCKETS) << shift
+    return lowest, lowest + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """HDR style histogram of latencies in microseconds.
+
+    Values are counted in log-linear buckets, so recording is a couple
+    of integer operations and the memory used is fixed whatever the
+    number of requests. Values above ``max_value`` are clamped.
+    """
+
+    def __init__(self, max_value=60 * 10**6):
+        self.counts = [0] * (_bucket_index(max_value) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def record(self, value):
+        index = _bucket_index(max(int(value), 0))
+        if index >= len(self.counts):
+            index = len(self.counts) - 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Value below which ``q`` of the recorded values are"""
+        if not self.count:
+            return 0
+        target = max(q * self.count, 1)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                lowest, highest = _bucket_range(index)
+                return (lowest + highest) / 2
+        return _bucket_range(len(self.counts) - 1)[1]
+
+    def to_dict(self):
+        """JSON serializable form of the histogram, see :meth:`from_dict`"""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": [[i, count] for i, count in enumerate(self.counts) if count],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls()
+        for index, count in data["buckets"]:
+            histogram.counts[min(index, len(histogram.counts) - 1)] += count
+        histogram.count = data["count"]
+        histogram.sum = data["sum"]
+        return histogram
+
+    def count_below(self, value):
+        """How many of the recorded values are at most ``value``"""
+        last = min(_bucket_index(int(value)), len(self.counts) - 1)
+        return sum(self.counts[: last + 1])
+
+
+class RequestStats:
+    """Request counters of a single thread, only ever written by that thread"""
+
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.in_flight = 0
+        self.bytes_out = 0
+        self.statuses = dict.fromkeys(STATUS_CLASSES, 0)
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.in_flight += other.in_flight
+        self.bytes_out += other.bytes_out
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+
+    def to_dict(self):
+        """JSON serializable form of the stats, see :meth:`from_dict`"""
+        return {
+            "latency": self.latency.to_dict(),
+            "in_flight": self.in_flight,
+            "bytes_out": self.bytes_out,
+            "statuses": dict(self.statuses),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Stats sent by another process, to be merged with local ones"""
+        stats = cls()
+        stats.latency = LatencyHistogram.from_dict(data["latency"])
+        stats.in_flight = data["in_flight"]
+        stats.bytes_out = data["bytes_out"]
+        stats.statuses.update(data["statuses"])
+        return stats
+
+
+class MetricsRegistry:
+    """Per-thread :class:`RequestStats`, aggregated when exported.
+
+    Recording a request never takes a lock: every thread updates its
+    own stats, the registry only locks to track the threads and when
+    folding the stats of the threads that are gone.
+    """
+
+    def __init__(self, restarts=0):
+        #: Times the server was restarted by ``--monitor-restart``.
+        self.restarts = restarts
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._retired = RequestStats()
+
+    def stats(self):
+        """The :class:`RequestStats` of the current thread"""
+        try:
+            return self._local.stats
+        except AttributeError:
+            stats = self._local.stats = RequestStats()
+            with self._lock:
+                self._threads.append((threading.current_thread(), stats))
+            return stats
+
+    def snapshot(self):
+        """:class:`RequestStats` of all the threads combined"""
+        total = RequestStats()
+        with self._lock:
+            alive = []
+            for thread, stats in self._threads:
+                if thread.is_alive():
+                    alive.append((thread, stats))
+                else:
+                    self._retired.merge(stats)
+            self._threads = alive
+            total.merge(self._retired)
+        for _, stats in alive:
+            total.merge(stats)
+        return total
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        stats = self.snapshot()
+        latency = stats.latency
+        lines = [
+            "# HELP gearbox_requests_total Requests served, by status class.",
+            "# TYPE gearbox_requests_total counter",
+        ]
+        for status, count in sorted(stats.statuses.items()):
+            lines.append('gearbox_requests_total{status="%s"} %d' % (status, count))
+        lines += [
+            "# HELP gearbox_requests_in_flight Requests being served.",
+            "# TYPE gearbox_requests_in_flight gauge",
+            "gearbox_requests_in_flight %d" % stats.in_flight,
+            "# HELP gearbox_response_bytes_total Bytes of response bodies sent.",
+            "# TYPE gearbox_response_bytes_total counter",
+            "gearbox_response_bytes_total %d" % stats.bytes_out,
+            "# HELP gearbox_request_duration_seconds Time to serve requests.",
+            "# TYPE gearbox_request_duration_seconds histogram",
+        ]
+        for bound in EXPORTED_BUCKETS:
+            lines.append(
+                'gearbox_request_duration_seconds_bucket{le="%s"} %d'
+                % (bound, latency.count_below(bound * 10**6))
+            )
+        lines += [
+            'gearbox_request_duration_seconds_bucket{le="+Inf"} %d' % latency.count,
+            "gearbox_request_duration_seconds_sum %.6f" % (latency.sum / 10**6),
+            "gearbox_request_duration_seconds_count %d" % latency.count,
+            "# HELP gearbox_request_latency_seconds Quantiles of the time to serve "
+            "requests.",
+            "# TYPE gearbox_request_latency_seconds summary",
+        ]
+        for q in EXPORTED_QUANTILES:
+            lines.append(
+                'gearbox_request_latency_seconds{quantile="%s"} %.6f'
+                % (q, latency.quantile(q) / 10**6)
+            )
+        lines += [
+            "gearbox_request_latency_seconds_sum %.6f" % (latency.sum / 10**6),
+            "gearbox_request_latency_seconds_count %d" % latency.count,
+            "# HELP gearbox_restarts_total Restarts of the server after it died.",
+            "# TYPE gearbox_restarts_total counter",
+            "gearbox_restarts_total %d" % self.restarts,
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """WSGI middleware recording requests in a :class:`MetricsRegistry`.
+
+    The latency of a request spans from the call of the application to
+    the end of the response body iteration.
+    """
+
+    def __init__(self, app, registry):
+        self.app = app
+        self.registry = registry
+
+    def __call__(self, environ, start_response):
+        stats = self.registry.stats()
+        started = time.perf_counter()
+        stats.in_flight += 1
+        response = _RecordedResponse(stats, started)
+
+        def recording_start_response(status, headers, exc_info=None):
+            response.status = status
+            for name, value in headers:
+                if name.lower() == "content-length":
+                    response.content_length = value
+            write = start_response(status, headers, exc_info)
+
+            def recording_write(data):
+                stats.bytes_out += len(data)
+                return write(data)
+
+            return recording_write
+
+        try:
+            result = self.app(environ, recording_start_response)
+        except BaseException:
+            response.status = "500"
+            response.finish()
+            raise
+
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if isinstance(file_wrapper, type) and isinstance(result, file_wrapper):
+            # Keep the file wrapper, so that the server can still send it
+            # efficiently, and count the response from its length.
+            close = getattr(result, "close", None)
+
+            def recording_close():
+                try:
+                    if close is not None:
+                        close()
+                finally:
+                    stats.bytes_out += int(response.content_length or 0)
+                    response.finish()
+
+            result.close = recording_close
+            return result
+        return _RecordingIterable(result, response)
+
+
+class _RecordedResponse:
+    def __init__(self, stats, started):
+        self.stats = stats
+        self.started = started
+        self.status = None
+        self.content_length = None
+        self.finished = False
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        stats = self.stats
+        stats.in_flight -= 1
+        stats.latency.record((time.perf_counter() - self.started) * 10**6)
+        status_class = (self.status or "500")[:1] + "xx"
+        stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+
+
+class _RecordingIterable:
+    def __init__(self, result, response):
+        self.result = result
+        self.response = response
+
+    def __iter__(self):
+        stats = self.response.stats
+        for data in self.result:
+            stats.bytes_out += len(data)
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self.result, "close"):
+                self.result.close()
+        finally:
+            self.response.finish()
+
+
+class _MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Unix sockets have no client address.
+        return str(self.client_address[0]) if self.client_address else "-"
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _MetricsServer(http.server.HTTPServer):
+    def __init__(self, address, handler_class, bind_timeout=0):
+        super().__init__(address, handler_class, bind_and_activate=False)
+        self.bind_timeout = bind_timeout
+        self.bound = self._bind(bind_timeout > 0)
+
+    def _bind(self, retry):
+        try:
+            self.server_bind()
+            self.server_activate()
+        except OSError as e:
+            if not retry or e.errno != errno.EADDRINUSE:
+                self.server_close()
+                raise
+            return False
+        return True
+
+    def serve_forever(self, poll_interval=0.5):
+        # The worker being replaced may still be exposing its metrics,
+        # the address is only for one process at a time.
+        deadline = time.monotonic() + self.bind_timeout
+        while not self.bound:
+            time.sleep(0.1)
+            try:
+                self.bound = self._bind(time.monotonic() < deadline)
+            except OSError as e:
+                logging.getLogger("gearbox").error(
+                    "Cannot serve metrics on %s:%d: %s" % (*self.server_address, e)
+                )
+                return
+        super().serve_forever(poll_interval)
+
+
+class _UnixMetricsServer(socketserver.UnixStreamServer):
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("",)
+
+
+def worker_address(address, slot):
+    """Metrics address of the worker in ``slot``.
+
+    TCP ports are offset by the slot, Unix socket paths get the slot
+    appended.
+    """
+    if address.startswith("unix:") or "/" in address:
+        return "%s.%d" % (address, slot)
+    host, _, port = address.rpartition(":")
+    return "%s:%d" % (host, int(port) + slot)
+
+
+def serve_metrics(registry, address=DEFAULT_ADDRESS, bind_timeout=0):
+    """Expose ``registry`` at ``address`` from a daemon thread.
+
+    ``address`` is either ``host:port`` or the path of a Unix socket,
+    optionally prefixed by ``unix:``. A ``host:port`` in use is retried
+    by the thread for ``bind_timeout`` seconds, as when the worker being
+    replaced still holds it. Returns the server.
+    """
+    handler_class = type(
+        "MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry}
+    )
+    if address.startswith("unix:") or "/" in address:
+        path = address[len("unix:") :] if address.startswith("unix:") else address
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        server = _UnixMetricsServer(path, handler_class)
+    else:
+        host, _, port = address.rpartition(":")
+        server = _MetricsServer(
+            (host or "127.0.0.1", int(port)), handler_class, bind_timeout
+        )
+    thread = threading.Thread(
+        target=server.serve_forever, name="gearbox-metrics", daemon=True
+    )
+    thread.start()
+    return server
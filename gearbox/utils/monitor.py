@@ -0,0 +1,257 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from gearbox.utils.lazy import lazy_import
+from gearbox.utils.plugins import find_project_dir, is_project_file
+
+hupper_reloader = lazy_import("hupper.reloader")
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+#: Events on the entries of a watched directory that can change a file.
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+_EVENT = struct.Struct("iIII")
+
+# Editors save files through several operations (write, rename, chmod),
+# they are reported once this long after the last one.
+COALESCE_DELAY = 0.05
+# Changes are reported at most this long after the first one, even if
+# files keep changing.
+MAX_COALESCE_DELAY = 1.0
+
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        _libc = libc
+    return _libc
+
+
+def is_inotify_supported():
+    """Whether :class:`InotifyFileMonitor` can be used on this platform"""
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        _load_libc()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+class InotifyFileMonitor(threading.Thread):
+    """``hupper`` file monitor relying on Linux inotify, through ctypes.
+
+    The directories of the watched files are watched, so that files
+    replaced by a rename, as many editors do when saving, are still
+    noticed. The thread sleeps until the kernel reports an event: an
+    idle server uses no CPU whatever the number of watched files.
+
+    Events are coalesced: each changed file is reported once, after
+    :data:`COALESCE_DELAY` seconds without further changes.
+
+    :param callback: Called with the path of each changed file.
+    """
+
+    def __init__(self, callback, logger=None, **kw):
+        super().__init__(name="gearbox-inotify", daemon=True)
+        self.callback = callback
+        self.logger = logger
+        self.paths = set()
+        self.directories = {}
+        self._watches = {}
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._stop_r, self._stop_w = os.pipe()
+        self._lock = threading.Lock()
+
+    def add_path(self, path):
+        path = os.path.abspath(path)
+        dirpath = os.path.dirname(path)
+        with self._lock:
+            self.paths.add(path)
+            if dirpath in self._watches:
+                return
+            wd = self._libc.inotify_add_watch(
+                self._fd, os.fsencode(dirpath), WATCH_MASK
+            )
+            if wd < 0:
+                error = ctypes.get_errno()
+                if self.logger is not None:
+                    self.logger.error(
+                        "Cannot watch %s: %s" % (dirpath, os.strerror(error))
+                    )
+                return
+            self.directories[wd] = dirpath
+            self._watches[dirpath] = wd
+
+    def stop(self):
+        try:
+            os.write(self._stop_w, b"\0")
+        except OSError:
+            pass
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self._fd, select.POLLIN)
+        poller.register(self._stop_r, select.POLLIN)
+        changed = {}
+        first_change = last_change = 0
+        try:
+            while True:
+                timeout = None
+                if changed:
+                    deadline = min(
+                        last_change + COALESCE_DELAY, first_change + MAX_COALESCE_DELAY
+                    )
+                    timeout = max(deadline - time.monotonic(), 0) * 1000
+                ready = [fd for fd, _ in poller.poll(timeout)]
+                if self._stop_r in ready:
+                    return
+                if self._fd in ready:
+                    paths = self._read_events()
+                    if paths:
+                        last_change = time.monotonic()
+                        if not changed:
+                            first_change = last_change
+                        changed.update(dict.fromkeys(paths))
+                    if not changed or (last_change - first_change < MAX_COALESCE_DELAY):
+                        continue
+                for path in changed:
+                    self.callback(path)
+                changed = {}
+        finally:
+            os.close(self._fd)
+            os.close(self._stop_r)
+            os.close(self._stop_w)
+
+    def _read_events(self):
+        """Watched paths affected by the pending events"""
+        changed = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return changed
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                with self._lock:
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were lost, consider everything changed.
+                        changed.extend(self.paths)
+                        continue
+                    dirpath = self.directories.get(wd)
+                    if mask & IN_IGNORED:
+                        self.directories.pop(wd, None)
+                        self._watches.pop(dirpath, None)
+                    if dirpath is None:
+                        continue
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        changed.extend(
+                            p for p in self.paths if os.path.dirname(p) == dirpath
+                        )
+                        continue
+                    path = os.path.join(dirpath, os.fsdecode(name))
+                    if path in self.paths:
+                        changed.append(path)
+
+
+class ScopedFileMonitor:
+    """Restricts a ``hupper`` file monitor to the files of the project.
+
+    Files outside of ``project_dir`` and files of a virtualenv within it
+    are ignored, so libraries are not watched, except for configuration
+    files which are always watched.
+
+    :param monitor: The ``hupper`` file monitor actually watching files.
+    """
+
+    #: Extensions of the files watched wherever they are.
+    CONFIG_EXTENSIONS = (".ini",)
+
+    def __init__(self, monitor, project_dir):
+        self.monitor = monitor
+        self.project_dir = project_dir
+
+    def add_path(self, path):
+        if path.endswith(self.CONFIG_EXTENSIONS) or is_project_file(
+            path, self.project_dir
+        ):
+            self.monitor.add_path(path)
+
+    def start(self):
+        self.monitor.start()
+
+    def stop(self):
+        self.monitor.stop()
+
+    def join(self):
+        self.monitor.join()
+
+
+def find_monitor_factory(logger, project_dir=None):
+    """File monitor factory for ``gearbox serve --reload``.
+
+    Uses :class:`InotifyFileMonitor` when available, unless a monitor is
+    chosen through the ``HUPPER_DEFAULT_MONITOR`` environment variable,
+    and falls back to the monitor ``hupper`` would use. Monitors only
+    watch the files of the project in ``project_dir``, found from the
+    current directory by default.
+    """
+    if not os.environ.get("HUPPER_DEFAULT_MONITOR") and is_inotify_supported():
+        logger.debug("File monitor backend: inotify")
+        factory = InotifyFileMonitor
+    else:
+        factory = hupper_reloader.find_default_monitor_factory(logger)
+    project_dir = project_dir or find_project_dir(os.getcwd())
+
+    def monitor_factory(callback, **kw):
+        return ScopedFileMonitor(factory(callback, **kw), project_dir)
+
+    return monitor_factory
@@ -1,12 +1,41 @@
-import importlib.metadata
+import importlib
+import json
 import os
+import re
+import stat
+import sys
+import time
+import zlib
+
+from .lazy import lazy_import
+
+metadata = lazy_import("importlib.metadata")
+pathlib = lazy_import("pathlib")
+tempfile = lazy_import("tempfile")
+
+INDEXED_GROUPS = ("gearbox.commands", "gearbox.plugins", "gearbox.project_commands")
+
+_INDEX_VERSION = 3
+_DIST_SUFFIXES = (".dist-info", ".egg-info")
+
+# Stamps newer than this are not trusted: a further change happening within
+# the filesystem timestamp granularity would otherwise go unnoticed.
+_RACY_WINDOW_NS = 2 * 10**9
 
 
 def find_local_distribution(start_dir, entry_point_group=None):
+    # Ancestors of the working directory are scanned directly rather than
+    # through the entry point index, which would otherwise record every
+    # directory gearbox was ever run from. Their metadata is only read
+    # when they hold any.
     current_dir = os.path.abspath(start_dir)
     while True:
         try:
-            distributions = importlib.metadata.distributions(path=[current_dir])
+            with os.scandir(current_dir) as it:
+                has_metadata = any(e.name.endswith(_DIST_SUFFIXES) for e in it)
+            distributions = ()
+            if has_metadata:
+                distributions = list(metadata.distributions(path=[current_dir]))
         except (OSError, PermissionError):
             distributions = ()
 
@@ -21,3 +50,377 @@ def find_local_distribution(start_dir, entry_point_group=None):
             # Top-most directory
             return None, None
         current_dir = parent
+
+
+def find_project_dir(start_dir):
+    """Directory of the project distribution ``start_dir`` belongs to.
+
+    Falls back to ``start_dir`` itself when no distribution is found,
+    like for projects installed in editable mode without an egg-info.
+    """
+    _, project_dir = find_local_distribution(start_dir)
+    return project_dir or os.path.abspath(start_dir)
+
+
+def is_project_file(filename, project_dir):
+    """Whether ``filename`` is part of the project in ``project_dir``.
+
+    Files of a virtualenv created within the project directory are not.
+    """
+    relpath = os.path.relpath(os.path.abspath(filename), project_dir)
+    if relpath == os.pardir or relpath.startswith(os.pardir + os.sep):
+        return False
+    parts = relpath.split(os.sep)
+    return "site-packages" not in parts and "dist-packages" not in parts
+
+
+def cache_dir():
+    """Directory where gearbox stores its caches.
+
+    Defaults to ``$XDG_CACHE_HOME/gearbox`` and can be overridden
+    through the ``GEARBOX_CACHE_DIR`` environment variable.
+    """
+    path = os.environ.get("GEARBOX_CACHE_DIR")
+    if not path:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache"
+        )
+        path = os.path.join(base, "gearbox")
+    return path
+
+
+def entry_points(group):
+    """Entry points of ``group`` available on ``sys.path``.
+
+    Gearbox own groups are served by the :class:`EntryPointIndex`,
+    any other group falls back to a full metadata scan.
+    """
+    if group in INDEXED_GROUPS:
+        return get_entry_point_index().entry_points(group)
+    return metadata.entry_points().select(group=group)
+
+
+class IndexedEntryPoint:
+    """Entry point recorded by the :class:`EntryPointIndex`.
+
+    Behaves like :class:`importlib.metadata.EntryPoint` without requiring
+    ``importlib.metadata`` to be imported.
+    """
+
+    def __init__(self, name, value, group):
+        self.name = name
+        self.value = value
+        self.group = group
+
+    @property
+    def module(self):
+        return self.value.partition(":")[0].strip()
+
+    @property
+    def attr(self):
+        attr = self.value.partition(":")[2]
+        return attr.partition("[")[0].strip() or None
+
+    def load(self):
+        """Import the module and return the object the entry point refers to"""
+        obj = importlib.import_module(self.module)
+        for name in (self.attr or "").split("."):
+            if name:
+                obj = getattr(obj, name)
+        return obj
+
+    def __eq__(self, other):
+        return (self.name, self.value, self.group) == (
+            getattr(other, "name", None),
+            getattr(other, "value", None),
+            getattr(other, "group", None),
+        )
+
+    def __hash__(self):
+        return hash((self.name, self.value, self.group))
+
+    def __repr__(self):
+        return "IndexedEntryPoint(name=%r, value=%r, group=%r)" % (
+            self.name,
+            self.value,
+            self.group,
+        )
+
+
+class IndexedDistribution:
+    """A distribution as recorded by the :class:`EntryPointIndex`.
+
+    Exposes the subset of :class:`importlib.metadata.Distribution`
+    gearbox relies on without reading any metadata file.
+    """
+
+    def __init__(self, index, path, record):
+        self._index = index
+        self._record = record
+        self.path = path
+
+    @property
+    def name(self):
+        return self._index._project_info(self.path, self._record)[0]
+
+    @property
+    def top_level(self):
+        return self._index._project_info(self.path, self._record)[1]
+
+    @property
+    def version(self):
+        return self._record["version"]
+
+    @property
+    def entry_points(self):
+        return [
+            IndexedEntryPoint(name, value, group)
+            for group, name, value in self._record["entry_points"]
+        ]
+
+    def __repr__(self):
+        return "<IndexedDistribution %s>" % self.path
+
+
+class EntryPointIndex:
+    """On-disk index of the gearbox entry points.
+
+    Records, for every path entry, the distributions it contains and
+    their ``gearbox.*`` entry points. Each path entry is stamped with
+    its modification time and each distribution with the modification
+    time of its metadata directory and ``entry_points.txt``, so that
+    only changed entries are scanned again and a warm startup performs
+    no metadata reads at all.
+
+    :param filename: Where the index is stored, by default a file in
+                     :func:`cache_dir` specific to the running interpreter.
+    """
+
+    def __init__(self, filename=None):
+        if filename is None:
+            prefix_hash = zlib.crc32(sys.prefix.encode("utf-8", "surrogateescape"))
+            filename = os.path.join(cache_dir(), "entry_points-%08x.json" % prefix_hash)
+        self.filename = filename
+        self._paths = self._read()
+        self._dirty = False
+
+    def _read(self):
+        try:
+            with open(self.filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get("version") != _INDEX_VERSION:
+            return {}
+        return data.get("paths", {})
+
+    def save(self):
+        """Write the index back to disk if anything changed.
+
+        Failures are ignored, the index is only a cache.
+        """
+        if not self._dirty:
+            return
+        data = {"version": _INDEX_VERSION, "paths": self._paths}
+        try:
+            dirname = os.path.dirname(self.filename)
+            os.makedirs(dirname, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(prefix=".entry_points-", dir=dirname)
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(data, f, separators=(",", ":"))
+                os.replace(tmpname, self.filename)
+            except BaseException:
+                os.unlink(tmpname)
+                raise
+        except OSError:
+            return
+        self._dirty = False
+
+    def distributions(self, path=None):
+        """Distributions found on ``path`` (defaults to ``sys.path``).
+
+        Like :func:`importlib.metadata.distributions` a distribution
+        shadows the ones with the same name found later on the path.
+        """
+        if path is None:
+            path = sys.path
+        seen = set()
+        for entry in path:
+            entry = os.path.abspath(entry or ".")
+            for dirname, record in self._refresh(entry).items():
+                normalized = _normalize_name(record["stem_name"])
+                if normalized in seen:
+                    continue
+                seen.add(normalized)
+                yield IndexedDistribution(self, os.path.join(entry, dirname), record)
+        self.save()
+
+    def entry_points(self, group, path=None):
+        """All the entry points of ``group`` provided by :meth:`distributions`"""
+        return [
+            ep
+            for dist in self.distributions(path)
+            for ep in dist.entry_points
+            if ep.group == group
+        ]
+
+    def version(self, name):
+        """Version of the ``name`` distribution, ``None`` when not installed"""
+        normalized = _normalize_name(name)
+        for dist in self.distributions():
+            if _normalize_name(dist._record["stem_name"]) == normalized:
+                return dist.version
+        return None
+
+    def packages_distributions(self, path=None):
+        """Index based equivalent of :func:`importlib.metadata.packages_distributions`"""
+        pkg_to_dist = {}
+        for dist in self.distributions(path):
+            for pkg in dist.top_level:
+                pkg_to_dist.setdefault(pkg, []).append(dist.name)
+        self.save()
+        return pkg_to_dist
+
+    def _refresh(self, entry):
+        try:
+            st = os.stat(entry)
+        except OSError:
+            return {}
+
+        cached = self._paths.get(entry)
+        stamp = _trusted_stamp(st.st_mtime_ns)
+        if cached is not None and stamp is not None and cached["stamp"] == stamp:
+            if not stat.S_ISDIR(st.st_mode):
+                return cached["dists"]
+            names = list(cached["dists"])
+        elif not stat.S_ISDIR(st.st_mode):
+            # Zip archives and other importable files get indexed as a whole.
+            dists = {}
+            for position, dist in enumerate(metadata.distributions(path=[entry])):
+                dists[str(position)] = _index_distribution(dist, None)
+            self._store(entry, stamp, dists)
+            return dists
+        else:
+            try:
+                names = sorted(
+                    name
+                    for name in os.listdir(entry)
+                    if name.lower().endswith(_DIST_SUFFIXES)
+                )
+            except OSError:
+                return {}
+
+        cached_dists = cached["dists"] if cached is not None else {}
+        dists = {}
+        changed = cached is None or cached["stamp"] != stamp
+        for name in names:
+            dist_path = os.path.join(entry, name)
+            dist_stamp = _distribution_stamp(dist_path)
+            if dist_stamp is None:
+                changed = True
+                continue
+            record = cached_dists.get(name)
+            if record is None or record["stamp"] != dist_stamp or None in dist_stamp:
+                dist = metadata.PathDistribution(pathlib.Path(dist_path))
+                record = _index_distribution(dist, dist_stamp, name)
+                changed = True
+            dists[name] = record
+        if changed or len(dists) != len(cached_dists):
+            self._store(entry, stamp, dists)
+        return dists
+
+    def _store(self, entry, stamp, dists):
+        self._paths[entry] = {"stamp": stamp, "dists": dists}
+        self._dirty = True
+
+    def _project_info(self, path, record):
+        # Distribution name and top level packages are only needed when
+        # looking up project commands, so they are indexed lazily.
+        if "top_level" not in record:
+            dist = metadata.PathDistribution(pathlib.Path(path))
+            record["name"] = dist.metadata.get("Name") or record["stem_name"]
+            record["top_level"] = sorted(_top_level_names(dist))
+            self._dirty = True
+        return record["name"], record["top_level"]
+
+
+def _index_distribution(dist, stamp, dirname=None):
+    stem_name = version = None
+    if dirname is not None:
+        stem_name, _, version = os.path.splitext(dirname)[0].partition("-")
+        # Drop the python tag of egg-info directories, like foo-1.0-py3.11
+        version = version.partition("-")[0]
+    if not stem_name:
+        stem_name = dist.metadata.get("Name") or ""
+    if not version:
+        version = dist.version
+    try:
+        dist_entry_points = dist.entry_points
+    except (OSError, ValueError):
+        dist_entry_points = ()
+    record = {
+        "stamp": stamp,
+        "stem_name": stem_name,
+        "version": version,
+        "entry_points": [
+            [ep.group, ep.name, ep.value]
+            for ep in dist_entry_points
+            if ep.group in INDEXED_GROUPS
+        ],
+    }
+    if stamp is None:
+        # Distributions inside archives get their project info right away,
+        # there is no path to lazily read it from later.
+        record["name"] = dist.metadata.get("Name") or stem_name
+        record["top_level"] = sorted(_top_level_names(dist))
+    return record
+
+
+def _distribution_stamp(dist_path):
+    try:
+        st = os.stat(dist_path)
+    except OSError:
+        return None
+    entry_points_stamp = 0
+    if stat.S_ISDIR(st.st_mode):
+        try:
+            entry_points_stamp = os.stat(
+                os.path.join(dist_path, "entry_points.txt")
+            ).st_mtime_ns
+        except OSError:
+            pass
+    return [_trusted_stamp(st.st_mtime_ns), _trusted_stamp(entry_points_stamp)]
+
+
+def _trusted_stamp(mtime_ns):
+    if mtime_ns and time.time_ns() - mtime_ns < _RACY_WINDOW_NS:
+        return None
+    return mtime_ns
+
+
+def _top_level_names(dist):
+    declared = (dist.read_text("top_level.txt") or "").split()
+    if declared:
+        return set(declared)
+    inferred = {
+        f.parts[0] if len(f.parts) > 1 else f.with_suffix("").name
+        for f in dist.files or ()
+        if f.suffix == ".py"
+    }
+    return {name for name in inferred if "." not in name}
+
+
+def _normalize_name(name):
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+_index = None
+
+
+def get_entry_point_index():
+    """The :class:`EntryPointIndex` shared by the whole process."""
+    global _index
+    if _index is None:
+        _index = EntryPointIndex()
+    return _index
@@ -0,0 +1,220 @@
+import atexit
+import cProfile
+import itertools
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+
+#: Request header asking for a deterministic profile of the request.
+PROFILE_HEADER = "HTTP_X_GEARBOX_PROFILE"
+
+_dump_counter = itertools.count()
+
+# Held while a request is profiled with cProfile: profiles of concurrent
+# requests would mix their calls, and Python 3.12 refuses to enable a
+# second one.
+_profiling = threading.Lock()
+
+
+class SamplingProfiler:
+    """Statistical profiler of the requests served by the process.
+
+    A daemon thread samples the stacks of all the threads ``rate`` times
+    per second through ``sys._current_frames()``. Stacks of threads that
+    are serving a request, as registered by :class:`ProfilerMiddleware`,
+    are counted under the request method and path, in the collapsed
+    format understood by ``flamegraph.pl`` and speedscope.
+
+    :param rate: Samples per second.
+    :param output_dir: Where :meth:`write` stores ``profile-<pid>.folded``.
+    """
+
+    def __init__(self, rate=100, output_dir="."):
+        self.interval = 1.0 / rate
+        self.output_dir = output_dir
+        self.requests = {}
+        self.stacks = {}
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def filename(self):
+        return os.path.join(self.output_dir, "profile-%d.folded" % os.getpid())
+
+    def start(self):
+        """Start sampling, write the profile on ``SIGUSR2`` and at exit"""
+        self._thread = threading.Thread(
+            target=self._run, name="gearbox-profiler", daemon=True
+        )
+        self._thread.start()
+        if hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.write())
+        atexit.register(self.stop)
+
+    def stop(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.write()
+
+    def sample(self):
+        """Record the stacks of the threads currently serving a request"""
+        own = threading.get_ident()
+        requests = self.requests
+        for ident, frame in sys._current_frames().items():
+            request = requests.get(ident)
+            if request is None or ident == own:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    "%s (%s:%d)" % (code.co_name, code.co_filename, code.co_firstlineno)
+                )
+                frame = frame.f_back
+            names.append(request)
+            stack = ";".join(reversed(names))
+            with self._lock:
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def write(self):
+        """Write the collapsed stacks sampled so far to :attr:`filename`"""
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmpname = self.filename + ".tmp"
+        with open(tmpname, "w") as f:
+            for stack, count in stacks:
+                f.write("%s %d\n" % (stack, count))
+        os.replace(tmpname, self.filename)
+        return self.filename
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+
+class ProfilerMiddleware:
+    """WSGI middleware attributing profiles to the requests being served.
+
+    Registers each request with the :class:`SamplingProfiler`. When
+    ``pstats_dir`` is set, requests carrying the ``X-Gearbox-Profile``
+    header and a ``ratio`` of the others are additionally profiled with
+    ``cProfile``, and their stats dumped to a ``.pstats`` file there.
+    Only one request is profiled at a time, those served meanwhile are
+    only sampled.
+    """
+
+    def __init__(self, app, profiler, pstats_dir=None, ratio=0.0):
+        self.app = app
+        self.profiler = profiler
+        self.pstats_dir = pstats_dir
+        self.ratio = ratio
+
+    def __call__(self, environ, start_response):
+        ident = threading.get_ident()
+        request = "%s %s" % (environ.get("REQUEST_METHOD"), environ.get("PATH_INFO"))
+        self.profiler.requests[ident] = request
+
+        profile = None
+        if (
+            self.pstats_dir
+            and (PROFILE_HEADER in environ or random.random() < self.ratio)
+            and _profiling.acquire(blocking=False)
+        ):
+            profile = cProfile.Profile()
+
+        profiled = _ProfiledResponse(self, ident, request, profile)
+        try:
+            with profiled:
+                result = self.app(environ, start_response)
+        except BaseException:
+            profiled.close()
+            raise
+
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if isinstance(file_wrapper, type) and isinstance(result, file_wrapper):
+            # Keep the file wrapper, so that the server can still send it
+            # efficiently.
+            close = getattr(result, "close", None)
+
+            def profiled_close():
+                try:
+                    if close is not None:
+                        close()
+                finally:
+                    profiled.close()
+
+            result.close = profiled_close
+            return result
+        return _ProfiledIterable(result, profiled)
+
+    def dump(self, request, profile):
+        os.makedirs(self.pstats_dir, exist_ok=True)
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", request).strip("_")[:100]
+        filename = os.path.join(
+            self.pstats_dir,
+            "%s-%d-%d-%s.pstats"
+            % (time.strftime("%Y%m%d%H%M%S"), os.getpid(), next(_dump_counter), name),
+        )
+        profile.dump_stats(filename)
+        return filename
+
+
+class _ProfiledResponse:
+    def __init__(self, middleware, ident, request, profile):
+        self.middleware = middleware
+        self.ident = ident
+        self.request = request
+        self.profile = profile
+
+    def __enter__(self):
+        if self.profile is not None:
+            self.profile.enable()
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+
+    def close(self):
+        requests = self.middleware.profiler.requests
+        if requests.get(self.ident) == self.request:
+            del requests[self.ident]
+        if self.profile is not None:
+            profile, self.profile = self.profile, None
+            try:
+                self.middleware.dump(self.request, profile)
+            finally:
+                _profiling.release()
+
+
+class _ProfiledIterable:
+    def __init__(self, result, profiled):
+        self.result = result
+        self.profiled = profiled
+
+    def __iter__(self):
+        iterator = iter(self.result)
+        while True:
+            with self.profiled:
+                data = next(iterator, None)
+            if data is None:
+                return
+            yield data
+
+    def close(self):
+        try:
+            if hasattr(self.result, "close"):
+                with self.profiled:
+                    self.result.close()
+        finally:
+            self.profiled.close()
@@ -0,0 +1,93 @@
+import os
+import socket
+
+#: Environment variable listing the file descriptors of listening sockets
+#: a process inherited from the one that started it.
+LISTEN_FDS_ENV = "GEARBOX_LISTEN_FDS"
+
+DEFAULT_BACKLOG = 1024
+
+_inherited = None
+
+
+def bind_socket(host, port, backlog=DEFAULT_BACKLOG, reuse_port=False):
+    """Create a TCP socket listening on ``host``:``port``.
+
+    ``reuse_port`` enables ``SO_REUSEPORT``, so that multiple processes
+    can bind their own socket on the same port and the kernel balances
+    incoming connections between them.
+    """
+    infos = socket.getaddrinfo(
+        host or None,
+        int(port),
+        socket.AF_UNSPEC,
+        socket.SOCK_STREAM,
+        0,
+        socket.AI_PASSIVE,
+    )
+    family, socktype, proto, _, address = infos[0]
+    sock = socket.socket(family, socktype, proto)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            if not hasattr(socket, "SO_REUSEPORT"):
+                raise ValueError("SO_REUSEPORT is not supported on this platform")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(address)
+        sock.listen(int(backlog))
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+def inherited_sockets():
+    """Listening sockets handed over by the process that started this one.
+
+    They are either set up through :func:`set_inherited_sockets` before
+    forking or listed in the ``GEARBOX_LISTEN_FDS`` environment variable.
+    """
+    global _inherited
+    if _inherited is None:
+        fds = os.environ.get(LISTEN_FDS_ENV, "")
+        _inherited = [socket.socket(fileno=int(fd)) for fd in fds.split(",") if fd]
+    return _inherited
+
+
+def inherited_socket():
+    """The first of the :func:`inherited_sockets`, ``None`` when there is none"""
+    sockets = inherited_sockets()
+    return sockets[0] if sockets else None
+
+
+def set_inherited_sockets(sockets):
+    """Make ``sockets`` the listeners the server runners will serve from"""
+    global _inherited
+    _inherited = list(sockets)
+
+
+class InheritedSocketMixIn:
+    """Serve a ``socketserver`` based server from :func:`inherited_socket`.
+
+    Falls back to binding its own socket when nothing was inherited.
+    """
+
+    def server_bind(self):
+        listener = inherited_socket()
+        if listener is None:
+            return super().server_bind()
+
+        self.socket.close()
+        self.socket = listener
+        self.address_family = listener.family
+        self.server_address = listener.getsockname()
+        # Same as http.server.HTTPServer.server_bind
+        host, port = self.server_address[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+        if hasattr(self, "setup_environ"):
+            self.setup_environ()
+
+    def server_activate(self):
+        if inherited_socket() is None:
+            super().server_activate()
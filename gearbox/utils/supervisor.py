@@ -0,0 +1,631 @@
+import contextlib
+import errno
+import os
+import select
+import signal
+import struct
+import sys
+import threading
+import time
+import traceback
+
+# Workers dying faster than this are considered failing at startup,
+# so they are not respawned immediately.
+MIN_WORKER_LIFETIME = 1.0
+
+# Longest delay between checks of whether a process exited, when it
+# can't be waited for through a pidfd.
+MAX_EXIT_POLL_DELAY = 0.1
+
+# Seconds a process has to disappear after SIGKILL.
+KILL_TIMEOUT = 5
+
+_PID = struct.Struct("i")
+
+# Whether the main thread is serving a request, see serving_request().
+_serving = False
+_stop_requested = False
+
+
+class Worker:
+    """A forked worker process tracked by the :class:`Supervisor`"""
+
+    def __init__(self, slot, pid):
+        self.slot = slot
+        self.pid = pid
+        self.started = time.monotonic()
+        self.retiring = False
+        #: When a retiring worker gets killed if it didn't exit yet.
+        self.deadline = None
+
+    @property
+    def age(self):
+        return time.monotonic() - self.started
+
+
+class Supervisor:
+    """Master process of a pool of forked workers.
+
+    Forks ``num_workers`` processes running ``target(slot)``, respawns
+    them when they die and performs a rolling restart on ``SIGHUP``:
+    a replacement is started for each worker before the old one is
+    asked to gracefully stop. ``SIGTERM``, ``SIGINT`` and ``SIGQUIT``
+    stop all the workers and make :meth:`run` return, ``SIGUSR1`` and
+    ``SIGUSR2`` are relayed to the workers.
+
+    The master never waits for a worker to exit, but while stopping
+    them all: retiring workers are killed by the main loop once their
+    ``graceful_timeout`` expired, and workers dying too early are
+    respawned by it after :data:`MIN_WORKER_LIFETIME` seconds.
+
+    Workers are recycled the same way, replacement first, when their
+    resident memory exceeds ``max_rss`` bytes, when they are older than
+    ``max_age`` seconds, or when they call :meth:`request_recycle`.
+
+    :param target: Callable invoked in the worker process with the worker
+                   slot number, the worker exits when it returns.
+    :param num_workers: How many workers to keep running.
+    :param out: Callable used to report what's going on.
+    :param graceful_timeout: Seconds a worker has to exit after ``SIGTERM``
+                             before being killed.
+    :param on_reload: Callable invoked in the master on ``SIGHUP``,
+                      before the workers are replaced.
+    :param on_start: Callable invoked in the master once the workers
+                     are started.
+    :param max_rss: Resident memory, in bytes, above which a worker is
+                    recycled. Only enforced where :func:`process_rss` is
+                    available.
+    :param max_age: Seconds after which a worker is recycled.
+    """
+
+    STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT)
+
+    #: Signals relayed to all the workers.
+    FORWARDED_SIGNALS = (signal.SIGUSR1, signal.SIGUSR2)
+
+    def __init__(
+        self,
+        target,
+        num_workers,
+        out,
+        graceful_timeout=30,
+        on_reload=None,
+        on_start=None,
+        max_rss=None,
+        max_age=None,
+    ):
+        self.target = target
+        self.num_workers = num_workers
+        self.out = out
+        self.graceful_timeout = graceful_timeout
+        self.on_reload = on_reload
+        self.on_start = on_start
+        self.max_rss = max_rss
+        self.max_age = max_age
+        self.workers = {}
+        # Slots of the workers to respawn, with when.
+        self._respawns = {}
+        self._signals = []
+        self._wakeup = None
+        self._recycle = None
+        self._previous_handlers = {}
+
+    def run(self):
+        """Run the master loop until a stop signal is received"""
+        self._install_signal_handlers()
+        try:
+            for slot in range(self.num_workers):
+                self.spawn(slot)
+            if self.on_start is not None:
+                self.on_start()
+
+            while True:
+                self._wait(self._next_timeout())
+                while self._signals:
+                    signum = self._signals.pop(0)
+                    if signum in self.STOP_SIGNALS:
+                        active = [w for w in self.workers.values() if not w.retiring]
+                        self.out("Stopping %d workers" % len(active))
+                        self.stop_all()
+                        return 0
+                    if signum == signal.SIGHUP:
+                        self.reload()
+                    elif signum in self.FORWARDED_SIGNALS:
+                        for worker in list(self.workers.values()):
+                            self._signal_worker(worker, signum)
+                self.reap()
+                self.check_deadlines()
+                self.check_workers()
+        finally:
+            self._restore_signal_handlers()
+
+    def spawn(self, slot):
+        """Fork a new worker process for ``slot``"""
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = worker = Worker(slot, pid)
+            self.out("Started worker %d (PID %s)" % (slot, pid))
+            return worker
+
+        status = 1
+        try:
+            self._reset_worker_process()
+            self.target(slot)
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except Exception:
+                    pass
+            os._exit(status)
+
+    def reap(self):
+        """Collect dead workers and respawn the ones that died unexpectedly.
+
+        Workers that died before running for :data:`MIN_WORKER_LIFETIME`
+        are only respawned by :meth:`check_deadlines` once it elapsed.
+        """
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self.workers.pop(pid, None)
+            if worker is None or worker.retiring:
+                continue
+
+            self.out(
+                "Worker %d (PID %s) %s, respawning"
+                % (worker.slot, pid, describe_exit_status(status)),
+            )
+            if worker.age < MIN_WORKER_LIFETIME:
+                self._respawns[worker.slot] = time.monotonic() + MIN_WORKER_LIFETIME
+            else:
+                self.spawn(worker.slot)
+
+    def check_deadlines(self):
+        """Respawn the workers whose delay elapsed and kill the retiring
+        workers that didn't exit in time.
+        """
+        now = time.monotonic()
+        for slot, when in list(self._respawns.items()):
+            if when <= now:
+                del self._respawns[slot]
+                self.spawn(slot)
+        for worker in list(self.workers.values()):
+            if worker.deadline is not None and worker.deadline <= now:
+                self.out(
+                    "Worker %d (PID %s) did not stop, killing"
+                    % (worker.slot, worker.pid)
+                )
+                self._signal_worker(worker, signal.SIGKILL)
+                worker.deadline = None
+
+    def check_workers(self):
+        """Recycle the workers exceeding their memory or age limit"""
+        for worker in list(self.workers.values()):
+            if worker.retiring:
+                continue
+            if self.max_age and worker.age > self.max_age:
+                self.recycle(worker, "reached its maximum age")
+            elif self.max_rss:
+                rss = process_rss(worker.pid)
+                if rss is not None and rss > self.max_rss:
+                    self.recycle(worker, "uses %d MiB of memory" % (rss // 2**20))
+
+    def recycle(self, worker, reason):
+        """Replace ``worker``, starting its replacement before stopping it"""
+        self.out(
+            "Recycling worker %d (PID %s), it %s" % (worker.slot, worker.pid, reason)
+        )
+        self.spawn(worker.slot)
+        self.stop_worker(worker)
+
+    def request_recycle(self):
+        """Ask the master to recycle the calling worker.
+
+        Meant to be called from a worker process, which keeps serving
+        until the master stops it once its replacement is started.
+        """
+        try:
+            os.write(self._recycle[1], _PID.pack(os.getpid()))
+        except OSError:
+            pass
+
+    def reload(self):
+        """Replace all workers, without downtime"""
+        if self.on_reload is not None:
+            try:
+                self.on_reload()
+            except Exception as e:
+                self.out("Reload failed, keeping current workers: %s" % e)
+                return
+
+        workers = [w for w in self.workers.values() if not w.retiring]
+        self.out("Rolling restart of %d workers" % len(workers))
+        for worker in workers:
+            self.spawn(worker.slot)
+            self.stop_worker(worker)
+
+    def stop_worker(self, worker):
+        """Ask ``worker`` to gracefully stop.
+
+        The worker is collected by :meth:`reap` once it exited, or
+        killed by :meth:`check_deadlines` if it doesn't in time.
+        """
+        worker.retiring = True
+        worker.deadline = time.monotonic() + self.graceful_timeout
+        self._signal_worker(worker, signal.SIGTERM)
+
+    def stop_all(self):
+        """Gracefully stop all the workers, killing those still running
+        ``graceful_timeout`` seconds later.
+        """
+        deadline = time.monotonic() + self.graceful_timeout
+        for worker in self.workers.values():
+            worker.retiring = True
+            self._signal_worker(worker, signal.SIGTERM)
+        stuck = []
+        for worker in list(self.workers.values()):
+            if not self._wait_worker(worker, max(0, deadline - time.monotonic())):
+                stuck.append(worker)
+        for worker in stuck:
+            self.out(
+                "Worker %d (PID %s) did not stop, killing" % (worker.slot, worker.pid)
+            )
+            self._signal_worker(worker, signal.SIGKILL)
+        for worker in stuck:
+            self._wait_worker(worker, None)
+        self.workers.clear()
+
+    def _signal_worker(self, worker, signum):
+        try:
+            os.kill(worker.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _wait_worker(self, worker, timeout):
+        return wait_for_exit(worker.pid, timeout)
+
+    def _install_signal_handlers(self):
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        self._wakeup = (read_fd, write_fd)
+        self._recycle = os.pipe()
+        os.set_blocking(self._recycle[0], False)
+        self._previous_wakeup_fd = signal.set_wakeup_fd(write_fd)
+        handled = self.STOP_SIGNALS + self.FORWARDED_SIGNALS
+        for signum in handled + (signal.SIGHUP, signal.SIGCHLD):
+            self._previous_handlers[signum] = signal.signal(signum, self._on_signal)
+
+    def _restore_signal_handlers(self):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler if handler is not None else signal.SIG_DFL)
+        self._previous_handlers.clear()
+        signal.set_wakeup_fd(self._previous_wakeup_fd)
+        for fd in self._wakeup + self._recycle:
+            os.close(fd)
+        self._wakeup = self._recycle = None
+
+    def _on_signal(self, signum, frame):
+        if signum != signal.SIGCHLD:
+            self._signals.append(signum)
+
+    def _next_timeout(self):
+        """Seconds the main loop can sleep for, at most 1"""
+        deadlines = [w.deadline for w in self.workers.values() if w.deadline]
+        deadlines.extend(self._respawns.values())
+        if not deadlines:
+            return 1.0
+        return min(1.0, max(0.0, min(deadlines) - time.monotonic()))
+
+    def _wait(self, timeout):
+        read_fd = self._wakeup[0]
+        recycle_fd = self._recycle[0]
+        try:
+            ready, _, _ = select.select([read_fd, recycle_fd], [], [], timeout)
+        except InterruptedError:
+            return
+        if read_fd in ready:
+            _drain(read_fd)
+        if recycle_fd in ready:
+            data = _drain(recycle_fd)
+            # Writes of a PID to a pipe are atomic, reads get whole PIDs.
+            pids = dict.fromkeys(pid for (pid,) in _PID.iter_unpack(data))
+            for pid in pids:
+                worker = self.workers.get(pid)
+                if worker is not None and not worker.retiring:
+                    self.recycle(worker, "reached its maximum number of requests")
+
+    def _reset_worker_process(self):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler if handler is not None else signal.SIG_DFL)
+        signal.set_wakeup_fd(-1)
+        for fd in self._wakeup:
+            os.close(fd)
+        os.close(self._recycle[0])
+        self._previous_handlers = {}
+        self._wakeup = None
+        signal.signal(signal.SIGTERM, terminate)
+
+
+def terminate(signum, frame):
+    """``SIGTERM`` handler raising :class:`SystemExit`.
+
+    When the main thread is serving a request, like single threaded
+    servers do, the request is completed first, see :func:`serving_request`.
+    """
+    global _stop_requested
+    if _serving:
+        _stop_requested = True
+        return
+    raise SystemExit
+
+
+@contextlib.contextmanager
+def serving_request():
+    """Context of a request being served.
+
+    When used from the main thread, a ``SIGTERM`` handled by :func:`terminate`
+    while in the context raises :class:`SystemExit` only once it exits.
+    """
+    global _serving
+    if _serving or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    _serving = True
+    try:
+        yield
+    finally:
+        _serving = False
+    if _stop_requested:
+        raise SystemExit
+
+
+class RecycleMiddleware:
+    """WSGI middleware calling ``on_limit`` once ``max_requests`` requests
+    have been received.
+
+    Used with :meth:`Supervisor.request_recycle` to recycle a worker
+    after it served a number of requests.
+    """
+
+    def __init__(self, app, max_requests, on_limit):
+        self.app = app
+        self.max_requests = max_requests
+        self.on_limit = on_limit
+        self.requests = 0
+        self.limit_reached = False
+
+    def __call__(self, environ, start_response):
+        self.requests += 1
+        if self.requests >= self.max_requests and not self.limit_reached:
+            self.limit_reached = True
+            self.on_limit()
+        return self.app(environ, start_response)
+
+
+def _drain(fd):
+    """Everything that can be read from the non blocking ``fd``"""
+    data = b""
+    try:
+        while True:
+            chunk = os.read(fd, 4096)
+            if not chunk:
+                break
+            data += chunk
+    except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+    return data
+
+
+def describe_exit_status(status):
+    """Human readable description of a ``waitpid`` exit status"""
+    if os.WIFSIGNALED(status):
+        signum = os.WTERMSIG(status)
+        try:
+            name = signal.Signals(signum).name
+        except ValueError:
+            name = str(signum)
+        return "was killed by %s" % name
+    return "exited with status %d" % os.waitstatus_to_exitcode(status)
+
+
+def describe_returncode(returncode):
+    """Human readable description of a :class:`subprocess.Popen` return code"""
+    if returncode < 0:
+        try:
+            name = signal.Signals(-returncode).name
+        except ValueError:
+            name = str(-returncode)
+        return "was killed by %s" % name
+    return "exited with status %d" % returncode
+
+
+#: Exit statuses of a server that would fail the same way if restarted,
+#: like those of command line or configuration errors.
+FATAL_EXIT_CODES = (2,)
+
+
+def classify_exit(returncode):
+    """Why a process exited, from its :class:`subprocess.Popen` return code.
+
+    ``"clean"`` when it exited successfully, ``"stopped"`` when it was
+    terminated or interrupted, ``"fatal"`` when it reported an error it
+    would run into again, like a bad option, and ``"crashed"`` otherwise.
+    """
+    if returncode == 0:
+        return "clean"
+    if returncode in (-signal.SIGTERM, -signal.SIGINT):
+        return "stopped"
+    if returncode in FATAL_EXIT_CODES:
+        return "fatal"
+    return "crashed"
+
+
+class RestartPolicy:
+    """Delays between the restarts of a process that keeps failing.
+
+    The delay doubles with each failure that happened within the last
+    ``window`` seconds, from ``initial_delay`` up to ``max_delay``. Once
+    ``max_failures`` failures happened within ``window`` seconds, the
+    process is crash-looping and is not restarted anymore.
+    """
+
+    def __init__(
+        self,
+        max_failures=5,
+        window=60,
+        initial_delay=0.5,
+        max_delay=30,
+        clock=time.monotonic,
+    ):
+        self.max_failures = max_failures
+        self.window = window
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.clock = clock
+        self.restarts = 0
+        self._failures = []
+
+    def failed(self):
+        """Record a failure.
+
+        Returns how long to wait before restarting, ``None`` to give up.
+        """
+        now = self.clock()
+        self._failures = [t for t in self._failures if now - t < self.window]
+        self._failures.append(now)
+        if len(self._failures) >= self.max_failures:
+            return None
+        self.restarts += 1
+        delay = self.initial_delay * 2 ** (len(self._failures) - 1)
+        return min(delay, self.max_delay)
+
+    @property
+    def recent_failures(self):
+        """Failures within the last ``window`` seconds"""
+        now = self.clock()
+        return sum(1 for t in self._failures if now - t < self.window)
+
+
+def process_rss(pid):
+    """Resident memory of the process ``pid`` in bytes.
+
+    Read from ``/proc``, so ``None`` on platforms without it.
+    """
+    try:
+        with open("/proc/%d/statm" % pid, "rb") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def wait_for_exit(pid, timeout=None):
+    """Wait for the process ``pid`` to exit, reaping it if it's a child.
+
+    Returns whether it exited within ``timeout`` seconds. On Linux the
+    wait relies on a pidfd becoming readable, so the exit is noticed as
+    soon as it happens. Elsewhere, the process is checked again after
+    exponentially growing delays.
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    pidfd = _pidfd_open(pid)
+    if pidfd is _GONE:
+        _reap(pid)
+        return True
+    delay = 0.001
+    try:
+        while True:
+            if _has_exited(pid):
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if pidfd is not None:
+                ready, _, _ = select.select([pidfd], [], [], remaining)
+                if ready:
+                    _reap(pid)
+                    return True
+            else:
+                time.sleep(delay if remaining is None else min(delay, remaining))
+                delay = min(delay * 2, MAX_EXIT_POLL_DELAY)
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def stop_process(pid, timeout=30, signum=signal.SIGTERM, kill_group=False):
+    """Send ``signum`` to ``pid``, and ``SIGKILL`` if it's still alive
+    after ``timeout`` seconds.
+
+    With ``kill_group``, ``SIGKILL`` is sent to the whole process group
+    of ``pid``, so that its workers don't survive it.
+
+    Returns how long the process took to exit, and whether it had to be
+    killed. Raises :class:`TimeoutError` if it survived ``SIGKILL``.
+    """
+    started = time.monotonic()
+    try:
+        os.kill(pid, signum)
+    except ProcessLookupError:
+        return 0.0, False
+    if wait_for_exit(pid, timeout):
+        return time.monotonic() - started, False
+    try:
+        if kill_group:
+            os.killpg(os.getpgid(pid), signal.SIGKILL)
+        else:
+            os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    if not wait_for_exit(pid, KILL_TIMEOUT):
+        raise TimeoutError("PID %s survived SIGKILL" % pid)
+    return time.monotonic() - started, True
+
+
+_GONE = object()
+
+
+def _pidfd_open(pid):
+    if not hasattr(os, "pidfd_open"):
+        return None
+    try:
+        return os.pidfd_open(pid)
+    except ProcessLookupError:
+        return _GONE
+    except OSError:
+        # Kernels older than 5.3
+        return None
+
+
+def _has_exited(pid):
+    try:
+        waited, _ = os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        # Not a child of ours.
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+    return bool(waited)
+
+
+def _reap(pid):
+    try:
+        os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        pass
@@ -0,0 +1,269 @@
+import glob
+import os
+import re
+
+#: Directories never walked into: version control data, virtualenvs,
+#: caches and build outputs, which usually hold most of the files of a
+#: project but none of its sources.
+PRUNED_DIRECTORIES = frozenset(
+    (
+        ".git",
+        ".hg",
+        ".svn",
+        ".tox",
+        ".venv",
+        "__pycache__",
+        "build",
+        "node_modules",
+    )
+)
+
+#: Files listing, like ``.gitignore``, the files to ignore in their
+#: directory and below.
+IGNORE_FILES = (".gitignore",)
+
+_MAGIC_RE = re.compile(r"[*?[]")
+
+
+class IgnoreRules:
+    """Patterns of ignored files, with the syntax of ``.gitignore``.
+
+    Patterns without a slash match names at any depth, others paths
+    relative to the directory of the file they come from. A trailing
+    slash only matches directories, a leading ``!`` includes again what
+    a previous pattern ignored, ``**`` matches any number of
+    directories. The last matching pattern wins.
+
+    Rules are immutable, :meth:`extended` returns new ones, so that the
+    rules of a directory can be shared by all its subdirectories.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = tuple(rules)
+
+    def extended(self, patterns, base=""):
+        """Rules with ``patterns``, relative to the ``base`` directory, added"""
+        rules = list(self.rules)
+        prefix = base + "/" if base else ""
+        for pattern in patterns:
+            rule = _parse_ignore_pattern(pattern, prefix)
+            if rule is not None:
+                rules.append(rule)
+        return IgnoreRules(rules)
+
+    def ignored(self, relpath, is_dir=False):
+        """Whether ``relpath``, with ``/`` separators, is ignored"""
+        ignored = False
+        for regex, prefix, negate, dir_only in self.rules:
+            if (
+                (is_dir or not dir_only)
+                and relpath.startswith(prefix)
+                and regex.match(relpath, len(prefix))
+            ):
+                ignored = not negate
+        return ignored
+
+
+def _parse_ignore_pattern(pattern, prefix):
+    pattern = pattern.rstrip("\n")
+    if pattern.endswith(" ") and not pattern.endswith("\\ "):
+        pattern = pattern.rstrip(" ")
+    if not pattern or pattern.startswith("#"):
+        return None
+    negate = pattern.startswith("!")
+    if negate:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\"):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    if not pattern:
+        return None
+    if "/" in pattern:
+        regex = translate(pattern.lstrip("/"))
+    else:
+        regex = "(?:.*/)?" + translate(pattern)
+    return re.compile(regex + r"\Z"), prefix, negate, dir_only
+
+
+def translate(pattern, dotfiles=True):
+    """Regular expression matching the paths matched by ``pattern``.
+
+    ``pattern`` uses ``/`` separators and the wildcards of glob patterns,
+    ``*`` and ``?`` not matching ``/``, while ``**`` matches any number of
+    directories. Unless ``dotfiles`` is true, wildcards don't match names
+    starting with a dot, as with :func:`glob.glob`.
+    """
+    hidden = "" if dotfiles else r"(?!\.)"
+    segments = pattern.split("/")
+    parts = []
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == "**":
+            parts.append("(?:%s[^/]*/)*" % hidden)
+            if last:
+                parts.append(hidden + "[^/]+")
+            continue
+        if not segment.startswith("."):
+            parts.append(hidden)
+        parts.append(_translate_segment(segment))
+        if not last:
+            parts.append("/")
+    return "".join(parts)
+
+
+def _translate_segment(segment):
+    regex = []
+    i = 0
+    while i < len(segment):
+        char = segment[i]
+        i += 1
+        if char == "*":
+            while i < len(segment) and segment[i] == "*":
+                i += 1
+            regex.append("[^/]*")
+        elif char == "?":
+            regex.append("[^/]")
+        elif char == "[":
+            start = i + 1 if segment[i : i + 1] in ("!", "^") else i
+            # A closing bracket right after the opening one is part of
+            # the set.
+            end = segment.find("]", start + 1)
+            if end == -1:
+                regex.append(re.escape(char))
+                continue
+            chars = segment[start:end].replace("\\", "\\\\")
+            regex.append("[%s%s]" % ("^" if start > i else "", chars))
+            i = end + 1
+        elif char == "\\" and i < len(segment):
+            regex.append(re.escape(segment[i]))
+            i += 1
+        else:
+            regex.append(re.escape(char))
+    return "".join(regex)
+
+
+def walk_files(
+    top,
+    exclude=(),
+    ignore_files=IGNORE_FILES,
+    pruned=PRUNED_DIRECTORIES,
+    root=None,
+):
+    """Paths, relative to ``top``, of the files found in ``top``.
+
+    Unlike :func:`os.walk`, directories named in ``pruned`` are never
+    entered, nor directories and files ignored by the ``ignore_files``
+    found on the way or by the ``exclude`` patterns, in the syntax of
+    ``.gitignore`` relative to ``top``. When ``root``, a directory
+    containing ``top``, is given the ``ignore_files`` of the directories
+    from ``root`` down to ``top`` apply too, as in a git repository.
+    Directories are listed with :func:`os.scandir` and symbolic links
+    to directories aren't followed. Paths use ``/`` separators.
+    """
+    # Rules match paths relative to root, which are prefixed by offset.
+    offset = ""
+    rules = IgnoreRules()
+    if root is not None:
+        parents = os.path.relpath(top, root).replace(os.sep, "/").split("/")
+        if parents != ["."]:
+            for i in range(len(parents)):
+                reldir = "/".join(parents[:i])
+                rules = _read_ignore_files(root, reldir, rules, ignore_files)
+            offset = "/".join(parents) + "/"
+    stack = [("", rules.extended(exclude, offset.rstrip("/")))]
+    while stack:
+        reldir, rules = stack.pop()
+        dirpath = os.path.join(top, reldir)
+        rules = _read_ignore_files(
+            top, reldir, rules, ignore_files, (offset + reldir).rstrip("/")
+        )
+        try:
+            with os.scandir(dirpath) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            relpath = reldir + "/" + entry.name if reldir else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if entry.name not in pruned and not rules.ignored(
+                    offset + relpath, True
+                ):
+                    subdirs.append((relpath, rules))
+            elif not rules.ignored(offset + relpath):
+                yield relpath
+        stack.extend(reversed(subdirs))
+
+
+def _read_ignore_files(top, reldir, rules, ignore_files, base=None):
+    """``rules`` extended with the ``ignore_files`` of ``reldir`` in
+    ``top``, relative to ``base``, ``reldir`` by default.
+    """
+    dirpath = os.path.join(top, reldir)
+    for name in ignore_files:
+        try:
+            with open(os.path.join(dirpath, name), encoding="utf-8") as f:
+                rules = rules.extended(f, reldir if base is None else base)
+        except (OSError, UnicodeDecodeError):
+            pass
+    return rules
+
+
+def find_root(path):
+    """Directory whose ignore files apply to ``path``.
+
+    The nearest directory containing ``path`` with a ``.git``, or the
+    current directory when it contains ``path``, otherwise ``None``.
+    """
+    path = os.path.abspath(path)
+    current = path
+    while True:
+        if os.path.exists(os.path.join(current, ".git")):
+            return current
+        parent = os.path.dirname(current)
+        if parent == current:
+            break
+        current = parent
+    cwd = os.getcwd()
+    if path == cwd or path.startswith(cwd.rstrip(os.sep) + os.sep):
+        return cwd
+    return None
+
+
+def glob_files(pattern, exclude=(), ignore=True):
+    """Files matching the glob ``pattern``, like :func:`glob.iglob`.
+
+    Recursive patterns, using ``**``, are matched while walking the
+    tree with :func:`walk_files`, so the directories it prunes and the
+    files it ignores are never listed, including those ignored by the
+    ignore files above the walked directory, from its :func:`find_root`
+    down. Unless ``ignore`` is false, which only honours the ``exclude``
+    patterns. Other patterns are expanded by :func:`glob.iglob`.
+    """
+    segments = pattern.split("/")
+    if "**" not in segments:
+        yield from glob.iglob(pattern, recursive=True)
+        return
+
+    base = []
+    for segment in segments:
+        if _MAGIC_RE.search(segment):
+            break
+        base.append(segment)
+    rest = segments[len(base) :]
+    base = "/".join(base) or ("/" if pattern.startswith("/") else "")
+    regex = re.compile(translate("/".join(rest), dotfiles=False) + r"\Z")
+    top = base or os.curdir
+    if ignore:
+        kw = {"root": find_root(top)}
+    else:
+        kw = {"ignore_files": (), "pruned": ()}
+    for relpath in walk_files(top, exclude, **kw):
+        if regex.match(relpath):
+            yield os.path.join(base, relpath) if base else relpath
@@ -0,0 +1,411 @@
+import io
+import mmap
+import os
+import queue
+import stat
+import threading
+from wsgiref import simple_server
+
+from gearbox.utils.supervisor import serving_request
+
+SERVICE_UNAVAILABLE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Content-Length: 20\r\n"
+    b"Retry-After: 1\r\n"
+    b"Connection: close\r\n"
+    b"\r\n"
+    b"Service Unavailable\n"
+)
+
+
+class ThreadPoolMixIn:
+    """Handle requests of a ``socketserver`` based server in a thread pool.
+
+    Unlike ``socketserver.ThreadingMixIn``, which starts a thread per
+    connection, connections are queued to ``pool_size`` long lived
+    threads. When more than ``max_queued`` connections are waiting the
+    server is overloaded and new ones are answered right away with a
+    ``503 Service Unavailable`` response, instead of piling up threads
+    and memory until the process falls over.
+
+    Threads are only started when the first request arrives, so the
+    server can be created before forking worker processes.
+    """
+
+    pool_size = 10
+    max_queued = 40
+
+    #: Seconds the rejection of a connection can block the accepting thread.
+    reject_timeout = 0.5
+
+    _pool = None
+
+    def process_request(self, request, client_address):
+        if self._pool is None:
+            self._start_pool()
+        try:
+            self._requests.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        """Answer ``request`` with a 503 response and close it"""
+        try:
+            request.settimeout(self.reject_timeout)
+            request.sendall(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return
+        for _ in pool:
+            self._requests.put(None)
+        for thread in pool:
+            thread.join()
+
+    def _start_pool(self):
+        self._requests = queue.Queue(self.max_queued)
+        self._pool = []
+        for i in range(self.pool_size):
+            thread = threading.Thread(
+                target=self._process_requests,
+                name="%s-%d" % (type(self).__name__, i),
+                daemon=True,
+            )
+            thread.start()
+            self._pool.append(thread)
+
+    def _process_requests(self):
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            request, client_address = item
+            # Same as socketserver.ThreadingMixIn.process_request_thread
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+class RequestBody:
+    """``wsgi.input`` stream limited to the ``Content-Length`` of a request.
+
+    Keeps applications from reading into the next request of a
+    persistent connection, and allows the server to skip the part of
+    the body the application didn't read.
+    """
+
+    def __init__(self, rfile, length):
+        self._rfile = rfile
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._rfile.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self._rfile.readline(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readlines(self, hint=-1):
+        lines = []
+        total = 0
+        for line in self:
+            lines.append(line)
+            total += len(line)
+            if 0 < hint <= total:
+                break
+        return lines
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def drain(self, limit):
+        """Discard the unread body, ``False`` when more than ``limit`` is left"""
+        if self.remaining > limit:
+            return False
+        while self.remaining:
+            if not self.read(min(self.remaining, 65536)):
+                return False
+        return True
+
+
+class FileWrapper:
+    """``wsgi.file_wrapper`` sending regular files without copying them.
+
+    Servers detect it and transmit the file with ``os.sendfile``,
+    from the current position of the file up to its end or the
+    ``Content-Length`` of the response. When iterated instead, regular
+    files are memory mapped and other file-like objects are read in
+    ``blksize`` blocks.
+    """
+
+    def __init__(self, filelike, blksize=65536):
+        self.filelike = filelike
+        self.blksize = blksize
+        if hasattr(filelike, "close"):
+            self.close = filelike.close
+
+    def fileno(self):
+        """Descriptor of the wrapped file if it's a regular file, or ``None``"""
+        try:
+            fd = self.filelike.fileno()
+            if stat.S_ISREG(os.fstat(fd).st_mode):
+                return fd
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            pass
+        return None
+
+    def __iter__(self):
+        fd = self.fileno()
+        if fd is None:
+            return self._read_blocks()
+        return self._map_blocks(fd)
+
+    def _read_blocks(self):
+        while True:
+            data = self.filelike.read(self.blksize)
+            if not data:
+                return
+            yield data
+
+    def _map_blocks(self, fd):
+        offset = self.filelike.tell()
+        size = os.fstat(fd).st_size
+        if offset >= size:
+            return
+        with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mapped:
+            for start in range(offset, size, self.blksize):
+                yield mapped[start : start + self.blksize]
+        self.filelike.seek(size)
+
+
+class GearboxServerHandler(simple_server.ServerHandler):
+    """``ServerHandler`` sending :class:`FileWrapper` responses with ``sendfile``"""
+
+    wsgi_file_wrapper = FileWrapper
+
+    def sendfile(self):
+        fd = self.result.fileno()
+        connection = getattr(self.request_handler, "connection", None)
+        if fd is None or connection is None:
+            return False
+
+        filelike = self.result.filelike
+        offset = filelike.tell()
+        count = max(os.fstat(fd).st_size - offset, 0)
+        if "Content-Length" in self.headers:
+            count = min(count, int(self.headers["Content-Length"]))
+        else:
+            self.headers["Content-Length"] = str(count)
+
+        if not self.headers_sent:
+            self.send_headers()
+        self._flush()
+        if count and self.environ["REQUEST_METHOD"] != "HEAD":
+            # Falls back to send() itself for TLS connections.
+            self.bytes_sent = connection.sendfile(filelike, offset, count)
+        self.finish_content()
+        return True
+
+
+class GearboxWSGIRequestHandler(simple_server.WSGIRequestHandler):
+    """``WSGIRequestHandler`` serving requests with a :class:`GearboxServerHandler`"""
+
+    server_handler_class = GearboxServerHandler
+
+    def run_application(self, handler):
+        """Serve the request through ``handler``.
+
+        A server stopped meanwhile only exits once the response is sent.
+        """
+        with serving_request():
+            handler.run(self.server.get_app())
+            self.wfile.flush()
+
+    def handle(self):
+        # Same as simple_server.WSGIRequestHandler.handle
+        self.raw_requestline = self.rfile.readline(65537)
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            return
+        if not self.parse_request():
+            return
+        handler = self.server_handler_class(
+            self.rfile,
+            self.wfile,
+            self.get_stderr(),
+            self.get_environ(),
+            multithread=False,
+        )
+        handler.request_handler = self
+        self.run_application(handler)
+
+
+class KeepAliveServerHandler(GearboxServerHandler):
+    """``ServerHandler`` framing responses for persistent connections.
+
+    Responses without a ``Content-Length`` are sent with chunked
+    transfer encoding to HTTP/1.1 clients, when the response can't be
+    delimited the connection is closed after it.
+    """
+
+    http_version = "1.1"
+
+    chunked = False
+
+    def cleanup_headers(self):
+        super().cleanup_headers()
+        request_handler = self.request_handler
+        if (self.headers.get("Connection") or "").lower() == "close":
+            request_handler.close_connection = True
+
+        if (
+            "Content-Length" not in self.headers
+            and self.environ["REQUEST_METHOD"] != "HEAD"
+            and self.status[:3] not in ("204", "304")
+        ):
+            if request_handler.request_version == "HTTP/1.1":
+                self.headers["Transfer-Encoding"] = "chunked"
+                self.chunked = True
+            else:
+                request_handler.close_connection = True
+
+        if request_handler.close_connection:
+            self.headers["Connection"] = "close"
+        elif request_handler.request_version != "HTTP/1.1":
+            self.headers["Connection"] = "keep-alive"
+
+    def write(self, data):
+        if type(data) is not bytes:
+            raise AssertionError("write() argument must be a bytes instance")
+        if not self.status:
+            raise AssertionError("write() before start_response()")
+        elif not self.headers_sent:
+            self.bytes_sent = len(data)
+            self.send_headers()
+        else:
+            self.bytes_sent += len(data)
+
+        if self.environ["REQUEST_METHOD"] == "HEAD" or not data:
+            return
+        if self.chunked:
+            data = b"%x\r\n%s\r\n" % (len(data), data)
+        self._write(data)
+        self._flush()
+
+    def finish_content(self):
+        super().finish_content()
+        if self.chunked:
+            self._write(b"0\r\n\r\n")
+            self._flush()
+        self.request_handler.response_complete = True
+
+
+class KeepAliveWSGIRequestHandler(GearboxWSGIRequestHandler):
+    """``WSGIRequestHandler`` serving multiple requests per connection.
+
+    Speaks HTTP/1.1, so connections are kept open until the client asks
+    to close them, ``max_requests`` requests were served on them or no
+    new request arrives within ``timeout`` seconds. Pipelined requests
+    are served in order as they are read from the connection buffer.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_handler_class = KeepAliveServerHandler
+
+    # Headers and body are buffered into as few packets as possible and
+    # sent right away, waiting for ACKs of earlier responses would
+    # otherwise stall every request after the first one.
+    wbufsize = 65536
+    disable_nagle_algorithm = True
+
+    #: Seconds to wait for the next request, or for a slow client.
+    timeout = 5
+
+    #: Requests served on a connection before closing it, 0 for no limit.
+    max_requests = 100
+
+    #: Bytes of request body left unread by the application that are
+    #: skipped to serve the next request, larger leftovers close the
+    #: connection instead.
+    max_drain = 65536
+
+    def handle_expect_100(self):
+        # The interim response would otherwise sit in the buffer of wfile,
+        # while the client waits for it before sending the body.
+        continued = super().handle_expect_100()
+        self.wfile.flush()
+        return continued
+
+    def handle(self):
+        self.close_connection = True
+        self.served_requests = 0
+        self.handle_one_request()
+        while not self.close_connection:
+            self.handle_one_request()
+
+    def handle_one_request(self):
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (TimeoutError, ConnectionError):
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            self.close_connection = True
+            return
+        if not self.parse_request():
+            return
+
+        self.served_requests += 1
+        if self.max_requests and self.served_requests >= self.max_requests:
+            self.close_connection = True
+        if "Transfer-Encoding" in self.headers:
+            # Chunked request bodies are not supported by wsgiref.
+            self.close_connection = True
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = 0
+        body = RequestBody(self.rfile, max(length, 0))
+        self.response_complete = False
+        handler = self.server_handler_class(
+            body, self.wfile, self.get_stderr(), self.get_environ(), multithread=False
+        )
+        handler.request_handler = self
+        self.run_application(handler)
+
+        try:
+            if not self.response_complete or not body.drain(self.max_drain):
+                self.close_connection = True
+        except OSError:
+            self.close_connection = True
@@ -0,0 +1,300 @@
+import atexit
+import errno
+import importlib
+import json
+import logging
+import os
+import select
+import signal
+import sys
+import threading
+import time
+
+from gearbox.utils.plugins import find_project_dir, is_project_file
+from gearbox.utils.supervisor import describe_exit_status, stop_process
+
+_child = False
+_report_fd = None
+
+
+def is_child():
+    """Whether the current process was forked by a :class:`Zygote`"""
+    return _child
+
+
+def report_loaded(files=()):
+    """Tell the zygote which modules the application needed.
+
+    Called by the child once the application is loaded, and at exit if
+    loading failed. The zygote then preimports the third-party modules,
+    so that the next children get them for free, and watches the project
+    modules and ``files`` for changes.
+    """
+    global _report_fd
+    fd, _report_fd = _report_fd, None
+    if fd is None:
+        return
+    modules = []
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, "__file__", None)
+        if isinstance(filename, str):
+            modules.append((name, filename))
+    report = {"modules": modules, "files": [os.path.abspath(f) for f in files]}
+    with os.fdopen(fd, "wb") as f:
+        f.write(json.dumps(report).encode("utf-8"))
+
+
+class Zygote:
+    """Reloader forking a fresh process from a preloaded parent on changes.
+
+    Unlike the ``hupper`` reloader, which starts the whole command again
+    on each change, the zygote stays alive across reloads: it imports
+    once the third-party modules the application uses, and each child
+    forked from it only has to import the project modules and load the
+    application again.
+
+    Modules whose file is outside ``project_dir``, or in a
+    ``site-packages`` directory, are considered third-party: they are
+    preimported and not watched, restart the command after upgrading
+    them. ``SIGTERM`` and ``SIGINT`` stop the child and the zygote.
+
+    :param monitor_factory: A ``hupper`` file monitor factory.
+    :param out: Callable used to report what's going on.
+    :param files: Files watched from the start, like the config file.
+    :param project_dir: Directory of the project, found from the current
+                        directory by default.
+    :param shutdown_timeout: Seconds the child has to exit before being
+                             killed.
+    """
+
+    STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+    def __init__(
+        self,
+        monitor_factory,
+        out,
+        files=(),
+        project_dir=None,
+        reload_interval=1,
+        shutdown_timeout=5,
+    ):
+        self.monitor_factory = monitor_factory
+        self.out = out
+        self.files = [os.path.abspath(f) for f in files]
+        self.project_dir = project_dir or find_project_dir(os.getcwd())
+        self.reload_interval = reload_interval
+        self.shutdown_timeout = shutdown_timeout
+        self.preloaded = set()
+        self.watched = set()
+        self.child = None
+        self._changed = []
+        self._changed_lock = threading.Lock()
+        self._signals = []
+        self._wakeup = None
+        self._previous_handlers = {}
+        self._monitor = None
+
+    def run(self):
+        """Fork the first child and reload it on changes.
+
+        Returns ``None`` in each child, which should go on loading the
+        application and then call :func:`report_loaded`. Returns the exit
+        code in the zygote once it is asked to stop.
+        """
+        self._install_signal_handlers()
+        self._monitor = self.monitor_factory(
+            self._file_changed,
+            interval=self.reload_interval,
+            logger=logging.getLogger("gearbox"),
+        )
+        self.watch(self.files)
+        self._monitor.start()
+        try:
+            while True:
+                report_fd = self.spawn()
+                if report_fd is None:
+                    return None
+                if not self._supervise(report_fd):
+                    return 0
+        finally:
+            if not _child:
+                self._monitor.stop()
+                self._monitor.join()
+                self._restore_signal_handlers()
+
+    def spawn(self):
+        """Fork a child, returns the pipe it reports on, ``None`` in the child"""
+        global _child, _report_fd
+        read_fd, write_fd = os.pipe()
+        started = time.monotonic()
+        pid = os.fork()
+        if pid:
+            os.close(write_fd)
+            self.child = pid
+            self.out(
+                "Forked server in PID %s (%.3fs)" % (pid, time.monotonic() - started)
+            )
+            return read_fd
+
+        os.close(read_fd)
+        self._reset_child_process()
+        _child = True
+        _report_fd = write_fd
+        atexit.register(report_loaded, self.files)
+        return None
+
+    def watch(self, files):
+        for filename in files:
+            if filename not in self.watched:
+                self.watched.add(filename)
+                self._monitor.add_path(filename)
+
+    def preload(self, modules):
+        """Import the third-party ``modules`` and watch the project ones.
+
+        :param modules: ``(name, filename)`` of modules the child imported.
+        """
+        third_party = []
+        for name, filename in modules:
+            if is_project_file(filename, self.project_dir):
+                self.watch([filename])
+            else:
+                third_party.append(name)
+
+        imported = 0
+        started = time.monotonic()
+        for name in third_party:
+            if name in self.preloaded or name == "__main__":
+                continue
+            self.preloaded.add(name)
+            if name in sys.modules:
+                continue
+            try:
+                importlib.import_module(name)
+            except BaseException:
+                # Only a missed optimization, the child will import it.
+                continue
+            imported += 1
+        if imported:
+            self.out(
+                "Preloaded %d modules in %.3fs" % (imported, time.monotonic() - started)
+            )
+
+    def stop_child(self):
+        """Stop the child, killing it if it doesn't exit in time"""
+        if self.child is None:
+            return
+        try:
+            _, killed = stop_process(self.child, self.shutdown_timeout)
+        except TimeoutError as e:
+            self.out(str(e))
+        else:
+            if killed:
+                self.out("Server (PID %s) did not stop, killed it" % self.child)
+        self.child = None
+
+    def _supervise(self, report_fd):
+        """Wait for a change, returns ``False`` if asked to stop instead"""
+        report = []
+        try:
+            while True:
+                readers = [self._wakeup[0]]
+                if report_fd is not None:
+                    readers.append(report_fd)
+                try:
+                    ready, _, _ = select.select(readers, [], [], 1.0)
+                except InterruptedError:
+                    ready = []
+                if report_fd in ready:
+                    data = os.read(report_fd, 65536)
+                    if data:
+                        report.append(data)
+                    else:
+                        os.close(report_fd)
+                        report_fd = None
+                        self._load_report(b"".join(report))
+                if self._wakeup[0] in ready:
+                    self._drain_wakeup()
+
+                if self._signals:
+                    self.stop_child()
+                    return False
+                with self._changed_lock:
+                    changed, self._changed = self._changed, []
+                if changed:
+                    self.out("%s changed; reloading..." % changed[0])
+                    self.stop_child()
+                    return True
+                self._reap_child()
+        finally:
+            if report_fd is not None:
+                os.close(report_fd)
+
+    def _load_report(self, data):
+        try:
+            report = json.loads(data.decode("utf-8"))
+        except ValueError:
+            return
+        self.watch(report.get("files", ()))
+        self.preload(report.get("modules", ()))
+
+    def _reap_child(self):
+        if self.child is None:
+            return
+        try:
+            pid, status = os.waitpid(self.child, os.WNOHANG)
+        except ChildProcessError:
+            pid, status = self.child, 0
+        if pid:
+            self.out(
+                "Server (PID %s) %s, waiting for changes to reload"
+                % (pid, describe_exit_status(status))
+            )
+            self.child = None
+
+    def _file_changed(self, path):
+        # Called from the monitor thread.
+        with self._changed_lock:
+            self._changed.append(path)
+        try:
+            os.write(self._wakeup[1], b"\0")
+        except (OSError, TypeError):
+            pass
+
+    def _install_signal_handlers(self):
+        read_fd, write_fd = os.pipe()
+        os.set_blocking(read_fd, False)
+        os.set_blocking(write_fd, False)
+        self._wakeup = (read_fd, write_fd)
+        self._previous_wakeup_fd = signal.set_wakeup_fd(write_fd)
+        for signum in self.STOP_SIGNALS:
+            self._previous_handlers[signum] = signal.signal(signum, self._on_signal)
+
+    def _restore_signal_handlers(self):
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler if handler is not None else signal.SIG_DFL)
+        self._previous_handlers.clear()
+        signal.set_wakeup_fd(self._previous_wakeup_fd)
+        for fd in self._wakeup:
+            os.close(fd)
+        self._wakeup = None
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _drain_wakeup(self):
+        try:
+            while os.read(self._wakeup[0], 1024):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _reset_child_process(self):
+        wakeup, self._wakeup = self._wakeup, None
+        signal.set_wakeup_fd(-1)
+        for fd in wakeup:
+            os.close(fd)
+        for signum, handler in self._previous_handlers.items():
+            signal.signal(signum, handler if handler is not None else signal.SIG_DFL)
+        self._previous_handlers = {}
@@ -1,8 +1,19 @@
 import argparse
+import glob
+import http.client
 import importlib.metadata
+import json
+import os
 import pathlib
+import socket
+import subprocess
 import sys
 import tempfile
+import textwrap
+import threading
+import time
+import urllib.error
+import urllib.request
 from unittest.mock import MagicMock, patch
 
 import pytest
@@ -10,11 +21,55 @@ import pytest
 from gearbox.command import Command
 from gearbox.commandmanager import CommandManager
 from gearbox.commands.help import HelpAction
-from gearbox.commands.serve import ServeCommand
+from gearbox.commands.patch import get_matcher, patch_file
+from gearbox.commands.serve import (
+    ServeCommand,
+    asyncio_server_runner,
+    cherrypy_server_runner,
+    server_address,
+    worker_pid_file,
+    worker_pid_files,
+    wsgiref_server_runner,
+)
 from gearbox.commands.setup_app import SetupAppCommand
 from gearbox.main import GearBox, main
+from gearbox.utils import configgraph, control, plugins, sockets, supervisor
+from gearbox.utils.aioserver import AsyncioWSGIServer
 from gearbox.utils.copydir import copy_dir
-from gearbox.utils.plugins import find_local_distribution
+from gearbox.utils.lazy import lazy_import
+from gearbox.utils.metrics import (
+    LatencyHistogram,
+    MetricsMiddleware,
+    MetricsRegistry,
+    RequestStats,
+    serve_metrics,
+)
+from gearbox.utils.monitor import (
+    InotifyFileMonitor,
+    ScopedFileMonitor,
+    is_inotify_supported,
+)
+from gearbox.utils.plugins import (
+    EntryPointIndex,
+    find_local_distribution,
+    is_project_file,
+)
+from gearbox.utils.profiler import ProfilerMiddleware, SamplingProfiler
+from gearbox.utils.walk import glob_files, walk_files
+from gearbox.utils.wsgiserver import (
+    FileWrapper,
+    GearboxWSGIRequestHandler,
+    KeepAliveWSGIRequestHandler,
+    ThreadPoolMixIn,
+)
+
+
+@pytest.fixture(autouse=True)
+def entry_point_index(tmp_path_factory, monkeypatch):
+    index_file = tmp_path_factory.mktemp("cache") / "entry_points.json"
+    index = EntryPointIndex(str(index_file))
+    monkeypatch.setattr(plugins, "_index", index)
+    return index
 
 
 def _write_dist_info(
@@ -619,7 +674,7 @@ def test_patch(tmp_path):
 
     with (
         patch(
-            "gearbox.commands.patch.glob.glob",
+            "gearbox.utils.walk.glob.glob",
             return_value=[str(test_file)],
         ),
         patch.object(
@@ -670,6 +725,265 @@ def test_patch_accepts_relative_nested_file_path(tmp_path, monkeypatch):
     assert test_file.read_text() == ""
 
 
+def test_patch_in_parallel_reports_files_in_glob_order(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("gearbox.commands.patch.PATCH_BATCH_SIZE", 3)
+    for i in range(10):
+        (tmp_path / ("%d.txt" % i)).write_text("line %d\nHello World\n" % i)
+    (tmp_path / "7.txt").write_text("nothing here\n")
+    os.chmod(tmp_path / "3.txt", 0o640)
+
+    with patch.object(
+        sys, "argv", ["gearbox", "patch", "*.txt", "World", "-r", "Gearbox", "-j", "2"]
+    ):
+        main()
+
+    expected = glob.glob("*.txt")
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "10 files matching"
+    assert [line.split()[-1] for line in out[1:]] == expected
+    assert "x Patching 7.txt" in out
+    assert (tmp_path / "3.txt").read_text() == "line 3\nHello Gearbox\n"
+    assert os.stat(tmp_path / "3.txt").st_mode & 0o777 == 0o640
+    assert sorted(os.listdir(tmp_path)) == sorted(expected)
+
+
+def test_patch_skips_files_without_match_or_change(tmp_path):
+    binary = tmp_path / "binary.txt"
+    binary.write_bytes(b"\xff\xfe not utf-8\n")
+    same = tmp_path / "same.txt"
+    same.write_text("Hello World\n")
+    inode = os.stat(same).st_ino
+    opts = argparse.Namespace(
+        text="World",
+        replacement="World",
+        regex=False,
+        eval=False,
+        addition=None,
+        delete=False,
+        multiline=False,
+    )
+
+    # Not decoded, as it doesn't contain the text.
+    assert patch_file(str(binary), opts) is False
+    assert patch_file(str(same), opts) is True
+    assert os.stat(same).st_ino == inode
+
+    opts.regex, opts.text, opts.replacement = True, r"W(or)ld", r"\1"
+    assert patch_file(str(same), opts) is True
+    assert same.read_text() == "Hello or\n"
+    assert get_matcher(r"W(or)ld", True) is get_matcher(r"W(or)ld", True)
+
+
+def test_patch_streams_large_files_keeping_line_endings(tmp_path, monkeypatch):
+    from gearbox.commands import patch
+
+    monkeypatch.setattr(patch, "STREAM_THRESHOLD", 1)
+    monkeypatch.setattr(patch, "STREAM_CHUNK_SIZE", 16)
+    big = tmp_path / "big.txt"
+    big.write_bytes(b"".join(b"line %d\r\n" % i for i in range(100)) + b"last 7")
+    opts = argparse.Namespace(
+        text=r"^line (\d*7)$",
+        replacement=r"seven \1",
+        regex=True,
+        eval=False,
+        addition=None,
+        delete=False,
+        multiline=False,
+    )
+
+    assert patch_file(str(big), opts) is True
+    lines = big.read_bytes().split(b"\r\n")
+    assert lines[7] == b"seven 7" and lines[97] == b"seven 97"
+    assert lines[8] == b"line 8" and lines[-1] == b"last 7"
+    assert len(lines) == 101
+
+    inode = os.stat(big).st_ino
+    opts.text, opts.regex = "missing", False
+    assert patch_file(str(big), opts) is False
+    assert os.stat(big).st_ino == inode
+    assert os.listdir(tmp_path) == ["big.txt"]
+
+
+def test_patch_multiline_matches_across_lines(tmp_path, monkeypatch, capsys):
+    test_file = tmp_path / "root.py"
+    test_file.write_text(
+        "import os\nimport sys\n\nx = 1\nimport re\nimport json\n\n@expose(\n"
+        "    'index.html'\n)\ndef index(): pass\n"
+    )
+    monkeypatch.chdir(tmp_path)
+
+    with patch.object(
+        sys,
+        "argv",
+        [
+            "gearbox",
+            "patch",
+            "root.py",
+            "-m",
+            "-x",
+            r"import (\w+)\nimport (\w+)$",
+            "-r",
+            r"import \1, \2",
+        ],
+    ):
+        main()
+
+    out = capsys.readouterr().out.splitlines()
+    assert out[-1] == "! Patching root.py (lines 1-2, 5-6)"
+    assert test_file.read_text().startswith(
+        "import os, sys\n\nx = 1\nimport re, json\n\n@expose"
+    )
+
+    opts = argparse.Namespace(
+        text="@expose(\n    'index.html'\n)",
+        replacement=None,
+        regex=False,
+        eval=False,
+        addition="@expose('index.html')",
+        delete=True,
+        multiline=True,
+    )
+    assert patch_file(str(test_file), opts) == [(6, 8)]
+    assert test_file.read_text().endswith(
+        "import re, json\n\n@expose('index.html')\ndef index(): pass\n"
+    )
+
+
+def test_patch_rules_apply_in_order_in_a_single_pass(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "root.py").write_text(
+        "from tg.decorators import expose\nimport os\nimport sys\nx = 100%\n"
+    )
+    (tmp_path / "other.py").write_text("import os\n")
+    (tmp_path / "README.txt").write_text("tg.decorators\n")
+    (tmp_path / "upgrade.ini").write_text(
+        "[decorators]\n"
+        "pattern = *.py\n"
+        "text = tg.decorators\n"
+        "replace = tg\n"
+        "\n"
+        "[expose]\n"
+        "pattern = *.py\n"
+        "text = from tg import (\\w+)\n"
+        "replace = from tg import \\1, redirect\n"
+        "regex = true\n"
+        "\n"
+        "[imports]\n"
+        "pattern = *.py\n"
+        "text = import os\\nimport sys\\n\n"
+        "replace = import os, sys\\n\n"
+        "regex = yes\n"
+        "multiline = yes\n"
+        "\n"
+        "[percent]\n"
+        "pattern = root.py\n"
+        "text = 100%\n"
+        "delete = true\n"
+    )
+
+    with patch.object(sys, "argv", ["gearbox", "patch", "--rules", "upgrade.ini"]):
+        main()
+
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "2 files matching"
+    assert sorted(out[1:]) == [
+        "! Patching root.py (decorators, expose, imports, percent)",
+        "x Patching other.py",
+    ]
+    assert (tmp_path / "root.py").read_text() == (
+        "from tg import expose, redirect\nimport os, sys\n"
+    )
+    assert (tmp_path / "README.txt").read_text() == "tg.decorators\n"
+
+    (tmp_path / "upgrade.toml").write_text(
+        '[[rule]]\nname = "redirect"\npattern = "root.py"\ntext = "expose, redirect"\n'
+        'replace = "expose"\n'
+    )
+    with patch.object(sys, "argv", ["gearbox", "patch", "--rules", "upgrade.toml"]):
+        main()
+    assert (tmp_path / "root.py").read_text().startswith("from tg import expose\n")
+
+    (tmp_path / "broken.ini").write_text("[rule]\npattern = *.py\nreplacement = x\n")
+    with patch.object(sys, "argv", ["gearbox", "patch", "--rules", "broken.ini"]):
+        assert main() == 2
+    assert "Unknown options replacement" in capsys.readouterr().out
+
+    from gearbox.commands import patch as patch_command
+
+    monkeypatch.setattr(patch_command, "tomllib", lazy_import("gearbox_no_tomllib"))
+    with patch.object(sys, "argv", ["gearbox", "patch", "--rules", "upgrade.toml"]):
+        assert main() == 2
+    assert "TOML rules need Python 3.11+" in capsys.readouterr().out
+
+
+def test_patch_rules_stream_large_files(tmp_path, monkeypatch):
+    from gearbox.commands import patch
+
+    monkeypatch.setattr(patch, "STREAM_THRESHOLD", 1)
+    monkeypatch.setattr(patch, "STREAM_CHUNK_SIZE", 16)
+    big = tmp_path / "big.txt"
+    big.write_bytes(b"".join(b"line %d\r\n" % i for i in range(100)) + b"last 7")
+    (tmp_path / "upgrade.ini").write_text(
+        "[seven]\npattern = big.txt\ntext = ^line (\\d*7)$\n"
+        "replace = seven \\1\nregex = true\n\n"
+        "[eight]\npattern = big.txt\ntext = seven 97\nappend = eight\n\n"
+        "[missing]\npattern = big.txt\ntext = missing\ndelete = true\n"
+    )
+    rules = patch.load_rules(str(tmp_path / "upgrade.ini"))
+
+    assert patch.patch_file_rules(str(big), rules) == ["seven", "eight"]
+    # Unlike files read in memory, streamed files keep their line endings.
+    lines = big.read_bytes().split(b"\r\n")
+    assert lines[7] == b"seven 7" and lines[97] == b"seven 97"
+    assert lines[98] == b"eight" and lines[99] == b"line 98"
+    assert lines[-1] == b"last 7" and len(lines) == 102
+
+
+def test_walk_files_prunes_and_honours_ignore_files(tmp_path):
+    for path in (
+        "app.py",
+        "debug.log",
+        "keep.log",
+        "node_modules/lib/index.js",
+        ".git/HEAD",
+        "build/app.py",
+        "pkg/__pycache__/app.cpython-311.pyc",
+        "pkg/models.py",
+        "pkg/secret.py",
+        "pkg/api_pb2.py",
+        "pkg/generated/api.py",
+        "pkg/build/notes.txt",
+        "docs/index.rst",
+        "dist/app.tar.gz",
+        "lib/dist/readme.txt",
+    ):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+    (tmp_path / ".gitignore").write_text(
+        "# Logs\n*.log\n!keep.log\n/dist/\n*_pb2.py\npkg/generated/\n"
+    )
+    (tmp_path / "pkg" / ".gitignore").write_text("secret.py\n")
+
+    assert sorted(walk_files(str(tmp_path), exclude=["docs/"])) == [
+        ".gitignore",
+        "app.py",
+        "keep.log",
+        "lib/dist/readme.txt",
+        "pkg/.gitignore",
+        "pkg/models.py",
+    ]
+    assert sorted(glob_files(str(tmp_path) + "/**/*.py")) == [
+        str(tmp_path / "app.py"),
+        str(tmp_path / "pkg" / "models.py"),
+    ]
+    assert len(list(glob_files(str(tmp_path) + "/**/*.py", ignore=False))) == 6
+    # Ignore files above the directory walked apply, from the repository.
+    assert list(glob_files(str(tmp_path / "pkg") + "/**/*.py")) == [
+        str(tmp_path / "pkg" / "models.py")
+    ]
+
+
 def test_copy_dir_interactive_diff_prefers_utf8_decoding(tmp_path):
     src_dir = tmp_path / "src"
     dest_dir = tmp_path / "dest"
@@ -732,16 +1046,12 @@ def test_global_extension_command_help_flag_shows_command_help(monkeypatch, caps
     extension_ep.name = "extensioncheck"
     extension_ep.load.return_value = ExtensionCommand
 
-    class EntryPointSet:
-        def select(self, group):
-            if group == "gearbox.commands":
-                return [extension_ep]
-            return []
+    def entry_points(group):
+        if group == "gearbox.commands":
+            return [extension_ep]
+        return []
 
-    monkeypatch.setattr(
-        "gearbox.commandmanager.importlib.metadata.entry_points",
-        lambda: EntryPointSet(),
-    )
+    monkeypatch.setattr("gearbox.commandmanager.entry_points", entry_points)
 
     result = GearBox().run(["extensioncheck", "--help"])
 
@@ -837,16 +1147,12 @@ def test_command_manager_loads_tgext_pluggable_style_global_commands():
     migrate_ep.name = "migrate-pluggable"
     plugin_eps = [quickstart_ep, migrate_ep]
 
-    class EntryPointSet:
-        def select(self, group):
-            if group == "gearbox.commands":
-                return plugin_eps
-            return []
+    def entry_points(group):
+        if group == "gearbox.commands":
+            return plugin_eps
+        return []
 
-    with patch(
-        "gearbox.commandmanager.importlib.metadata.entry_points"
-    ) as entry_points:
-        entry_points.return_value = EntryPointSet()
+    with patch("gearbox.commandmanager.entry_points", side_effect=entry_points):
         cm = CommandManager(namespace="gearbox.commands")
 
     assert cm.commands["quickstart-pluggable"] is quickstart_ep
@@ -951,10 +1257,13 @@ def test_run_continues_when_project_distribution_is_missing():
     run_subcommand.assert_called_once_with(["help"])
 
 
-def test_find_local_distribution_continues_after_unreadable_directory(tmp_path):
+def test_find_local_distribution_continues_after_unreadable_directory(
+    tmp_path, entry_point_index
+):
     project_root = tmp_path / "project"
     nested_dir = project_root / "app" / "pkg"
-    nested_dir.mkdir(parents=True)
+    (nested_dir / "pkg.dist-info").mkdir(parents=True)
+    (project_root / "project.egg-info").mkdir()
 
     plugin_ep = MagicMock(group="gearbox.plugins")
     dist = MagicMock()
@@ -969,15 +1278,20 @@ def test_find_local_distribution_continues_after_unreadable_directory(tmp_path):
         return []
 
     with patch(
-        "gearbox.utils.plugins.importlib.metadata.distributions",
-        side_effect=fake_distributions,
-    ):
+        "importlib.metadata.distributions", side_effect=fake_distributions
+    ) as distributions:
         found_dist, found_path = find_local_distribution(
             str(nested_dir), "gearbox.plugins"
         )
 
     assert found_dist is dist
     assert found_path == str(project_root)
+    assert distributions.call_count == 2
+
+    # Directories searched for a local project are not indexed.
+    find_local_distribution(str(nested_dir))
+    entry_point_index.save()
+    assert not os.path.exists(entry_point_index.filename)
 
 
 def test_load_commands_for_package_logs_context_when_distribution_missing(caplog):
@@ -1006,3 +1320,1253 @@ def test_version_option_uses_gearbox_version_fallback(capsys, monkeypatch):
     with pytest.raises(SystemExit):
         app.run(["--version"])
     assert "unknown-test" in capsys.readouterr().out
+
+
+def _age_tree(path, seconds=60):
+    past = pathlib.Path(path).stat().st_mtime - seconds
+    for entry in sorted(pathlib.Path(path).rglob("*"), reverse=True):
+        os.utime(entry, (past, past))
+    os.utime(path, (past, past))
+
+
+def test_entry_point_index_warm_lookup_reads_no_metadata(tmp_path):
+    plugin_root = tmp_path / "plugins"
+    plugin_root.mkdir()
+    _write_dist_info(
+        plugin_root,
+        "tgext.indexed",
+        "1.0",
+        "[gearbox.commands]\nindexed-cmd = tgext.indexed:IndexedCommand\n",
+    )
+    _age_tree(plugin_root)
+    index_file = str(tmp_path / "index.json")
+
+    cold = EntryPointIndex(index_file)
+    cold_eps = cold.entry_points("gearbox.commands", path=[str(plugin_root)])
+    assert [ep.name for ep in cold_eps] == ["indexed-cmd"]
+
+    warm = EntryPointIndex(index_file)
+    with patch(
+        "gearbox.utils.plugins.importlib.metadata.PathDistribution",
+        side_effect=AssertionError("metadata should not be read"),
+    ):
+        warm_eps = warm.entry_points("gearbox.commands", path=[str(plugin_root)])
+
+    assert [(ep.name, ep.value) for ep in warm_eps] == [
+        ("indexed-cmd", "tgext.indexed:IndexedCommand")
+    ]
+
+
+def test_entry_point_index_picks_up_changed_distributions(tmp_path):
+    plugin_root = tmp_path / "plugins"
+    plugin_root.mkdir()
+    first = _write_dist_info(
+        plugin_root, "first", "1.0", "[gearbox.commands]\nfirst = first:Command\n"
+    )
+    _age_tree(plugin_root, seconds=120)
+    index_file = str(tmp_path / "index.json")
+    EntryPointIndex(index_file).entry_points("gearbox.commands", path=[plugin_root])
+
+    (first / "entry_points.txt").write_text(
+        "[gearbox.commands]\nfirst-renamed = first:Command\n"
+    )
+    _write_dist_info(
+        plugin_root, "second", "1.0", "[gearbox.commands]\nsecond = second:Command\n"
+    )
+    _age_tree(plugin_root, seconds=60)
+
+    index = EntryPointIndex(index_file)
+    eps = index.entry_points("gearbox.commands", path=[str(plugin_root)])
+
+    assert sorted(ep.name for ep in eps) == ["first-renamed", "second"]
+
+
+def test_entry_point_index_earlier_path_entries_shadow_later_ones(tmp_path):
+    first_root = tmp_path / "first"
+    second_root = tmp_path / "second"
+    first_root.mkdir()
+    second_root.mkdir()
+    _write_dist_info(
+        first_root, "dupe", "2.0", "[gearbox.commands]\nnew = dupe:NewCommand\n"
+    )
+    _write_dist_info(
+        second_root, "dupe", "1.0", "[gearbox.commands]\nold = dupe:OldCommand\n"
+    )
+
+    index = EntryPointIndex(str(tmp_path / "index.json"))
+    eps = index.entry_points(
+        "gearbox.commands", path=[str(first_root), str(second_root)]
+    )
+
+    assert [ep.name for ep in eps] == ["new"]
+
+
+def test_help_action_lists_summary_without_instantiating(capsys):
+    class SummaryCommand(Command):
+        summary = "Command with a declared summary"
+
+        def __init__(self, *args, **kwargs):
+            raise AssertionError("command should not be instantiated")
+
+    cm = CommandManager(namespace="test")
+    cm.add_command("summarized", SummaryCommand)
+    action = HelpAction(
+        option_strings=[], dest="help", nargs=0, default=MagicMock(command_manager=cm)
+    )
+
+    with pytest.raises(SystemExit):
+        action(argparse.ArgumentParser(prog="fakeapp"), argparse.Namespace(), None)
+
+    assert "summarized     Command with a declared summary" in capsys.readouterr().out
+
+
+def test_lazy_import_defers_module_loading(tmp_path, monkeypatch):
+    (tmp_path / "heavy_dependency.py").write_text("VALUE = 42\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, "heavy_dependency", raising=False)
+
+    module = lazy_import("heavy_dependency")
+    assert "heavy_dependency" not in sys.modules
+
+    assert module.VALUE == 42
+    assert "heavy_dependency" in sys.modules
+    assert lazy_import("heavy_dependency") is sys.modules["heavy_dependency"]
+
+
+def test_listing_commands_does_not_import_server_dependencies(tmp_path):
+    code = (
+        "import sys\n"
+        "from gearbox.main import GearBox\n"
+        "try:\n"
+        "    GearBox().run(['help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "heavy = ('paste.deploy', 'hupper', 'tempita')\n"
+        "sys.stderr.write(repr([m for m in heavy if m in sys.modules]))\n"
+    )
+    env = dict(os.environ, GEARBOX_CACHE_DIR=str(tmp_path))
+    proc = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True
+    )
+
+    assert "serve" in proc.stdout
+    assert proc.stderr == "[]"
+
+
+def test_server_address_follows_runner_defaults():
+    wsgiref, cherrypy = wsgiref_server_runner, cherrypy_server_runner
+    assert server_address({}, wsgiref) == ("0.0.0.0", 8080)
+    assert server_address({"host": "127.0.0.1", "port": "5000"}, wsgiref) == (
+        "127.0.0.1",
+        5000,
+    )
+    assert server_address({"wsgiref.certfile": "cert.pem"}, wsgiref) == (
+        "0.0.0.0",
+        8080,
+    )
+    secure = {"wsgiref.certfile": "cert.pem", "wsgiref.keyfile": "key.pem"}
+    assert server_address(secure, wsgiref) == ("0.0.0.0", 4443)
+    assert server_address(secure, asyncio_server_runner) == ("0.0.0.0", 8080)
+
+    assert server_address({}, cherrypy) == ("127.0.0.1", 8080)
+    assert server_address({"host": "localhost:6543"}, cherrypy) == ("localhost", 6543)
+    assert server_address({"ssl_pem": "server.pem"}, cherrypy) == ("127.0.0.1", 4443)
+
+
+def test_restart_takes_over_listening_socket_through_control_socket(
+    tmp_path, monkeypatch
+):
+    listener = sockets.bind_socket("127.0.0.1", 0)
+    monkeypatch.setattr(sockets, "_inherited", [listener])
+    pid_file = str(tmp_path / "gearbox.pid")
+    cmd = ServeCommand(MagicMock(), argparse.Namespace(verbose_level=0))
+    server = cmd.start_control_server(pid_file)
+    assert server.path == str(tmp_path / "gearbox.sock")
+
+    try:
+        opts = argparse.Namespace(pid_file=pid_file)
+        assert cmd.take_over_listeners(opts) == os.getpid()
+        received = sockets.inherited_socket()
+        assert received.fileno() != listener.fileno()
+        assert received.getsockname() == listener.getsockname()
+
+        with pytest.raises(ValueError, match="Unknown command 'reload'"):
+            control.request(server.path, "reload")
+    finally:
+        server.close()
+        listener.close()
+        for sock in sockets.inherited_sockets():
+            sock.close()
+
+    assert not os.path.exists(server.path)
+    assert cmd.take_over_listeners(opts) is None
+
+
+def test_status_combines_the_request_stats_of_workers(tmp_path):
+    pid_file = str(tmp_path / "gearbox.pid")
+    cmd = ServeCommand(MagicMock(), argparse.Namespace(verbose_level=0))
+    cmd.started = time.time()
+    registries = [MetricsRegistry(), MetricsRegistry()]
+    for slot, registry in enumerate(registries):
+        for value in range(100 * (slot + 1)):
+            registry.stats().latency.record(1000 * (slot + 1))
+    stats_servers = [
+        cmd.start_stats_server(pid_file, slot, registry)
+        for slot, registry in enumerate(registries)
+    ]
+    workers = {
+        os.getpid() + slot: supervisor.Worker(slot, os.getpid())
+        for slot in range(len(registries))
+    }
+    server = cmd.start_control_server(
+        pid_file,
+        lambda: cmd.server_status(
+            MetricsRegistry(), MagicMock(workers=workers), pid_file
+        ),
+    )
+
+    try:
+        status, _ = control.request(server.path, "status")
+    finally:
+        server.close()
+        for stats_server in stats_servers:
+            stats_server.close()
+
+    assert status["pid"] == os.getpid()
+    assert status["uptime"] >= 0
+    assert [w["slot"] for w in status["workers"]] == [0, 1]
+    assert [w["requests"] for w in status["workers"]] == [100, 200]
+    assert status["requests"] == 300
+    assert status["in_flight"] == 0
+    assert abs(status["latency"]["p50"] - 0.002) < 0.00002
+    if sys.platform.startswith("linux"):
+        assert status["rss"] > 0
+
+
+def test_wsgiref_server_serves_from_inherited_socket(monkeypatch):
+    from wsgiref.simple_server import WSGIServer, make_server
+
+    listener = sockets.bind_socket("127.0.0.1", 0)
+    monkeypatch.setattr(sockets, "_inherited", [listener])
+
+    class Server(sockets.InheritedSocketMixIn, WSGIServer):
+        pass
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"inherited"]
+
+    # The configured port is ignored in favour of the inherited socket.
+    server = make_server("127.0.0.1", 1, app, server_class=Server)
+    port = listener.getsockname()[1]
+    assert server.server_port == port
+
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:%d/" % port, timeout=5) as r:
+            assert r.read() == b"inherited"
+    finally:
+        thread.join(5)
+        server.server_close()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_supervisor_respawns_and_stops_workers(tmp_path):
+    code = textwrap.dedent(
+        """
+        import os, sys, time
+        from gearbox.utils.supervisor import Supervisor
+
+        def target(slot):
+            with open(os.path.join(sys.argv[1], "%d-%d" % (slot, os.getpid())), "w"):
+                pass
+            while True:
+                time.sleep(0.05)
+
+        sys.exit(Supervisor(target, 2, print, graceful_timeout=5).run())
+        """
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code, str(tmp_path)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    def started(count):
+        deadline = time.monotonic() + 10
+        while len(os.listdir(tmp_path)) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return sorted(os.listdir(tmp_path))
+
+    try:
+        first = started(2)
+        assert [name.split("-")[0] for name in first] == ["0", "1"]
+
+        os.kill(int(first[0].split("-")[1]), 9)
+        respawned = set(started(3)) - set(first)
+        assert [name.split("-")[0] for name in respawned] == ["0"]
+    finally:
+        proc.terminate()
+        out, _ = proc.communicate(timeout=15)
+
+    assert proc.returncode == 0
+    assert "was killed by SIGKILL, respawning" in out
+    assert "Stopping 2 workers" in out
+
+
+def test_supervisor_recycles_workers_replacement_first(tmp_path):
+    code = textwrap.dedent(
+        """
+        import os, sys, time
+        from gearbox.utils.supervisor import Supervisor
+
+        def target(slot):
+            first = not os.listdir(sys.argv[1])
+            with open(os.path.join(sys.argv[1], str(os.getpid())), "w"):
+                pass
+            if first:
+                supervisor.request_recycle()
+            while True:
+                time.sleep(0.05)
+
+        supervisor = Supervisor(target, 1, print, graceful_timeout=5)
+        sys.exit(supervisor.run())
+        """
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code, str(tmp_path)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while len(os.listdir(tmp_path)) < 2 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        out, _ = proc.communicate(timeout=15)
+
+    first, second = sorted(os.listdir(tmp_path), key=lambda p: out.index(p))
+    assert "Recycling worker 0 (PID %s), it reached its maximum number" % first in out
+    assert out.index("Started worker 0 (PID %s)" % second) < out.index(
+        "Stopping 1 workers"
+    )
+    assert "respawning" not in out
+
+
+def test_supervisor_never_waits_for_workers_in_the_main_loop(monkeypatch):
+    messages = []
+    master = supervisor.Supervisor(None, 1, messages.append, graceful_timeout=0.2)
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+            "print(flush=True); time.sleep(30)",
+        ],
+        stdout=subprocess.PIPE,
+    )
+    proc.stdout.readline()
+    worker = master.workers[proc.pid] = supervisor.Worker(0, proc.pid)
+
+    started = time.monotonic()
+    master.stop_worker(worker)
+    assert time.monotonic() - started < 0.1
+    assert worker.retiring and proc.poll() is None
+    assert 0 < master._next_timeout() <= 0.2
+
+    master.check_deadlines()
+    assert proc.poll() is None
+    time.sleep(0.25)
+    master.check_deadlines()
+    assert proc.wait(5) == -9
+    assert messages == ["Worker 0 (PID %s) did not stop, killing" % proc.pid]
+
+    # Workers dying at startup are respawned later, not after a sleep.
+    spawned = []
+    monkeypatch.setattr(master, "spawn", spawned.append)
+    statuses = [(1234, 256), (0, 0)]
+    monkeypatch.setattr(supervisor.os, "waitpid", lambda *args: statuses.pop(0))
+    master.workers = {1234: supervisor.Worker(1, 1234)}
+    started = time.monotonic()
+    master.reap()
+    assert time.monotonic() - started < 0.1
+    assert spawned == [] and list(master._respawns) == [1]
+    master._respawns[1] = started
+    master.check_deadlines()
+    assert spawned == [1] and master._respawns == {}
+
+
+def test_supervisor_stops_all_workers_within_one_graceful_timeout():
+    messages = []
+    master = supervisor.Supervisor(None, 3, messages.append, graceful_timeout=0.3)
+    procs = []
+    for slot in range(3):
+        proc = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+                "print(flush=True); time.sleep(30)",
+            ],
+            stdout=subprocess.PIPE,
+        )
+        proc.stdout.readline()
+        master.workers[proc.pid] = supervisor.Worker(slot, proc.pid)
+        procs.append(proc)
+
+    started = time.monotonic()
+    master.stop_all()
+    elapsed = time.monotonic() - started
+
+    assert 0.3 <= elapsed < 0.6
+    assert master.workers == {}
+    for proc in procs:
+        # Killed and reaped by stop_all() already.
+        with pytest.raises(ProcessLookupError):
+            os.kill(proc.pid, 0)
+        proc.wait(5)
+    assert len(messages) == 3 and all("did not stop" in m for m in messages)
+
+
+def test_sigterm_is_deferred_while_serving_a_request(monkeypatch):
+    import signal
+
+    monkeypatch.setattr(supervisor, "_stop_requested", False)
+    previous = signal.signal(signal.SIGTERM, supervisor.terminate)
+    served = []
+    app = supervisor.RecycleMiddleware(
+        lambda environ, start_response: served.append(environ) or [],
+        2,
+        lambda: os.kill(os.getpid(), signal.SIGTERM),
+    )
+    try:
+        with pytest.raises(SystemExit):
+            with supervisor.serving_request():
+                app({}, None)
+                app({}, None)
+                served.append("response sent")
+    finally:
+        signal.signal(signal.SIGTERM, previous)
+
+    assert served == [{}, {}, "response sent"]
+
+
+def test_restart_policy_backs_off_and_gives_up_on_crash_loops():
+    now = [0.0]
+    policy = supervisor.RestartPolicy(
+        max_failures=4,
+        window=60,
+        initial_delay=0.5,
+        max_delay=1.5,
+        clock=lambda: now[0],
+    )
+
+    assert [policy.failed() for _ in range(3)] == [0.5, 1.0, 1.5]
+    now[0] = 61
+    # Failures older than the window are forgotten.
+    assert policy.failed() == 0.5
+    assert policy.recent_failures == 1
+    assert [policy.failed() for _ in range(3)] == [1.0, 1.5, None]
+    assert policy.restarts == 6
+
+
+@pytest.mark.parametrize(
+    "returncode, reason",
+    [
+        (0, "clean"),
+        (-15, "stopped"),
+        (-2, "stopped"),
+        (2, "fatal"),
+        (1, "crashed"),
+        (-9, "crashed"),
+    ],
+)
+def test_classify_exit(returncode, reason):
+    assert supervisor.classify_exit(returncode) == reason
+
+
+def test_is_project_file_excludes_virtualenvs_and_other_directories(tmp_path):
+    project = str(tmp_path / "project")
+    assert is_project_file(os.path.join(project, "app", "model.py"), project)
+    assert not is_project_file(
+        os.path.join(project, ".venv", "lib", "site-packages", "sqlalchemy.py"),
+        project,
+    )
+    assert not is_project_file(str(tmp_path / "project2" / "app.py"), project)
+    assert not is_project_file(str(tmp_path / "other.py"), project)
+
+
+@pytest.mark.skipif(not is_inotify_supported(), reason="inotify is not available")
+def test_inotify_monitor_coalesces_changes_of_watched_files(tmp_path):
+    watched = tmp_path / "app.py"
+    watched.write_text("VALUE = 1\n")
+    changes = []
+    reported = threading.Event()
+
+    def callback(path):
+        changes.append(path)
+        reported.set()
+
+    monitor = InotifyFileMonitor(callback)
+    monitor.add_path(str(watched))
+    monitor.start()
+    try:
+        (tmp_path / "other.py").write_text("ignored")
+        # Saved the way editors do: through a temporary file and a rename.
+        for value in range(3):
+            (tmp_path / "app.py.tmp").write_text("VALUE = %d\n" % value)
+            os.rename(tmp_path / "app.py.tmp", watched)
+        assert reported.wait(5)
+        time.sleep(0.2)
+    finally:
+        monitor.stop()
+        monitor.join()
+
+    assert changes == [str(watched)]
+
+
+def test_scoped_monitor_only_watches_project_and_config_files(tmp_path):
+    watched = []
+    inner = MagicMock(add_path=watched.append)
+    project = str(tmp_path / "project")
+    scoped = ScopedFileMonitor(inner, project)
+
+    for path in (
+        os.path.join(project, "app", "controllers.py"),
+        os.path.join(project, "venv", "lib", "site-packages", "tg", "__init__.py"),
+        "/usr/lib/python3/dist-packages/sqlalchemy/__init__.py",
+        "/etc/myapp/production.ini",
+    ):
+        scoped.add_path(path)
+
+    assert watched == [
+        os.path.join(project, "app", "controllers.py"),
+        "/etc/myapp/production.ini",
+    ]
+
+
+def test_config_files_follow_config_references_recursively(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    (tmp_path / "development.ini").write_text(
+        textwrap.dedent(
+            """
+            [server:main]
+            use = config:%(here)s/shared/server.ini
+
+            [app:main]
+            use = config:base.ini#main
+            debug = true
+            """
+        )
+    )
+    (tmp_path / "base.ini").write_text(
+        "[app:main]\nuse = config:shared/app.ini\nx = %(undefined)s\n"
+    )
+    (shared / "server.ini").write_text("[server:main]\nuse = egg:gearbox#wsgiref\n")
+    (shared / "app.ini").write_text(
+        "[app:main]\nuse = config:../development.ini\n"
+        "[filter:auth]\nuse = config:missing.ini\n"
+    )
+
+    files = configgraph.config_files(str(tmp_path / "development.ini"))
+    assert files == [
+        str(tmp_path / "development.ini"),
+        str(shared / "server.ini"),
+        str(tmp_path / "base.ini"),
+        str(shared / "app.ini"),
+        str(shared / "missing.ini"),
+    ]
+
+    with patch.object(configgraph, "_config_references") as references:
+        assert configgraph.config_files(str(tmp_path / "development.ini")) == files
+    assert not references.called
+
+    (shared / "missing.ini").write_text("[filter:auth]\nuse = config:auth.ini\n")
+    assert configgraph.config_files(str(tmp_path / "development.ini")) == files + [
+        str(shared / "auth.ini")
+    ]
+
+
+def test_zygote_preloads_third_party_modules_and_reloads_on_change(tmp_path):
+    project = tmp_path / "project"
+    site_packages = tmp_path / "site-packages"
+    children = tmp_path / "children"
+    for directory in (project, site_packages, children):
+        directory.mkdir()
+    (project / "projmod.py").write_text("VALUE = 1\n")
+    (site_packages / "thirdparty.py").write_text("VALUE = 2\n")
+    code = textwrap.dedent(
+        """
+        import os, sys, time
+        from hupper.polling import PollingFileMonitor
+        from gearbox.utils import zygote
+
+        def monitor_factory(callback, interval, logger):
+            return PollingFileMonitor(callback, interval=0.05)
+
+        status = zygote.Zygote(
+            monitor_factory, print, project_dir=sys.argv[1]
+        ).run()
+        if not zygote.is_child():
+            sys.exit(status)
+
+        preloaded = "thirdparty" in sys.modules
+        import projmod, thirdparty
+        zygote.report_loaded()
+        with open("%s-%d" % (os.getpid(), preloaded), "w"):
+            pass
+        while True:
+            time.sleep(0.05)
+        """
+    )
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join([str(project), str(site_packages)]),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code, str(project)],
+        cwd=str(children),
+        env=env,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    def started(count):
+        deadline = time.monotonic() + 10
+        while len(os.listdir(children)) < count and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return sorted(
+            os.listdir(children), key=lambda f: (children / f).stat().st_mtime
+        )
+
+    try:
+        first = started(1)
+        assert [name.split("-")[1] for name in first] == ["0"]
+
+        time.sleep(0.5)
+        (project / "projmod.py").write_text("VALUE = 3\n")
+        reloaded = started(2)
+        assert [name.split("-")[1] for name in reloaded] == ["0", "1"]
+    finally:
+        proc.terminate()
+        out, _ = proc.communicate(timeout=15)
+
+    assert proc.returncode == 0
+    assert "projmod.py changed; reloading..." in out
+
+
+@pytest.mark.parametrize("pidfd", [True, False], ids=["pidfd", "backoff"])
+def test_stop_process_escalates_to_sigkill(pidfd, monkeypatch):
+    if not pidfd:
+        monkeypatch.setattr(supervisor, "_pidfd_open", lambda pid: None)
+    code = textwrap.dedent(
+        """
+        import signal, sys, time
+        if sys.argv[1] == "ignore":
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        print("ready", flush=True)
+        time.sleep(30)
+        """
+    )
+
+    def start(mode):
+        proc = subprocess.Popen(
+            [sys.executable, "-c", code, mode], stdout=subprocess.PIPE, text=True
+        )
+        assert proc.stdout.readline() == "ready\n"
+        return proc
+
+    proc = start("exit")
+    elapsed, killed = supervisor.stop_process(proc.pid, timeout=5)
+    assert not killed
+    assert elapsed < 2
+    # Reaped by stop_process already.
+    assert supervisor.stop_process(proc.pid) == (0.0, False)
+
+    proc = start("ignore")
+    elapsed, killed = supervisor.stop_process(proc.pid, timeout=0.3)
+    assert killed
+    assert 0.3 <= elapsed < 2
+    assert supervisor.stop_process(proc.pid) == (0.0, False)
+
+
+def test_worker_pid_files_sit_next_to_the_server_pid_file(tmp_path):
+    pid_file = str(tmp_path / "gearbox.pid")
+    assert worker_pid_file(pid_file, 2) == str(tmp_path / "gearbox.2.pid")
+
+    for slot in (0, 2, 11):
+        (tmp_path / ("gearbox.%d.pid" % slot)).write_text("1")
+    (tmp_path / "gearbox.old.pid").write_text("1")
+
+    assert [slot for slot, _ in worker_pid_files(pid_file)] == [0, 2, 11]
+
+
+@pytest.mark.skipif(not hasattr(sockets.socket, "SO_REUSEPORT"), reason="Linux/BSD")
+def test_bind_socket_reuse_port_allows_one_socket_per_process():
+    first = sockets.bind_socket("127.0.0.1", 0, reuse_port=True)
+    port = first.getsockname()[1]
+    try:
+        second = sockets.bind_socket("127.0.0.1", port, reuse_port=True)
+        second.close()
+        with pytest.raises(OSError):
+            sockets.bind_socket("127.0.0.1", port).close()
+    finally:
+        first.close()
+
+
+def test_thread_pool_server_sheds_load_when_queue_is_full():
+    from wsgiref.simple_server import WSGIServer, make_server
+
+    release = threading.Event()
+    started = threading.Event()
+
+    def app(environ, start_response):
+        started.set()
+        release.wait(10)
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [b"served"]
+
+    class Server(ThreadPoolMixIn, WSGIServer):
+        pool_size = 1
+        max_queued = 1
+
+    server = make_server("127.0.0.1", 0, app, server_class=Server)
+    url = "http://127.0.0.1:%d/" % server.server_port
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}
+    )
+    thread.start()
+
+    results = []
+
+    def fetch():
+        try:
+            with urllib.request.urlopen(url, timeout=10) as r:
+                results.append(r.read())
+        except urllib.error.HTTPError as e:
+            results.append(e.code)
+
+    try:
+        busy = threading.Thread(target=fetch)
+        busy.start()
+        assert started.wait(5)
+        queued = threading.Thread(target=fetch)
+        queued.start()
+        while server._requests.empty():
+            time.sleep(0.01)
+
+        fetch()
+        assert results == [503]
+
+        release.set()
+        busy.join(5)
+        queued.join(5)
+        assert results == [503, b"served", b"served"]
+    finally:
+        release.set()
+        server.shutdown()
+        server.server_close()
+        thread.join(5)
+
+
+@pytest.fixture
+def keepalive_server():
+    from wsgiref.simple_server import WSGIServer, make_server
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        if environ["PATH_INFO"] == "/stream":
+            return (chunk for chunk in (b"str", b"eam"))
+        if environ["PATH_INFO"] == "/echo":
+            return [environ["wsgi.input"].read()]
+        return [environ["PATH_INFO"].encode("ascii")]
+
+    class Handler(KeepAliveWSGIRequestHandler):
+        max_requests = 3
+
+        def log_message(self, *args):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, WSGIServer, Handler)
+    thread = threading.Thread(
+        target=server.serve_forever, kwargs={"poll_interval": 0.05}
+    )
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join(5)
+
+
+def test_keepalive_handler_serves_requests_on_one_connection(keepalive_server):
+    conn = http.client.HTTPConnection("127.0.0.1", keepalive_server.server_port)
+    try:
+        conn.request("POST", "/first", body=b"unread body")
+        first = conn.getresponse()
+        assert first.read() == b"/first"
+        sock = conn.sock
+
+        conn.request("GET", "/stream")
+        second = conn.getresponse()
+        assert second.getheader("Transfer-Encoding") == "chunked"
+        assert second.read() == b"stream"
+        assert conn.sock is sock
+
+        conn.request("GET", "/last")
+        last = conn.getresponse()
+        assert last.getheader("Connection") == "close"
+        assert last.read() == b"/last"
+    finally:
+        conn.close()
+
+
+def test_keepalive_handler_answers_pipelined_requests_in_order(keepalive_server):
+    with socket.create_connection(("127.0.0.1", keepalive_server.server_port)) as s:
+        s.sendall(
+            b"GET /one HTTP/1.1\r\nHost: x\r\n\r\n"
+            b"GET /two HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+        )
+        data = b""
+        while chunk := s.recv(65536):
+            data += chunk
+
+    assert data.count(b"HTTP/1.1 200 OK") == 2
+    assert data.index(b"/one") < data.index(b"/two")
+
+
+def test_keepalive_handler_sends_100_continue_right_away(keepalive_server):
+    with socket.create_connection(("127.0.0.1", keepalive_server.server_port)) as s:
+        s.settimeout(2)
+        s.sendall(
+            b"POST /echo HTTP/1.1\r\nHost: x\r\nContent-Length: 4\r\n"
+            b"Expect: 100-continue\r\nConnection: close\r\n\r\n"
+        )
+        assert s.recv(65536) == b"HTTP/1.1 100 Continue\r\n\r\n"
+        s.sendall(b"body")
+        data = b""
+        while chunk := s.recv(65536):
+            data += chunk
+
+    assert data.startswith(b"HTTP/1.1 200 OK")
+    assert data.endswith(b"\r\n\r\nbody")
+
+
+@pytest.fixture
+def asyncio_server():
+    def app(environ, start_response):
+        if environ["PATH_INFO"] == "/error":
+            raise RuntimeError("failure")
+        body = environ["wsgi.input"].read()
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        if environ["PATH_INFO"] == "/stream":
+            return (chunk for chunk in (b"str", b"eam"))
+        return [environ["REQUEST_METHOD"].encode("ascii") + b" " + body]
+
+    server = AsyncioWSGIServer(app, "127.0.0.1", 0, threads=2)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    assert server.started.wait(5)
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        thread.join(5)
+
+
+def test_asyncio_server_serves_requests_on_persistent_connection(
+    asyncio_server, capsys
+):
+    conn = http.client.HTTPConnection("127.0.0.1", asyncio_server.server_port)
+    try:
+        conn.request("POST", "/", body=b"payload")
+        response = conn.getresponse()
+        assert response.getheader("Content-Length") == "12"
+        assert response.read() == b"POST payload"
+        sock = conn.sock
+
+        conn.request("GET", "/stream")
+        response = conn.getresponse()
+        assert response.getheader("Transfer-Encoding") == "chunked"
+        assert response.read() == b"stream"
+
+        conn.request("GET", "/error")
+        response = conn.getresponse()
+        assert response.status == 500
+        response.read()
+        assert conn.sock is sock
+    finally:
+        conn.close()
+    assert "RuntimeError: failure" in capsys.readouterr().err
+
+
+def test_asyncio_server_times_out_slow_request_bodies(asyncio_server):
+    asyncio_server.body_timeout = 0.2
+    with socket.create_connection(("127.0.0.1", asyncio_server.server_port)) as s:
+        s.sendall(b"POST / HTTP/1.1\r\nHost: x\r\nContent-Length: 10\r\n\r\nab")
+        s.settimeout(5)
+        response = s.recv(65536)
+        assert response.startswith(b"HTTP/1.1 408 Request Timeout\r\n")
+        while s.recv(65536):
+            pass
+
+    with socket.create_connection(("127.0.0.1", asyncio_server.server_port)) as s:
+        s.sendall(
+            b"POST / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"2\r\nab\r\n"
+        )
+        s.settimeout(5)
+        assert s.recv(65536).startswith(b"HTTP/1.1 408 Request Timeout\r\n")
+
+
+def test_asyncio_server_reads_chunked_and_pipelined_requests(asyncio_server):
+    with socket.create_connection(("127.0.0.1", asyncio_server.server_port)) as s:
+        s.sendall(
+            b"PUT / HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"3\r\nabc\r\n2\r\nde\r\n0\r\n\r\n"
+            b"GET / HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+        )
+        data = b""
+        while chunk := s.recv(65536):
+            data += chunk
+
+    assert data.count(b"HTTP/1.1 200 OK") == 2
+    assert data.index(b"PUT abcde") < data.index(b"GET ")
+    assert data.endswith(b"GET ")
+
+
+def test_asyncio_server_completes_requests_in_progress_on_sigterm():
+    code = textwrap.dedent(
+        """
+        import signal, threading, time
+        from gearbox.utils.aioserver import AsyncioWSGIServer
+        from gearbox.utils.supervisor import terminate
+
+        def app(environ, start_response):
+            print("serving", flush=True)
+            time.sleep(1.5)
+            start_response("200 OK", [("Content-Type", "text/plain")])
+            return [b"completed"]
+
+        signal.signal(signal.SIGTERM, terminate)
+        def announce():
+            server.started.wait()
+            print(server.server_port, flush=True)
+
+        server = AsyncioWSGIServer(app, "127.0.0.1", 0, graceful_timeout=5)
+        threading.Thread(target=announce, daemon=True).start()
+        server.serve_forever()
+        print("stopped", flush=True)
+        """
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-c", code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        port = int(proc.stdout.readline())
+        idle = socket.create_connection(("127.0.0.1", port))
+        with socket.create_connection(("127.0.0.1", port)) as s:
+            s.sendall(b"GET / HTTP/1.1\r\nHost: x\r\n\r\n")
+            assert proc.stdout.readline() == "serving\n"
+            proc.terminate()
+            data = b""
+            while chunk := s.recv(65536):
+                data += chunk
+        # Idle connections are closed without waiting for their timeout.
+        idle.settimeout(5)
+        assert idle.recv(1) == b""
+        idle.close()
+        out, err = proc.communicate(timeout=10)
+    finally:
+        proc.kill()
+
+    assert data.startswith(b"HTTP/1.1 200 OK")
+    assert b"Connection: close" in data and data.endswith(b"completed")
+    assert out == "stopped\n"
+    assert proc.returncode == 0, err
+
+
+def test_file_wrapper_iterates_files_from_their_position(tmp_path):
+    import io
+
+    path = tmp_path / "data.bin"
+    path.write_bytes(bytes(range(256)) * 40)
+    with open(path, "rb") as f:
+        f.seek(100)
+        wrapper = FileWrapper(f, blksize=4096)
+        assert wrapper.fileno() == f.fileno()
+        assert b"".join(wrapper) == path.read_bytes()[100:]
+
+    wrapper = FileWrapper(io.BytesIO(b"in memory"), blksize=4)
+    assert wrapper.fileno() is None
+    assert list(wrapper) == [b"in m", b"emor", b"y"]
+
+
+@pytest.mark.parametrize(
+    "handler_class", [GearboxWSGIRequestHandler, KeepAliveWSGIRequestHandler]
+)
+def test_wsgiref_handlers_send_file_wrapper_with_sendfile(tmp_path, handler_class):
+    from wsgiref.simple_server import WSGIServer, make_server
+
+    path = tmp_path / "download.bin"
+    path.write_bytes(os.urandom(300000))
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/octet-stream")])
+        return environ["wsgi.file_wrapper"](open(path, "rb"))
+
+    class Handler(handler_class):
+        def log_message(self, *args):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, WSGIServer, Handler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    try:
+        real_sendfile = socket.socket.sendfile
+        with patch.object(
+            socket.socket, "sendfile", autospec=True, side_effect=real_sendfile
+        ) as sendfile:
+            url = "http://127.0.0.1:%d/" % server.server_port
+            with urllib.request.urlopen(url, timeout=5) as r:
+                assert r.headers["Content-Length"] == "300000"
+                assert r.read() == path.read_bytes()
+        sendfile.assert_called_once()
+    finally:
+        thread.join(5)
+        server.server_close()
+
+
+def test_asyncio_server_sends_file_wrapper_responses(tmp_path):
+    path = tmp_path / "download.bin"
+    path.write_bytes(os.urandom(300000))
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/octet-stream")])
+        f = open(path, "rb")
+        f.seek(1000)
+        return environ["wsgi.file_wrapper"](f)
+
+    server = AsyncioWSGIServer(app, "127.0.0.1", 0, threads=1)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    assert server.started.wait(5)
+    try:
+        url = "http://127.0.0.1:%d/" % server.server_port
+        with urllib.request.urlopen(url, timeout=5) as r:
+            assert r.headers["Content-Length"] == "299000"
+            assert r.read() == path.read_bytes()[1000:]
+    finally:
+        server.shutdown()
+        thread.join(5)
+
+
+def test_latency_histogram_quantiles_are_within_one_percent():
+    histogram = LatencyHistogram()
+    for value in range(1, 100001):
+        histogram.record(value)
+
+    assert histogram.count == 100000
+    assert abs(histogram.quantile(0.5) - 50000) < 500
+    assert abs(histogram.quantile(0.99) - 99000) < 990
+    assert abs(histogram.count_below(25000) - 25000) < 250
+
+
+def test_metrics_middleware_records_requests_per_thread(tmp_path):
+    from wsgiref.util import setup_testing_defaults
+
+    def app(environ, start_response):
+        if environ["PATH_INFO"] == "/missing":
+            start_response("404 Not Found", [])
+            return [b"not found"]
+        if environ["PATH_INFO"] == "/file":
+            start_response("200 OK", [("Content-Length", "4")])
+            return environ["wsgi.file_wrapper"](open(tmp_path / "file", "rb"))
+        start_response("200 OK", [])
+        return [b"hello", b"world"]
+
+    (tmp_path / "file").write_bytes(b"data")
+    registry = MetricsRegistry()
+    wrapped = MetricsMiddleware(app, registry)
+
+    def request(path):
+        environ = {"PATH_INFO": path, "wsgi.file_wrapper": FileWrapper}
+        setup_testing_defaults(environ)
+        result = wrapped(environ, lambda status, headers, exc_info=None: None)
+        body = b"" if isinstance(result, FileWrapper) else b"".join(result)
+        result.close()
+        return body
+
+    assert request("/") == b"helloworld"
+    thread = threading.Thread(target=request, args=("/missing",))
+    thread.start()
+    thread.join()
+    request("/file")
+
+    stats = registry.snapshot()
+    assert stats.statuses["2xx"] == 2
+    assert stats.statuses["4xx"] == 1
+    assert stats.bytes_out == 10 + 9 + 4
+    assert stats.in_flight == 0
+    assert stats.latency.count == 3
+
+
+def test_request_stats_round_trip_through_json():
+    stats = RequestStats()
+    for value in (5, 500, 50000, 10**9):
+        stats.latency.record(value)
+    stats.in_flight = 2
+    stats.statuses["2xx"] = 4
+
+    received = RequestStats.from_dict(json.loads(json.dumps(stats.to_dict())))
+
+    assert received.latency.counts == stats.latency.counts
+    assert received.latency.quantile(0.5) == stats.latency.quantile(0.5)
+    assert (received.in_flight, received.statuses) == (2, stats.statuses)
+
+
+def test_metrics_endpoint_serves_prometheus_text(tmp_path):
+    registry = MetricsRegistry(restarts=2)
+    registry.stats().statuses["2xx"] += 3
+    registry.stats().latency.record(2000)
+
+    path = str(tmp_path / "metrics.sock")
+    server = serve_metrics(registry, "unix:" + path)
+    try:
+        with socket.socket(socket.AF_UNIX) as s:
+            s.connect(path)
+            s.sendall(b"GET /metrics HTTP/1.0\r\n\r\n")
+            data = b""
+            while chunk := s.recv(65536):
+                data += chunk
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    text = data.decode("utf-8")
+    assert text.startswith("HTTP/1.0 200")
+    assert 'gearbox_requests_total{status="2xx"} 3' in text
+    assert 'gearbox_request_duration_seconds_bucket{le="0.005"} 1' in text
+    assert "gearbox_request_duration_seconds_count 1" in text
+    assert "gearbox_restarts_total 2" in text
+
+
+def test_metrics_endpoint_waits_for_its_address_to_be_released():
+    previous = socket.socket()
+    previous.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    previous.bind(("127.0.0.1", 0))
+    previous.listen()
+    port = previous.getsockname()[1]
+
+    with pytest.raises(OSError):
+        serve_metrics(MetricsRegistry(), "127.0.0.1:%d" % port)
+    server = serve_metrics(MetricsRegistry(), "127.0.0.1:%d" % port, bind_timeout=5)
+    try:
+        assert not server.bound
+        previous.close()
+        url = "http://127.0.0.1:%d/metrics" % port
+        deadline = time.monotonic() + 5
+        while not server.bound and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with urllib.request.urlopen(url, timeout=5) as r:
+            assert b"gearbox_restarts_total 0" in r.read()
+        if hasattr(socket, "SO_REUSEPORT"):
+            reuse_port = socket.SO_REUSEPORT
+            assert not server.socket.getsockopt(socket.SOL_SOCKET, reuse_port)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_profiler_samples_stacks_per_request_and_dumps_pstats(tmp_path):
+    import pstats
+    from wsgiref.util import setup_testing_defaults
+
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow_view():
+        entered.set()
+        release.wait(5)
+
+    def app(environ, start_response):
+        slow_view()
+        start_response("200 OK", [])
+        return [b"done"]
+
+    sampler = SamplingProfiler(rate=1000, output_dir=str(tmp_path))
+    wrapped = ProfilerMiddleware(app, sampler, str(tmp_path / "pstats"))
+
+    def request():
+        environ = {"PATH_INFO": "/slow", "HTTP_X_GEARBOX_PROFILE": "1"}
+        setup_testing_defaults(environ)
+        result = wrapped(environ, lambda status, headers, exc_info=None: None)
+        b"".join(result)
+        result.close()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    assert entered.wait(5)
+    sampler.sample()
+    release.set()
+    thread.join(5)
+    sampler.sample()
+
+    assert sampler.requests == {}
+    with open(sampler.write()) as f:
+        (line,) = f.read().splitlines()
+    stack, count = line.rsplit(" ", 1)
+    assert stack.startswith("GET /slow;")
+    assert any(frame.startswith("slow_view (") for frame in stack.split(";"))
+    assert count == "1"
+
+    (dump,) = (tmp_path / "pstats").iterdir()
+    assert dump.name.endswith("-GET_slow.pstats")
+    functions = {func[2] for func in pstats.Stats(str(dump)).stats}
+    assert "slow_view" in functions
+
+
+def test_profiler_profiles_one_request_at_a_time(tmp_path):
+    from wsgiref.util import setup_testing_defaults
+
+    entered = threading.Event()
+    release = threading.Event()
+
+    def app(environ, start_response):
+        if environ["PATH_INFO"] == "/slow":
+            entered.set()
+            release.wait(5)
+        start_response("200 OK", [])
+        return [environ["PATH_INFO"].encode()]
+
+    sampler = SamplingProfiler(output_dir=str(tmp_path))
+    wrapped = ProfilerMiddleware(app, sampler, str(tmp_path / "pstats"))
+    bodies = {}
+
+    def request(path):
+        environ = {"PATH_INFO": path, "HTTP_X_GEARBOX_PROFILE": "1"}
+        setup_testing_defaults(environ)
+        result = wrapped(environ, lambda status, headers, exc_info=None: None)
+        bodies[path] = b"".join(result)
+        result.close()
+
+    thread = threading.Thread(target=request, args=("/slow",))
+    thread.start()
+    assert entered.wait(5)
+    request("/fast")
+    release.set()
+    thread.join(5)
+
+    assert bodies == {"/slow": b"/slow", "/fast": b"/fast"}
+    (dump,) = (tmp_path / "pstats").iterdir()
+    assert dump.name.endswith("-GET_slow.pstats")
+
+    request("/fast")
+    assert len(list((tmp_path / "pstats").iterdir())) == 2